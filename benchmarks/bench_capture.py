@@ -0,0 +1,66 @@
+"""
+compares the scapy dissection path and the raw offset parser of NetworkCollector
+(packets/sec through the flow table), and checks both produce identical Netflow counters
+
+usage: python bench_capture.py [pcap_path] [n_packets]
+"""
+import os
+import sys
+import tempfile
+from common import use_endpoint, synthetic_packets, write_pcap, measure
+use_endpoint()
+from scapy.all import PcapReader
+from cygnet_modules.networkcapture import NetworkCollector
+from cygnet_modules.flowtable import FlowTable
+
+def new_table():
+    #no expiry - every flow stays in the table so the counters can be compared
+    return FlowTable(idle_timeout=None, active_timeout=None, max_flows=None)
+
+def run_scapy(pcap_path):
+    flows = new_table()
+    collector = NetworkCollector(bpf_filter=None, network_flows=flows)
+    with PcapReader(pcap_path) as reader:
+        for pkt in reader:
+            collector.process_packet(pkt)
+    return flows
+
+def run_raw(pcap_path):
+    flows = new_table()
+    collector = NetworkCollector(bpf_filter=None, network_flows=flows)
+    collector.replay(pcap_path, flush=False)
+    return flows
+
+def counters(flows):
+    return {key: flow.counters() for key, flow in flows.items()}
+
+def main(pcap_path=None, n_packets=20000):
+    tmp = None
+    if pcap_path is None:
+        tmp = tempfile.NamedTemporaryFile(suffix='.pcap', delete=False)
+        tmp.close()
+        pcap_path = tmp.name
+        write_pcap(pcap_path, synthetic_packets(n_packets))
+    try:
+        results = {}
+        for name, run in (('scapy', run_scapy), ('raw', run_raw)):
+            flows = {}
+            def job():
+                flows.clear()
+                flows.update(run(pcap_path).items())
+            elapsed = measure(job, repeat=3)
+            results[name] = (elapsed, counters(flows))
+        n = sum(c[0]+c[1] for c in results['raw'][1].values())
+        for name, (elapsed, _) in results.items():
+            print(f"{name:>6}: {n/elapsed:12.0f} packets/sec ({elapsed:.3f}s for {n} packets)")
+        print(f"speedup: {results['scapy'][0]/results['raw'][0]:.1f}x")
+        identical = results['scapy'][1] == results['raw'][1]
+        print(f"identical flow counters: {identical}")
+        return 0 if identical else 1
+    finally:
+        if tmp is not None:
+            os.unlink(pcap_path)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    sys.exit(main(args[0] if args and args[0] else None, int(args[1]) if len(args) > 1 else 20000))
@@ -0,0 +1,77 @@
+"""
+compares the session ciphers of CygCrypt - the original per-message Fernet construction,
+a cached Fernet, AES-GCM and ChaCha20-Poly1305 (counter nonces, raw binary) - in messages/sec,
+MB/sec and ciphertext size, for a single alert, a batch frame of alerts and a large frame
+
+usage: python bench_crypto.py
+"""
+import base64
+import json
+import sys
+import time
+from common import use_endpoint
+use_endpoint()
+from cryptography.fernet import Fernet
+from cygnet_modules.encryption import CygCrypt, FERNET, AES_GCM, CHACHA20_POLY1305
+
+SIZES = {
+    'single alert': 1,
+    'batch of 32': 32,
+    'batch of 512': 512,
+}
+N_BYTES = 8*1024*1024 #bytes encrypted (and decrypted) per measurement
+
+class PerMessageFernet:
+    #the previous CygCrypt path - a new Fernet object (and base64 key) per message
+    def __init__(self, key):
+        self._key = key
+
+    def encrypt(self, data):
+        return Fernet(base64.urlsafe_b64encode(self._key)).encrypt(data)
+
+    def decrypt(self, token):
+        return Fernet(base64.urlsafe_b64encode(self._key)).decrypt(token)
+
+def pair(cipher):
+    a, b = CygCrypt(), CygCrypt()
+    a.generate_keys()
+    b.generate_keys()
+    a.shared_secret(b.serialised_public_key(), cipher, initiator=True)
+    b.shared_secret(a.serialised_public_key(), cipher, initiator=False)
+    return a, b
+
+def payload(n_alerts):
+    alerts = [f"10.0.0.5:{1024+i}-93.184.216.{i % 250}:443" for i in range(n_alerts)]
+    return json.dumps(alerts).encode()
+
+def measure(sender, receiver, data):
+    n = max(1, N_BYTES//len(data))
+    start = time.perf_counter()
+    tokens = [sender.encrypt(data) for _ in range(n)]
+    encrypt_time = time.perf_counter()-start
+    start = time.perf_counter()
+    for token in tokens:
+        receiver.decrypt(token)
+    decrypt_time = time.perf_counter()-start
+    return n/encrypt_time, n/decrypt_time, len(tokens[0])
+
+def main():
+    fernet_a, fernet_b = pair(FERNET)
+    ciphers = {
+        'fernet (per message)': (PerMessageFernet(fernet_a._encryption_key), PerMessageFernet(fernet_b._encryption_key)),
+        'fernet (cached)': (fernet_a, fernet_b),
+        'aes-gcm': pair(AES_GCM),
+        'chacha20-poly1305': pair(CHACHA20_POLY1305),
+    }
+    for size_name, n_alerts in SIZES.items():
+        data = payload(n_alerts)
+        print(f"{size_name} ({len(data)} bytes):")
+        for name, (sender, receiver) in ciphers.items():
+            encrypt_rate, decrypt_rate, size = measure(sender, receiver, data)
+            print(f"  {name:22s} encrypt {encrypt_rate:9.0f} msg/s ({encrypt_rate*len(data)/1e6:7.1f} MB/s)   "
+                  f"decrypt {decrypt_rate:9.0f} msg/s ({decrypt_rate*len(data)/1e6:7.1f} MB/s)   "
+                  f"{size} bytes (x{size/len(data):.2f})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
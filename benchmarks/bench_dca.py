@@ -0,0 +1,91 @@
+"""
+compares the array-backed DC population (immune.DCPopulation) with a list of DC objects
+(the previous per-cell implementation)
+for whole-population signal updates at several population sizes, and measures the DCA's
+end-to-end antigens/sec with a constant signal extractor
+
+usage: python bench_dca.py
+"""
+import queue
+import sys
+import time
+import numpy as np
+from common import use_endpoint
+use_endpoint()
+from cygnet_modules import immune
+
+POPULATION_SIZES = [5, 1000, 5000]
+MIGRATION_RANGE = (5, 15)
+CSM_WEIGHTS = [2, 2]
+K_WEIGHTS = [2, -2]
+
+class ListDC:
+    #the previous per-cell DC: its own signal/output vectors, updated one cell at a time
+    def __init__(self, migration_threshold, max_antigens, csm_weights, k_weights, in_signal=2):
+        self._migration_threshold = migration_threshold
+        self._max_antigens = max_antigens
+        self._weights = np.array([csm_weights[0:in_signal], k_weights[0:in_signal]])
+        self._in_signal = in_signal
+        self._signals = np.zeros(shape=in_signal, dtype=np.float64)
+        self._output_signals = np.zeros(shape=2, dtype=np.float64)
+
+    def signal_update(self, signal_vector):
+        self._signals = self._signals+signal_vector
+        self._output_signals = self._weights.dot(self._signals)
+
+    def should_migrate(self):
+        return self._output_signals[0]>=self._migration_threshold
+
+    def reset(self):
+        self._signals = np.zeros(shape=self._in_signal, dtype=np.float64)
+        self._output_signals = np.zeros(shape=2, dtype=np.float64)
+
+def list_population(size):
+    return [ListDC(np.random.uniform(*MIGRATION_RANGE), 5, CSM_WEIGHTS, K_WEIGHTS) for _ in range(size)]
+
+def updates_per_sec(update, n_updates):
+    signals = np.array([0.1, 0.05])
+    start = time.perf_counter()
+    for _ in range(n_updates):
+        update(signals)
+    return n_updates/(time.perf_counter()-start)
+
+def main():
+    for size in POPULATION_SIZES:
+        cells = list_population(size)
+        def update_list(signals):
+            for cell in cells:
+                cell.signal_update(signals)
+                if cell.should_migrate():
+                    cell.reset()
+        population = immune.DCPopulation.random(size, MIGRATION_RANGE, 5, CSM_WEIGHTS, K_WEIGHTS)
+        def update_population(signals):
+            migrating = population.signal_update_all(signals)
+            population.reset(migrating)
+        n_updates = max(20, 200000//size)
+        print(f"population {size:5d}: list of DCs {updates_per_sec(update_list, n_updates):10.0f} updates/sec, "
+              f"DCPopulation {updates_per_sec(update_population, n_updates):10.0f} updates/sec")
+    for size in POPULATION_SIZES:
+        n_antigens = 50000
+        input_queue = queue.Queue()
+        output_queue = queue.Queue()
+        data = np.zeros((1, 8))
+        for i in range(n_antigens):
+            input_queue.put((i, data))
+        input_queue.put(None)
+        def constant_signals(batch):
+            return np.full((len(batch), 2), [0.5, 0.1])
+        constant_signals.n_signals = 2
+        dca = immune.DCA(input_queue, output_queue, population_size=size, migration_range=MIGRATION_RANGE,
+                         max_antigens=5, csm_weights=CSM_WEIGHTS, k_weights=K_WEIGHTS, segment_size=20,
+                         signal_extractor=immune.SignalExtractor([constant_signals], batch_funcs=[constant_signals]),
+                         batch_size=64)
+        start = time.perf_counter()
+        dca.start()
+        elapsed = time.perf_counter()-start
+        print(f"DCA population {size:5d}: {n_antigens/elapsed:10.0f} antigens/sec, "
+              f"{output_queue.qsize()} migrations")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
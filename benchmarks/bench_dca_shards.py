@@ -0,0 +1,106 @@
+"""
+scaling of the sharded DCA: flow updates are routed to K DCA worker processes by
+flowkey.key_shard (as NetworkCollector does with a list of queues), every worker extracting
+the signals with the fused numpy autoencoders and running its own DC population.
+reports updates/sec at 1, 2, 4 and 8 workers, and checks that every flow's signal
+sequence is the same as with a single worker
+
+usage: python bench_dca_shards.py [n_updates]
+"""
+import multiprocessing
+import queue
+import sys
+import time
+import numpy as np
+from common import use_endpoint, ENDPOINT_DIR
+use_endpoint()
+from cygnet_modules import immune, flowkey
+from cygnet_modules.models import ModelRegistry, NUMPY_BACKEND
+
+WORKERS = [1, 2, 4, 8]
+N_FLOWS = 5000
+MODELS = ModelRegistry({'pamp': ENDPOINT_DIR+"/assets/models/dae3_benign.npz",
+                        'safe': ENDPOINT_DIR+"/assets/models/dae3_malicious.npz"},
+                       backend=NUMPY_BACKEND)
+
+def pamp_safe(data):
+    return MODELS.get_fused(['pamp', 'safe'])(data)
+pamp_safe.n_signals = 2
+
+def make_dca(input_queue, output_queue, dca_class=immune.DCA):
+    return dca_class(input_queue, output_queue, population_size=5, migration_range=(5, 15),
+                     max_antigens=5, csm_weights=[2, 2], k_weights=[2, -2], segment_size=20,
+                     signal_extractor=immune.SignalExtractor([pamp_safe], batch_funcs=[pamp_safe]),
+                     batch_size=64, batch_timeout_ms=5)
+
+def updates(n, seed=5):
+    rng = np.random.default_rng(seed)
+    keys = [flowkey.make_key(0x0A000005, 1024+i, 0xC0A80001+i % 7, 443, 6) for i in range(N_FLOWS)]
+    rows = np.concatenate([rng.normal(size=(n, 6)), np.eye(2)[rng.integers(0, 2, n)]], axis=1)
+    return [(keys[i], rows[j:j+1]) for j, i in enumerate(rng.integers(0, N_FLOWS, n))]
+
+def run_worker(input_queue, output_queue):
+    make_dca(input_queue, output_queue).start()
+
+def updates_per_sec(n_workers, data):
+    inputs = [multiprocessing.Queue() for _ in range(n_workers)]
+    output = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=run_worker, args=(q, output)) for q in inputs]
+    for worker in workers:
+        worker.start()
+    time.sleep(0.5) #workers loading their models
+    start = time.perf_counter()
+    for update in data:
+        inputs[flowkey.key_shard(update[0], n_workers)].put(update)
+    for q in inputs:
+        q.put(None)
+    migrations = 0
+    while any(worker.is_alive() for worker in workers) or not output.empty():
+        try:
+            output.get(timeout=0.05)
+            migrations += 1
+        except queue.Empty:
+            pass
+    elapsed = time.perf_counter()-start
+    for worker in workers:
+        worker.join()
+    return len(data)/elapsed, migrations
+
+class RecordingDCA(immune.DCA):
+    #records every flow's signals, in the order the worker processed them
+    def start(self, *args, **kwargs):
+        self.signals = {}
+        super().start(*args, **kwargs)
+
+    def process_antigen(self, key, signals, stamp=0.0):
+        self.signals.setdefault(key, []).append(signals.copy())
+        super().process_antigen(key, signals, stamp)
+
+def per_flow_signals(n_workers, data):
+    inputs = [queue.Queue() for _ in range(n_workers)]
+    for update in data:
+        inputs[flowkey.key_shard(update[0], n_workers)].put(update)
+    signals = {}
+    for q in inputs:
+        q.put(None)
+        dca = make_dca(q, queue.Queue(), RecordingDCA)
+        dca.start()
+        signals.update(dca.signals)
+    return signals
+
+def main():
+    n_updates = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    data = updates(n_updates)
+    expected = per_flow_signals(1, data[:20000])
+    for n_workers in WORKERS[1:]:
+        sharded = per_flow_signals(n_workers, data[:20000])
+        same = sharded.keys() == expected.keys() and all(
+            np.array_equal(np.array(sharded[key]), np.array(expected[key])) for key in expected)
+        print(f"workers={n_workers}: per flow signals {'match' if same else 'MISMATCH'} the single worker's")
+    for n_workers in WORKERS:
+        rate, migrations = updates_per_sec(n_workers, data)
+        print(f"workers={n_workers}: {rate:10.0f} updates/sec, {migrations} migrations")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""
+runs synthetic traffic through NetworkCollector under several emission policies and
+reports the emitted/suppressed flow updates (the DCA's inference load), final states
+and packets/sec
+
+usage: python bench_emission.py [n_packets]
+"""
+import os
+import sys
+import tempfile
+from common import use_endpoint, synthetic_packets, write_pcap, measure
+use_endpoint()
+from cygnet_modules.networkcapture import NetworkCollector
+from cygnet_modules.flowtable import FlowTable
+from cygnet_modules.emission import EmissionPolicy
+
+POLICIES = {
+    'every packet': {},
+    'every 8th packet': {'every_n': 8},
+    'once per 100ms': {'min_interval_ms': 100},
+    'delta > 5%': {'min_delta': 0.05},
+    'every 4th, 50ms, 5%': {'every_n': 4, 'min_interval_ms': 50, 'min_delta': 0.05},
+}
+
+class Counter:
+    #stands in for the DCA queue
+    def __init__(self):
+        self.n = 0
+
+    def put(self, update):
+        self.n += 1
+
+def run(pcap_path, policy):
+    collector = NetworkCollector(bpf_filter=None, network_flows=FlowTable(), stdout=Counter(),
+                                 emission=EmissionPolicy(**policy))
+    collector.replay(pcap_path)
+    return collector.stats()
+
+def main(n_packets=200000):
+    tmp = tempfile.NamedTemporaryFile(suffix='.pcap', delete=False)
+    tmp.close()
+    try:
+        write_pcap(tmp.name, synthetic_packets(n_packets, rate=2000.0))
+        for name, policy in POLICIES.items():
+            stats = {}
+            elapsed = measure(lambda: stats.update(run(tmp.name, policy)), repeat=3)
+            emission = stats['emission']
+            print(f"{name:>20}: {emission['emitted']:7d} emitted, {emission['suppressed']:7d} suppressed "
+                  f"({emission['suppressed_ratio']:.0%}), {emission['final']:5d} final, "
+                  f"{stats['packets']/elapsed:9.0f} packets/sec")
+    finally:
+        os.unlink(tmp.name)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000))
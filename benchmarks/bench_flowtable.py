@@ -0,0 +1,87 @@
+"""
+memory per tracked flow and update throughput of the columnar FlowTable, compared with
+the previous layout (one Python object with a per-instance __dict__ per flow)
+
+usage: python bench_flowtable.py [n_flows]
+"""
+import sys
+import time
+import tracemalloc
+from common import use_endpoint
+use_endpoint()
+from cygnet_modules.netflow import PacketInfo
+from cygnet_modules.flowtable import FlowTable
+from cygnet_modules import flowkey
+
+class DictNetflow:
+    """the previous Netflow layout - plain attributes in a per-instance __dict__"""
+    def __init__(self, sip, dip, sport, dport, stime, proto, ibytes, packet_size, key):
+        self._sip = sip
+        self._dip = dip
+        self._sport = sport
+        self._dport = dport
+        self._key = key
+        self._stime = stime
+        self._ltime = stime
+        self._tcp_state = 0
+        self._proto = proto
+        self._spkts = 1
+        self._dpkts = 0
+        self._sbytes = ibytes
+        self._dbytes = 0
+        self._spkts_size = packet_size
+        self._dpkts_size = 0
+        self._smean = packet_size
+        self._dmean = 0
+
+def packets(n_flows):
+    base = flowkey.ip_to_int("10.0.0.5")
+    for i in range(n_flows):
+        yield PacketInfo(base, 0x08000000+i*7919, 1024+i % 60000, 443, flowkey.PROTO_TCP,
+                         60+i % 1400, 46+i % 1400, 1.7e9+i*1e-4, 0x18)
+
+def measure_memory(build, n_flows):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    table = build(n_flows)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after-before)/n_flows, table
+
+def build_columnar(n_flows):
+    table = FlowTable(idle_timeout=None, active_timeout=None, max_flows=None)
+    for info in packets(n_flows):
+        table.insert(flowkey.make_key(info.sip, info.sport, info.dip, info.dport, info.proto), info)
+    return table
+
+def build_dicts(n_flows):
+    table = {}
+    for info in packets(n_flows):
+        key = flowkey.make_key(info.sip, info.sport, info.dip, info.dport, info.proto)
+        table[key] = DictNetflow(info.sip, info.dip, info.sport, info.dport, info.time,
+                                 'TCP', info.payload_size, info.size, key)
+    return table
+
+def main(n_flows=100000):
+    columnar, table = measure_memory(build_columnar, n_flows)
+    legacy, _ = measure_memory(build_dicts, n_flows)
+    store = table.get_store()
+    print(f"memory per flow: columnar {columnar:.0f} B, per-object {legacy:.0f} B "
+          f"({legacy/columnar:.1f}x less)")
+    print(f"  columnar flow state (store columns): {store.nbytes()/n_flows:.0f} B, "
+          f"key->slot index: {columnar-store.nbytes()/n_flows:.0f} B")
+    infos = list(packets(n_flows))
+    slots = list(table.slots())
+    start = time.perf_counter()
+    for slot, info in zip(slots, infos):
+        store.update(slot, info)
+    elapsed = time.perf_counter()-start
+    print(f"store.update: {n_flows/elapsed:.0f} updates/sec")
+    start = time.perf_counter()
+    keys, rows = table.feature_rows()
+    elapsed = time.perf_counter()-start
+    print(f"feature_rows: {rows.shape} in {elapsed*1e3:.2f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(*(int(a) for a in sys.argv[1:2])))
@@ -0,0 +1,116 @@
+"""
+handshakes/sec of the endpoint's connection setup (authentication + key agreement) per
+mode - a full DH group 14 exchange, a full X25519 exchange and a resumed session (ticket
+from the previous connection, no key exchange). the real Client connects to a real
+AlertServer (in-memory configuration, no smtp) in a separate process over TCP, from
+--concurrency threads at once (many endpoints reconnecting after a server restart),
+and the server's CPU time per handshake is reported with the rate
+
+usage: python bench_handshake.py [--handshakes 200] [--concurrency 1]
+"""
+import argparse
+import subprocess
+import sys
+import threading
+import time
+from common import use_endpoint, use_server
+
+COMPANY_HASH = "cygnet:localhost:8000"
+MODES = ('dh-group14', 'x25519', 'resumed')
+
+def serve():
+    #server process - prints its port, serves until stdin closes, then prints its CPU seconds
+    use_server()
+    import socket
+    import alertserver
+    sys.stdout = sys.__stdout__
+    from cygnet_modules.encryption import SessionTickets
+    from cygnet_modules.encryption import AESGCM
+
+    class BenchAlertServer(alertserver.AlertServer):
+        def get_config(self):
+            return {'company_hash': COMPANY_HASH, 'admins': []}
+
+    server = BenchAlertServer("127.0.0.1", 0, None, tickets=SessionTickets(AESGCM.generate_key(bit_length=256)))
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(512)
+
+    def accept():
+        while True:
+            client_socket, client_address = listener.accept()
+            threading.Thread(target=server.handle_client, args=(client_socket, client_address),
+                             daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    start = time.process_time()
+    print(listener.getsockname()[1], flush=True)
+    sys.stdin.read()
+    print(time.process_time()-start, flush=True)
+    return 0
+
+def run_mode(mode, port, n_handshakes, concurrency):
+    #n_handshakes connection setups (connect + disconnect) split over the threads
+    use_endpoint()
+    from cygnet_modules.client import Client
+    from cygnet_modules.encryption import X25519, DH_GROUP14
+
+    def new_client():
+        return Client(address="127.0.0.1", server_host="127.0.0.1", server_port=port, name="bench",
+                      company_hash=COMPANY_HASH, alert_queue=None,
+                      key_exchange=DH_GROUP14 if mode == 'dh-group14' else X25519)
+
+    failures = []
+    def worker(n):
+        client = new_client()
+        if mode == 'resumed':
+            #the first (full) handshake gets the ticket the others resume
+            client.connect()
+            client.disconnect()
+        barrier.wait()
+        for _ in range(n):
+            if mode != 'resumed':
+                client = new_client()
+            if not client.connect():
+                failures.append(mode)
+            client.disconnect()
+
+    barrier = threading.Barrier(concurrency+1)
+    per_thread = n_handshakes//concurrency
+    threads = [threading.Thread(target=worker, args=(per_thread,)) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter()-start
+    if failures:
+        raise Exception('HANDSHAKE FAILED')
+    return per_thread*concurrency, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="handshakes/sec per key agreement mode")
+    parser.add_argument('--handshakes', type=int, default=200, help="handshakes per mode")
+    parser.add_argument('--concurrency', type=int, default=1, help="concurrently connecting endpoints")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve()
+
+    print(f"{args.handshakes} handshakes per mode, {args.concurrency} concurrent endpoint(s):")
+    for mode in MODES:
+        #a server process per mode, so its CPU time covers that mode only
+        server = subprocess.Popen([sys.executable, __file__, '--serve'], stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE, text=True)
+        port = int(server.stdout.readline())
+        n, elapsed = run_mode(mode, port, args.handshakes, args.concurrency)
+        server.stdin.close()
+        server_cpu = float(server.stdout.readline())
+        server.wait()
+        print(f"  {mode:12s} {n/elapsed:8.0f} handshakes/s   {elapsed/n*1e6:8.1f}us per handshake   "
+              f"server CPU {server_cpu/n*1e6:8.1f}us per handshake")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
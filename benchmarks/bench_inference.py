@@ -0,0 +1,66 @@
+"""
+checks the numpy inference backend against the SavedModels in endpoint/dev/assets/models
+(float64 tolerance) and compares the rows/sec of both backends at several batch sizes,
+and of the fused (pamp + safe in one pass) evaluator against two separate numpy passes
+
+usage: python bench_inference.py
+"""
+import sys
+import time
+import numpy as np
+from common import use_endpoint, ENDPOINT_DIR
+use_endpoint()
+from cygnet_modules.models import ModelRegistry, KERAS_BACKEND, NUMPY_BACKEND
+from cygnet_modules import utils
+
+MODELS = ['dae3_benign', 'dae3_malicious']
+BATCH_SIZES = [1, 64, 1024]
+ATOL = 1e-10
+
+def registry(backend):
+    ext = '.npz' if backend == NUMPY_BACKEND else ''
+    paths = {name: f"{ENDPOINT_DIR}/assets/models/{name}{ext}" for name in MODELS}
+    return ModelRegistry(paths, backend=backend)
+
+def sample(n, seed=123):
+    rng = np.random.default_rng(seed)
+    return np.concatenate([rng.normal(size=(n, 6)), np.eye(2)[rng.integers(0, 2, n)]], axis=1)
+
+def rows_per_sec(model, batch_size, total=20000):
+    data = sample(batch_size)
+    n_calls = max(1, total//batch_size)
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        model(data)
+    return n_calls*batch_size/(time.perf_counter()-start)
+
+def main():
+    backends = {backend: registry(backend) for backend in (KERAS_BACKEND, NUMPY_BACKEND)}
+    for backend in backends.values():
+        backend.load_all()
+    ok = True
+    data = sample(10000)
+    for name in MODELS:
+        expected = backends[KERAS_BACKEND].get(name)(data)
+        max_error = np.max(np.abs(backends[NUMPY_BACKEND].get(name)(data)-expected))
+        ok = ok and max_error <= ATOL
+        print(f"{name}: max abs error numpy vs SavedModel {max_error:.3g} "
+              f"({'ok' if max_error <= ATOL else 'MISMATCH'})")
+    for backend, models in backends.items():
+        timing = models.timings[MODELS[0]]
+        print(f"{backend:>6}: load {timing['load']:.3f}s, warm-up {timing['warmup']:.3f}s")
+        for batch_size in BATCH_SIZES:
+            print(f"        batch {batch_size:5d}: {rows_per_sec(models.get(MODELS[0]), batch_size):12.0f} rows/sec")
+    numpy_models = backends[NUMPY_BACKEND]
+    fused = numpy_models.get_fused(MODELS)
+    def separate(batch):
+        return [utils.rmse_rows(batch, numpy_models.get(name)(batch)) for name in MODELS]
+    max_error = np.max(np.abs(fused(data)-np.column_stack(separate(data))))
+    print(f"fused signals: max abs error vs separate passes {max_error:.3g}")
+    for batch_size in BATCH_SIZES:
+        print(f"  batch {batch_size:5d}: fused {rows_per_sec(fused, batch_size):12.0f} rows/sec, "
+              f"separate {rows_per_sec(separate, batch_size):12.0f} rows/sec")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+compares the blocking, batch-draining LymphNode consumer with the previous polling loop
+(queue.empty() spin + one profile object per flow key): CPU time burnt while idle,
+and presentations/sec for a burst of migrations. also reports the profile store's memory
+per profile and evictions under a memory cap, with decay
+
+usage: python bench_lymphnode.py
+"""
+import queue
+import sys
+import threading
+import time
+import numpy as np
+from common import use_endpoint
+use_endpoint()
+from cygnet_modules import immune, flowkey
+from cygnet_modules.profiles import ProfileStore, CAPACITY
+
+IDLE_SECONDS = 1.0
+N_PRESENTATIONS = 50000
+N_FLOWS = 2000
+THRESHOLD = 0.65
+
+class PollingProfile:
+    #the previous per-antigen profile object
+    def __init__(self):
+        self._mature_presentation = 0
+        self._total_presentation = 0
+
+    def presented(self, context):
+        if context==1:
+            self._mature_presentation+=1
+        self._total_presentation+=1
+
+    def mcav(self):
+        return self._mature_presentation/(self._total_presentation+1)
+
+class PollingLymphNode:
+    #the previous consumer: spins on queue.empty(), one profile object per antigen
+    def __init__(self, input_queue, alert_queue):
+        self._input_queue = input_queue
+        self._alert_queue = alert_queue
+        self._antigen_profiles = {}
+
+    def get_migration(self, output):
+        context = 1 if output.k>1 else 0
+        for key in flowkey.join_keys(output.keys):
+            if key not in self._antigen_profiles:
+                self._antigen_profiles[key] = PollingProfile()
+            profile = self._antigen_profiles[key]
+            profile.presented(context)
+            if profile.mcav()>THRESHOLD:
+                self._alert_queue.put(flowkey.key_to_str(key))
+
+    def start(self):
+        while True:
+            if not self._input_queue.empty():
+                presentation = self._input_queue.get()
+                if presentation==None:
+                    break
+                self.get_migration(presentation)
+
+def idle_cpu(node, input_queue):
+    #cpu seconds used by the consumer thread per second of idling
+    thread = threading.Thread(target=node.start)
+    thread.start()
+    time.sleep(0.1)
+    cpu = time.process_time()
+    time.sleep(IDLE_SECONDS)
+    used = time.process_time()-cpu
+    input_queue.put(None)
+    thread.join()
+    return used/IDLE_SECONDS
+
+def presentations(n, seed=7):
+    rng = np.random.default_rng(seed)
+    keys = [flowkey.make_key(0x0A000005, 1024+i, 0xC0A80001, 443, 6) for i in range(N_FLOWS)]
+    outputs = []
+    for _ in range(n):
+        ids = rng.integers(0, N_FLOWS, 5)
+        outputs.append(immune.DCOutput(rng.uniform(-3, 4), 6.0, flowkey.split_keys([keys[i] for i in ids])))
+    return outputs
+
+def burst_rate(make_node, outputs):
+    input_queue = queue.Queue()
+    alert_queue = queue.Queue()
+    for output in outputs:
+        input_queue.put(output)
+    input_queue.put(None)
+    node = make_node(input_queue, alert_queue)
+    start = time.perf_counter()
+    node.start()
+    return len(outputs)/(time.perf_counter()-start), alert_queue.qsize()
+
+def main():
+    q = queue.Queue()
+    print(f"idle cpu: polling {idle_cpu(PollingLymphNode(q, queue.Queue()), q):.2f} cores")
+    q = queue.Queue()
+    print(f"idle cpu: blocking {idle_cpu(immune.LymphNode(THRESHOLD, q, queue.Queue()), q):.2f} cores")
+    outputs = presentations(N_PRESENTATIONS)
+    rate, alerts = burst_rate(PollingLymphNode, outputs)
+    print(f"burst: polling  {rate:10.0f} presentations/sec, {alerts} alerts")
+    rate, alerts = burst_rate(lambda i, a: immune.LymphNode(THRESHOLD, i, a), outputs)
+    print(f"burst: batched  {rate:10.0f} presentations/sec, {alerts} alerts")
+    stores = []
+    def capped_node(input_queue, alert_queue):
+        store = ProfileStore(max_bytes=N_FLOWS*100, ttl=300.0, half_life=60.0)
+        stores.append(store)
+        return immune.LymphNode(THRESHOLD, input_queue, alert_queue, profiles=store)
+    rate, alerts = burst_rate(capped_node, outputs)
+    stats = stores[0].stats()
+    print(f"burst: capped   {rate:10.0f} presentations/sec, {alerts} alerts "
+          f"({stats['profiles']} profiles, {stats['bytes_per_profile']:.0f} B/profile, "
+          f"{stats['evictions'][CAPACITY]} evictions)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+compares the Client's alert sender with the previous polling sender (send_alert returning
+at once on an empty queue, one alert per call) - the sender's CPU usage while idle, and the
+alerts/sec it sends while a producer process floods the (multiprocessing) alert queue.
+the frames go over a socket pair to a reader thread that decrypts them
+
+usage: python bench_sender.py [--idle 3] [--alerts 50000]
+"""
+import argparse
+import json
+import socket
+import sys
+import threading
+import time
+from multiprocessing import Process, Queue
+from common import use_endpoint
+use_endpoint()
+from cygnet_modules import utils as cyg
+from cygnet_modules.client import Client
+from cygnet_modules.encryption import CygCrypt, AES_GCM, X25519
+
+class PollingClient(Client):
+    #the previous sender - one alert per call, returning at once when the queue is empty
+    def send_alert(self):
+        if not self.alert_queue.empty():
+            alert = self.alert_queue.get()
+            if alert != None:
+                if not self._batch:
+                    self._batch_deadline = time.monotonic()+self._batch_interval
+                self._batch.append(alert)
+        if self._batch and (len(self._batch) >= self._batch_size or time.monotonic() >= self._batch_deadline):
+            self.flush()
+
+def connected(client_class, alert_queue):
+    #client with an AES-GCM session to a reader thread that counts the received alerts
+    client = client_class("127.0.0.1", "127.0.0.1", 0, "bench", "cygnet:localhost:8000", alert_queue)
+    server_crypt = CygCrypt()
+    client.crypt.generate_keys(X25519)
+    server_crypt.generate_keys(X25519)
+    client.crypt.shared_secret(server_crypt.serialised_public_key(), AES_GCM, initiator=True)
+    server_crypt.shared_secret(client.crypt.serialised_public_key(), AES_GCM, initiator=False)
+    client._socket, server_socket = socket.socketpair()
+    received = []
+    def read():
+        while True:
+            data = cyg.recv_frame(server_socket)
+            if data == None:
+                return
+            received.extend(json.loads(server_crypt.decrypt_msg(data)))
+    reader = threading.Thread(target=read)
+    reader.start()
+    return client, reader, received
+
+def produce(alert_queue, n_alerts):
+    for i in range(n_alerts):
+        alert_queue.put(f"10.0.0.5:{1024+i % 60000}-93.184.216.{i % 250}:443")
+
+def idle_cpu(client_class, seconds):
+    #CPU seconds per second of the sender thread with nothing to send
+    alert_queue = Queue()
+    client, reader, _ = connected(client_class, alert_queue)
+    sender = threading.Thread(target=client.send_alerts)
+    start_cpu = time.process_time()
+    sender.start()
+    time.sleep(seconds)
+    client.stop()
+    stop_time = time.perf_counter()
+    sender.join()
+    stopped = time.perf_counter()-stop_time
+    cpu = (time.process_time()-start_cpu)/seconds
+    client.disconnect()
+    reader.join()
+    return cpu, stopped
+
+def storm(client_class, n_alerts):
+    #alerts/sec sent while a producer process fills the queue
+    alert_queue = Queue()
+    client, reader, received = connected(client_class, alert_queue)
+    producer = Process(target=produce, args=(alert_queue, n_alerts))
+    start = time.perf_counter()
+    producer.start()
+    while len(received) < n_alerts:
+        client.send_alert()
+    client.disconnect()
+    reader.join()
+    elapsed = time.perf_counter()-start
+    producer.join()
+    return len(received)/elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="idle CPU and alert storm throughput of the alert sender")
+    parser.add_argument('--idle', type=float, default=3.0, help="seconds the idle sender runs")
+    parser.add_argument('--alerts', type=int, default=50000, help="alerts of the storm")
+    args = parser.parse_args()
+    for name, client_class in (('polling', PollingClient), ('blocking', Client)):
+        cpu, stopped = idle_cpu(client_class, args.idle)
+        rate = storm(client_class, args.alerts)
+        print(f"{name:9s} idle CPU {cpu*100:6.1f}%   stopped in {stopped*1000:6.1f}ms   "
+              f"storm {rate:9.0f} alerts/s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""
+throughput of the endpoint's on-disk alert spool - spooling batches of alerts (server down),
+replaying them in batches (reconnected) and spooling past the size cap (oldest segments dropped)
+
+usage: python bench_spool.py [--alerts 200000] [--batch 32]
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from common import use_endpoint
+use_endpoint()
+from cygnet_modules.spool import AlertSpool, SEGMENT_SIZE
+
+def alerts(n_alerts):
+    return [f"10.0.0.5:{1024+i % 60000}-93.184.216.{i % 250}:443" for i in range(n_alerts)]
+
+def spool_and_replay(directory, items, batch, max_bytes):
+    spool = AlertSpool(directory, SEGMENT_SIZE, max_bytes)
+    start = time.perf_counter()
+    for i in range(0, len(items), batch):
+        spool.append(items[i:i+batch])
+    spool.flush()
+    append_time = time.perf_counter()-start
+    start = time.perf_counter()
+    replayed = 0
+    while True:
+        replay = spool.peek(batch)
+        if not replay:
+            break
+        replayed += len(replay)
+        spool.commit()
+    replay_time = time.perf_counter()-start
+    stats = spool.stats()
+    spool.close()
+    return len(items)/append_time, replayed/replay_time if replay_time > 0 else 0.0, stats
+
+def main():
+    parser = argparse.ArgumentParser(description="alert spool throughput")
+    parser.add_argument('--alerts', type=int, default=200000, help="alerts spooled")
+    parser.add_argument('--batch', type=int, default=32, help="alerts per spooled/replayed batch")
+    args = parser.parse_args()
+    items = alerts(args.alerts)
+    for name, max_bytes in (('uncapped', 1 << 40), ('capped at 4 segments', 4*SEGMENT_SIZE)):
+        directory = tempfile.mkdtemp(prefix="cygnet_spool_")
+        try:
+            append_rate, replay_rate, stats = spool_and_replay(directory, items, args.batch, max_bytes)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        print(f"{name:22s} spool {append_rate:9.0f} alerts/s   replay {replay_rate:9.0f} alerts/s   "
+              f"replayed {stats['replayed']}, dropped {stats['dropped']} ({stats['dropped_segments']} segments)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+compares the shared memory ring transport (ringbuffer.FlowUpdateRing) with a
+multiprocessing.Queue carrying the collector's (flow key, (1, 8) feature row) updates
+from a producer process to a consumer process: records/sec at full speed, and the
+p50/p99 producer -> consumer latency at a paced rate
+
+usage: python bench_transport.py [n_records]
+"""
+import multiprocessing
+import sys
+import time
+import numpy as np
+from common import use_endpoint
+use_endpoint()
+from cygnet_modules import flowkey
+from cygnet_modules.ringbuffer import FlowUpdateRing, BLOCK
+
+PACED_RATE = 20000 #records/sec of the latency run
+PACED_RECORDS = 20000
+
+def produce(transport, n_records, rate):
+    key = flowkey.make_key(0x0A000005, 40000, 0xC0A80001, 443, 6)
+    vector = np.zeros((1, 8))
+    interval = 1/rate if rate else 0
+    start = time.perf_counter()
+    for i in range(n_records):
+        if interval:
+            while time.perf_counter() < start+i*interval:
+                pass
+        vector[0, 0] = time.perf_counter() #send time, for the latency
+        transport.put((key, vector))
+    transport.put(None)
+
+def consume(transport, results, batch):
+    latencies = []
+    n = 0
+    start = None
+    while True:
+        if batch:
+            update = transport.get_batch(256)
+            if update == None:
+                break
+            rows = update[1]
+        else:
+            update = transport.get()
+            if update == None:
+                break
+            rows = update[1]
+        now = time.perf_counter()
+        if start == None:
+            start = now
+        latencies.extend(now-rows[:, 0])
+        n += len(rows)
+    results.put((n, time.perf_counter()-start, np.percentile(latencies, 50), np.percentile(latencies, 99)))
+
+def run(make_transport, n_records, rate, batch=False):
+    transport = make_transport()
+    results = multiprocessing.Queue()
+    consumer = multiprocessing.Process(target=consume, args=(transport, results, batch))
+    consumer.start()
+    producer = multiprocessing.Process(target=produce, args=(transport, n_records, rate))
+    producer.start()
+    producer.join()
+    n, elapsed, p50, p99 = results.get()
+    consumer.join()
+    if hasattr(transport, 'release'):
+        transport.release()
+    return n/elapsed, p50, p99
+
+def main():
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    transports = {
+        'queue': (multiprocessing.Queue, False),
+        'ring': (lambda: FlowUpdateRing(65536, BLOCK), False),
+        'ring (batch read)': (lambda: FlowUpdateRing(65536, BLOCK), True),
+    }
+    for name, (make_transport, batch) in transports.items():
+        rate, _, _ = run(make_transport, n_records, 0, batch)
+        _, p50, p99 = run(make_transport, PACED_RECORDS, PACED_RATE, batch)
+        print(f"{name:>18}: {rate:10.0f} records/sec, latency at {PACED_RATE}/sec "
+              f"p50 {p50*1e6:8.1f}us p99 {p99*1e6:8.1f}us")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""shared helpers for the Cygnet benchmarks (path setup, synthetic traffic, timing)"""
+import os
+import random
+import struct
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINT_DIR = ROOT+"/endpoint/dev"
+SERVER_DIR = ROOT+"/server/dev"
+
+def use_endpoint():
+    """makes the endpoint's cygnet_modules importable"""
+    if ENDPOINT_DIR not in sys.path:
+        sys.path.insert(0, ENDPOINT_DIR)
+
+def use_server():
+    """makes the server's cygnet_modules importable"""
+    if SERVER_DIR not in sys.path:
+        sys.path.insert(0, SERVER_DIR)
+
+#Synthetic traffic
+def _checksum(header):
+    total = sum(struct.unpack('!%dH' % (len(header)//2), header))
+    while total >> 16:
+        total = (total & 0xFFFF)+(total >> 16)
+    return ~total & 0xFFFF
+
+def build_frame(sip, dip, sport, dport, proto, payload_len, flags=0x18):
+    """builds an ethernet/IPv4/TCP or UDP frame (proto 6 or 17) with a zeroed payload"""
+    payload = bytes(payload_len)
+    if proto == 6:
+        transport = struct.pack('!HHIIBBHHH', sport, dport, 0, 0, 5 << 4, flags, 8192, 0, 0)
+    else:
+        transport = struct.pack('!HHHH', sport, dport, 8+payload_len, 0)
+    total_len = 20+len(transport)+payload_len
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, total_len, 0, 0, 64, proto, 0,
+                     bytes(map(int, sip.split('.'))), bytes(map(int, dip.split('.'))))
+    ip = ip[:10]+struct.pack('!H', _checksum(ip))+ip[12:]
+    ether = b'\x00\x11\x22\x33\x44\x55'+b'\x66\x77\x88\x99\xaa\xbb'+b'\x08\x00'
+    frame = ether+ip+transport+payload
+    if len(frame) < 60:
+        frame += bytes(60-len(frame)) #ethernet padding
+    return frame
+
+def synthetic_packets(n_packets, n_flows=200, seed=1234, start_time=1.7e9, rate=10000.0):
+    """
+    generates a reproducible stream of (timestamp, frame) pairs spread over n_flows
+    bidirectional TCP/UDP flows between a local host and random remote hosts
+    """
+    rng = random.Random(seed)
+    local = "10.0.0.5"
+    flows = []
+    for _ in range(n_flows):
+        remote = "%d.%d.%d.%d" % (rng.randint(1, 223), rng.randint(0, 255),
+                                  rng.randint(0, 255), rng.randint(1, 254))
+        proto = 6 if rng.random() < 0.8 else 17
+        flows.append((local, remote, rng.randint(1024, 65535), rng.choice([53, 80, 443, 8080]), proto))
+    packets = []
+    t = start_time
+    for _ in range(n_packets):
+        sip, dip, sport, dport, proto = flows[int(rng.paretovariate(1.2)) % n_flows]
+        if rng.random() < 0.5:
+            sip, dip, sport, dport = dip, sip, dport, sport
+        t += rng.expovariate(rate)
+        packets.append((t, build_frame(sip, dip, sport, dport, proto, rng.randint(0, 1400))))
+    return packets
+
+def write_pcap(path, packets, linktype=1):
+    """writes (timestamp, frame) pairs to a classic (microsecond) pcap file"""
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 65535, linktype))
+        for ts, frame in packets:
+            sec = int(ts)
+            usec = int(round((ts-sec)*1e6))
+            f.write(struct.pack('<IIII', sec, usec, len(frame), len(frame)))
+            f.write(frame)
+
+def write_pcapng(path, packets, linktype=1):
+    """writes (timestamp, frame) pairs to a pcapng file (one interface, enhanced packet blocks)"""
+    def block(block_type, body):
+        body += bytes(-len(body) % 4)
+        length = 12+len(body)
+        return struct.pack('<II', block_type, length)+body+struct.pack('<I', length)
+    with open(path, 'wb') as f:
+        f.write(block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1)))
+        f.write(block(0x00000001, struct.pack('<HHI', linktype, 0, 65535)))
+        for ts, frame in packets:
+            usec = int(round(ts*1e6))
+            f.write(block(0x00000006, struct.pack('<IIIII', 0, usec >> 32, usec & 0xFFFFFFFF,
+                                                  len(frame), len(frame))+frame))
+
+#Timing
+def measure(func, repeat=1):
+    """runs func repeat times and returns the best wall time (seconds)"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter()-start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def time_calls(func, items):
+    """calls func(item) for every item, returns the per-call wall times (seconds)"""
+    perf_counter = time.perf_counter
+    latencies = []
+    append = latencies.append
+    for item in items:
+        start = perf_counter()
+        func(item)
+        append(perf_counter()-start)
+    return latencies
+
+def latency_stats(latencies, ops_per_call=1):
+    """
+    returns the ops/sec and the latency percentiles (microseconds per call) of
+    per-call wall times (seconds) - ops_per_call ops are done in each call
+    """
+    ordered = sorted(latencies)
+    n = len(ordered)
+    total = sum(ordered)
+    def percentile(p):
+        return ordered[min(n-1, int(p/100*n))]*1e6
+    return {
+        'calls': n,
+        'ops': n*ops_per_call,
+        'ops_per_sec': n*ops_per_call/total if total > 0 else 0.0,
+        'p50_us': percentile(50),
+        'p90_us': percentile(90),
+        'p99_us': percentile(99),
+        'max_us': ordered[-1]*1e6,
+    }
@@ -0,0 +1,374 @@
+"""
+benchmark suite of the Cygnet hot paths - packet keying, flow updates/vectorisation,
+signal extraction, the DCA over synthetic segments, lymph node presentations, alert
+encryption and the alert server's message handling. every case runs on fixed-seed
+synthetic traffic in its own process, and the ops/sec and latency percentiles of all
+cases are written to a JSON file, to be compared across commits on the same machine
+
+usage: python suite.py [-o results.json] [--cases case1,case2] [--compare baseline.json]
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import queue
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from common import ROOT, use_endpoint, use_server, synthetic_packets, time_calls, latency_stats
+
+SEED = 1234
+N_PACKETS = 20000
+N_FLOWS = 500
+N_MESSAGES = 2000
+N_HANDSHAKES = 20
+ALERT_BATCH = 32
+SEGMENT_SIZE = 20
+N_SEGMENTS = 500
+THRESHOLD = 0.65
+COMPANY_HASH = "cygnet:localhost:8000"
+X25519_MODE = 'x25519' #encryption.X25519 (the encryption modules are imported per case)
+
+def packet_infos():
+    use_endpoint()
+    from cygnet_modules.rawcapture import parse_frame
+    return [parse_frame(frame, ts) for ts, frame in synthetic_packets(N_PACKETS, N_FLOWS, SEED)]
+
+def flows(infos):
+    #per flow key Netflow (created from the flow's first packet) + the updates of the later packets
+    use_endpoint()
+    from cygnet_modules import flowkey
+    from cygnet_modules.netflow import Netflow, FlowStore
+    store = FlowStore()
+    netflows = {}
+    updates = []
+    for info in infos:
+        key = flowkey.make_key(info.sip, info.sport, info.dip, info.dport, info.proto)
+        flow = netflows.get(key)
+        if flow == None:
+            netflows[key] = Netflow.netflow_from_info(info, key, store)
+        else:
+            updates.append((flow, info))
+    return netflows, updates
+
+def feature_rows():
+    #(flow key, scaled (1, 8) feature vector) of every flow update
+    netflows, updates = flows(packet_infos())
+    rows = []
+    for flow, info in updates:
+        flow.update(info)
+        rows.append((flow.get_key(), flow.vectorise()))
+    return rows
+
+def signal_extractor():
+    #the endpoint's signal extractor (models, backend)
+    use_endpoint()
+    import pipeline
+    extractor = pipeline.signal_extractor()
+    extractor.initialise()
+    return extractor
+
+#Cases - each returns latency_stats of its per-call timings
+def bench_get_key_from_packet():
+    use_endpoint()
+    from scapy.layers.l2 import Ether
+    import scapy.layers.inet #binds IP/TCP/UDP to Ether
+    from cygnet_modules.netflow import Pktops
+    packets = [Ether(frame) for _, frame in synthetic_packets(N_PACKETS, N_FLOWS, SEED)]
+    return latency_stats(time_calls(Pktops.get_key_from_packet, packets))
+
+def bench_netflow_update():
+    _, updates = flows(packet_infos())
+    return latency_stats(time_calls(lambda update: update[0].update(update[1]), updates))
+
+def bench_netflow_vectorise():
+    netflows, updates = flows(packet_infos())
+    for flow, info in updates:
+        flow.update(info)
+    calls = [flow for _, flow in sorted(netflows.items())]*(N_PACKETS//len(netflows))
+    return latency_stats(time_calls(lambda flow: flow.vectorise(), calls))
+
+def bench_signal_extract():
+    extractor = signal_extractor()
+    rows = [row for _, row in feature_rows()]
+    return latency_stats(time_calls(extractor.extract, rows))
+
+def bench_signal_extract_batch():
+    extractor = signal_extractor()
+    rows = [row for _, row in feature_rows()]
+    import numpy as np
+    batches = [np.concatenate(rows[i:i+64]) for i in range(0, len(rows)-63, 64)]
+    return latency_stats(time_calls(extractor.extract_batch, batches), ops_per_call=64)
+
+def bench_dca_segment():
+    #one DCA.start call per segment of flow updates (the population/models stay loaded)
+    use_endpoint()
+    from cygnet_modules import immune
+    import numpy as np
+    extractor = signal_extractor()
+    rows = feature_rows()
+    input_queue = queue.Queue()
+    output_queue = queue.Queue()
+    np.random.seed(SEED)
+    dca = immune.DCA(input_queue, output_queue, population_size=5, migration_range=(5,15),
+                     max_antigens=5, csm_weights=[2,2], k_weights=[2,-2], segment_size=SEGMENT_SIZE,
+                     signal_extractor=extractor, in_signal=2, batch_size=64, batch_timeout_ms=0)
+    segments = [rows[(i*SEGMENT_SIZE) % (len(rows)-SEGMENT_SIZE):][:SEGMENT_SIZE] for i in range(N_SEGMENTS)]
+    def run_segment(segment):
+        for update in segment:
+            input_queue.put(update)
+        dca.start(iteration_limit=1)
+    stats = latency_stats(time_calls(run_segment, segments), ops_per_call=SEGMENT_SIZE)
+    stats['migrations'] = output_queue.qsize()
+    return stats
+
+def bench_lymphnode_get_migration():
+    use_endpoint()
+    from cygnet_modules import immune, flowkey
+    import numpy as np
+    rng = np.random.default_rng(SEED)
+    keys = [flowkey.make_key(0x0A000005, 1024+i, 0xC0A80001, 443, 6) for i in range(N_FLOWS)]
+    outputs = []
+    for _ in range(N_PACKETS):
+        ids = rng.integers(0, N_FLOWS, 5)
+        outputs.append(immune.DCOutput(rng.uniform(-3, 4), 6.0, flowkey.split_keys([keys[i] for i in ids])))
+    alert_queue = queue.Queue()
+    node = immune.LymphNode(THRESHOLD, queue.Queue(), alert_queue)
+    stats = latency_stats(time_calls(node.get_migration, outputs))
+    stats['alerts'] = alert_queue.qsize()
+    return stats
+
+def crypt_pair():
+    #two endpoints of an exchanged key, with the session cipher the client and server negotiate
+    use_endpoint()
+    from cygnet_modules.encryption import CygCrypt, SUPPORTED_CIPHERS
+    a, b = CygCrypt(), CygCrypt()
+    a.generate_keys()
+    b.generate_keys()
+    a.shared_secret(b.serialised_public_key(), SUPPORTED_CIPHERS[0], initiator=True)
+    b.shared_secret(a.serialised_public_key(), SUPPORTED_CIPHERS[0], initiator=False)
+    return a, b
+
+def alerts():
+    #"sip:sport-dip:dport" flow key alerts
+    rng = random.Random(SEED)
+    def endpoint():
+        return "%d.%d.%d.%d:%d" % (rng.randint(1, 223), rng.randint(0, 255), rng.randint(0, 255),
+                                   rng.randint(1, 254), rng.randint(1, 65535))
+    return [f"{endpoint()}-{endpoint()}" for _ in range(N_MESSAGES)]
+
+def alert_messages(batch=1):
+    #alert frame payloads as the endpoint client sends them - JSON lists of batch alerts
+    flows = alerts()
+    return [json.dumps(flows[i:i+batch]) for i in range(0, len(flows)-batch+1, batch)]
+
+def bench_encrypt_msg():
+    a, _ = crypt_pair()
+    return latency_stats(time_calls(a.encrypt_msg, alert_messages()))
+
+def bench_decrypt_msg():
+    a, b = crypt_pair()
+    tokens = [a.encrypt_msg(msg) for msg in alert_messages()]
+    return latency_stats(time_calls(b.decrypt_msg, tokens))
+
+def alert_server():
+    #AlertServer with an in-memory configuration, handing the processed alerts to a queue (no smtp)
+    use_server()
+    import alertserver
+    sys.stdout = sys.__stdout__
+    sys.stderr = sys.__stderr__
+    from cygnet_modules.encryption import CygCrypt, SessionTickets, SUPPORTED_CIPHERS
+    from cygnet_modules.encryption import RESUMPTION_NONCE_SIZE
+    from cygnet_modules import utils as cyg
+
+    class BenchAlertServer(alertserver.AlertServer):
+        def __init__(self):
+            super().__init__("localhost", 0, None, tickets=SessionTickets(os.urandom(32)))
+            self.processed = queue.Queue()
+
+        def get_config(self):
+            return {'company_hash': COMPANY_HASH, 'admins': []}
+
+        def send_alert(self, alert, subject=None):
+            self.processed.put(alert)
+
+    def connect(server, key_exchange=None, resume=None):
+        """
+        client side of the handshake (authentication + key exchange) over a socket pair -
+        key_exchange None -> the original DH round trip after authentication, else the key
+        (and the resume=(ticket, secret) ticket) sent with the credentials
+        """
+        client_socket, server_socket = socket.socketpair()
+        thread = threading.Thread(target=server.handle_client, args=(server_socket, ("127.0.0.1", 0)))
+        thread.start()
+        crypt = CygCrypt()
+        credentials = {'hostname': 'bench', 'company_hash': COMPANY_HASH, 'ciphers': list(SUPPORTED_CIPHERS)}
+        if key_exchange != None:
+            crypt.generate_keys(key_exchange)
+            credentials['public_key'] = base64.b64encode(crypt.serialised_public_key()).decode()
+        if resume != None:
+            nonce = os.urandom(RESUMPTION_NONCE_SIZE)
+            credentials['ticket'] = base64.b64encode(resume[0]).decode()
+            credentials['nonce'] = base64.b64encode(nonce).decode()
+        cyg.send_frame(client_socket, json.dumps(credentials).encode())
+        result, _, cipher = cyg.recv_frame(client_socket).decode().partition(':')
+        if result != cyg.AUTH_SUCCESS:
+            raise Exception('AUTHENTICATION FAILED')
+        if key_exchange == None:
+            crypt.generate_keys()
+            cyg.send_frame(client_socket, crypt.serialised_public_key())
+            crypt.shared_secret(cyg.recv_frame(client_socket), cipher, initiator=True)
+            return client_socket, thread, crypt
+        handshake = json.loads(cyg.recv_frame(client_socket))
+        if handshake['resumed']:
+            crypt.resume(resume[1], nonce, base64.b64decode(handshake['nonce']), cipher, initiator=True)
+        else:
+            crypt.shared_secret(base64.b64decode(handshake['public_key']), cipher, initiator=True)
+        crypt.ticket = base64.b64decode(handshake['ticket'])
+        return client_socket, thread, crypt
+
+    return BenchAlertServer(), connect, cyg.send_frame
+
+def handshakes(key_exchange=None, resumed=False):
+    #full connection setups (authentication + key exchange/resumption) of one handshake mode
+    server, connect, _ = alert_server()
+    resume = None
+    if resumed:
+        client_socket, thread, crypt = connect(server, X25519_MODE)
+        resume = (crypt.ticket, crypt.resumption_secret())
+        client_socket.close()
+        thread.join()
+    connections = []
+    def handshake(_):
+        connections.append(connect(server, key_exchange, resume))
+    stats = latency_stats(time_calls(handshake, range(N_HANDSHAKES)))
+    for client_socket, thread, _ in connections:
+        client_socket.close()
+        thread.join()
+    return stats
+
+def bench_handle_client_handshake():
+    return handshakes()
+
+def bench_handle_client_handshake_x25519():
+    return handshakes(X25519_MODE)
+
+def bench_handle_client_handshake_resumed():
+    return handshakes(X25519_MODE, resumed=True)
+
+def handle_client_frames(batch):
+    #alert frame round trip - sent by the client, decrypted, parsed and every alert handed to send_alert
+    server, connect, send_frame = alert_server()
+    client_socket, thread, crypt = connect(server)
+    tokens = [crypt.encrypt_msg(msg) for msg in alert_messages(batch)]
+    def send(token):
+        send_frame(client_socket, token)
+        for _ in range(batch):
+            server.processed.get()
+    stats = latency_stats(time_calls(send, tokens), ops_per_call=batch)
+    client_socket.close()
+    thread.join()
+    return stats
+
+def bench_handle_client_message():
+    return handle_client_frames(1)
+
+def bench_handle_client_batch():
+    return handle_client_frames(ALERT_BATCH)
+
+CASES = {
+    'pktops.get_key_from_packet': bench_get_key_from_packet,
+    'netflow.update': bench_netflow_update,
+    'netflow.vectorise': bench_netflow_vectorise,
+    'signal_extractor.extract': bench_signal_extract,
+    'signal_extractor.extract_batch': bench_signal_extract_batch,
+    'dca.start_segment': bench_dca_segment,
+    'lymph_node.get_migration': bench_lymphnode_get_migration,
+    'cygcrypt.encrypt_msg': bench_encrypt_msg,
+    'cygcrypt.decrypt_msg': bench_decrypt_msg,
+    'alert_server.handshake': bench_handle_client_handshake,
+    'alert_server.handshake_x25519': bench_handle_client_handshake_x25519,
+    'alert_server.handshake_resumed': bench_handle_client_handshake_resumed,
+    'alert_server.handle_client_message': bench_handle_client_message,
+    'alert_server.handle_client_batch': bench_handle_client_batch,
+}
+
+def run_case(name, out_path):
+    #child process - runs one case and writes its stats to out_path
+    stats = CASES[name]()
+    with open(out_path, 'w') as f:
+        json.dump(stats, f)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=30).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def environment():
+    return {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'seed': SEED,
+    }
+
+def compare(results, baseline_path):
+    #ops/sec and p99 of this run relative to a previous results file
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} ({(baseline['environment']['commit'] or '?')[:10]}):")
+    for name, stats in results['cases'].items():
+        base = baseline['cases'].get(name)
+        if base == None or 'error' in stats or 'error' in base:
+            continue
+        print(f"{name:36s} ops/sec x{stats['ops_per_sec']/base['ops_per_sec']:6.2f}   "
+              f"p99 x{stats['p99_us']/base['p99_us']:6.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="runs the Cygnet benchmark suite")
+    parser.add_argument('-o', '--output', default='bench_results.json', help="results file (JSON)")
+    parser.add_argument('--cases', default=None, help="comma separated case names (default: all)")
+    parser.add_argument('--compare', default=None, help="previous results file to compare with")
+    parser.add_argument('--run', default=None, help=argparse.SUPPRESS) #child process: case name
+    parser.add_argument('--out', default=None, help=argparse.SUPPRESS) #child process: stats file
+    args = parser.parse_args()
+    if args.run != None:
+        run_case(args.run, args.out)
+        return 0
+    names = list(CASES) if args.cases == None else args.cases.split(',')
+    results = {'environment': environment(), 'cases': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            out_path = os.path.join(tmp, 'case.json')
+            #every case in a fresh process (the endpoint and server modules share a package name)
+            process = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', name, '--out', out_path],
+                                     cwd=os.path.dirname(os.path.abspath(__file__)),
+                                     capture_output=True, text=True)
+            if process.returncode != 0:
+                stats = {'error': process.stderr.strip().splitlines()[-1] if process.stderr.strip() else 'failed'}
+                print(f"{name:36s} FAILED: {stats['error']}")
+            else:
+                with open(out_path) as f:
+                    stats = json.load(f)
+                print(f"{name:36s} {stats['ops_per_sec']:12.0f} ops/sec   p50 {stats['p50_us']:9.1f}us   "
+                      f"p99 {stats['p99_us']:9.1f}us")
+            results['cases'][name] = stats
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    if args.compare != None:
+        compare(results, args.compare)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
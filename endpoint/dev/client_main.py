@@ -1,119 +1,235 @@
-from cygnet_modules import immune
-from cygnet_modules.networkcapture import NetworkCollector
-from cygnet_modules.client import Client
-from cygnet_modules import utils as cyg
-from multiprocessing import Process, Queue, freeze_support
-import socket
-import tensorflow as tf
-import numpy as np
+import time
+LAUNCH_TIME = time.time() #wall-clock launch time - the startup report is relative to it
 import sys
 import os
+import socket
+import logging
+from multiprocessing import Process, Queue, freeze_support
+_import_start = time.perf_counter()
+from cygnet_modules import utils as cyg
+#per-import/per-phase startup timings, written to the log once capture and connection are up
+STARTUP = cyg.StartupTimer(LAUNCH_TIME)
+STARTUP.phases.append(('import utils', time.perf_counter()-_import_start))
+#heavy dependencies are kept out of this process: scapy is imported only by the scapy
+#capture backend and tensorflow only by the keras model backend, in the DCA process
+with STARTUP.phase('import immune'):
+    from cygnet_modules import immune
+    from cygnet_modules.profiles import ProfileStore
+    from cygnet_modules.ringbuffer import FlowUpdateRing, MigrationRing, BLOCK, DROP
+with STARTUP.phase('import networkcapture'):
+    from cygnet_modules.networkcapture import NetworkCollector, SCAPY_BACKEND, RAW_BACKEND
+    from cygnet_modules.flowtable import FlowTable
+    from cygnet_modules.emission import EmissionPolicy
+    from cygnet_modules.metrics import Metrics, serve_metrics
+with STARTUP.phase('import client'):
+    from cygnet_modules.client import Client
+    from cygnet_modules.spool import AlertSpool
+with STARTUP.phase('import pipeline'):
+    import pipeline
 
 CURDIR = os.path.dirname(os.path.abspath(__file__))
-PAMP_MODEL_PATH = CURDIR+"/dev/assets/models/dae3_benign"
-SAFE_MODEL_PATH = CURDIR+"/dev/assets/models/dae3_malicious"
-SCALER_PATH = CURDIR+"/dev/assets/scaler.pkl"
+#(the detection pipeline's models and settings are in pipeline.py, shared with replay_main)
+LOG_PATH = CURDIR+"/cygnet_endpoint.log"
+#packet capture backend - the raw (AF_PACKET) backend is only available on linux
+CAPTURE_BACKEND = RAW_BACKEND if sys.platform.startswith('linux') else SCAPY_BACKEND
+#number of DCA worker processes - flow updates are sharded to them by flow key hash,
+#each worker owns its own DC population (1 -> a single DCA process, as before)
+DCA_WORKERS = 1
+#interprocess transport - shared memory rings (sniffer -> DCA, DCA -> lymph node), or
+#multiprocessing queues when False. the DCA -> lymph node ring has a single producer,
+#so with several DCA workers the migrations always go through a queue
+SHARED_MEMORY_TRANSPORT = True
+#full ring policy - BLOCK: the capture waits for the DCA (no update is lost, as with the queues),
+#DROP: the update is dropped (counted, and logged as soon as the count grows) rather than
+#stalling the capture - opt-in, a dropped update is a flow the DCA doesn't see
+RING_POLICY = BLOCK
+#seconds between the pipeline stats (ring drops, and the collector's flow table/emission
+#counters - logged by the capture process) written to the log
+STATS_LOG_INTERVAL = 600.0
+#alert batching on the server link - a frame is sent once it holds ALERT_BATCH_SIZE alerts,
+#or ALERT_BATCH_INTERVAL_MS after its first alert
+ALERT_BATCH_SIZE = 32
+ALERT_BATCH_INTERVAL_MS = 50.0
+#undelivered alerts (server down/restarting) - spooled to memory-mapped segment files in
+#SPOOL_DIR, capped at SPOOL_MAX_BYTES (oldest dropped), and replayed once reconnected.
+#reconnection backoff (seconds) - jittered, doubling from the min delay up to the max
+SPOOL_DIR = CURDIR+"/spool"
+SPOOL_SEGMENT_BYTES = 1024*1024
+SPOOL_MAX_BYTES = 64*1024*1024
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 60.0
+#per-stage latency instrumentation (trace stamps from flow update to alert) - histograms and
+#queue depths dumped to METRICS_DIR every pipeline.METRICS_INTERVAL seconds per process, and
+#served on localhost:METRICS_PORT/metrics (None -> not served)
+METRICS_ENABLED = False
+METRICS_DIR = CURDIR+"/metrics"
+METRICS_PORT = None
 
 #redirecting stdout and stderr to null to avoid output
 sys.stdout = open(os.devnull, 'w')
 sys.stderr = open(os.devnull, 'w')
+logging.basicConfig(filename=LOG_PATH, level=logging.INFO,
+                    format="%(asctime)s %(processName)s %(name)s: %(message)s")
+logger = logging.getLogger('cygnet_endpoint')
 
-def safe_extraction(data):
-    """
-    extracting safe signal value from reconstruction by autoencoder trained on malicious samples.
-    the higher the RMSE value, the stronger indication input is benign
-    """
-    m = load_model(SAFE_MODEL_PATH) # m -> keras Model object (trained autoencoder)
-    reconstructed = m(data)
-    error_rate = cyg.rmse(data, reconstructed)
-    return error_rate
+def run_dca(dca: immune.DCA, launch_time):
+    #DCA process target - the models are loaded (and tensorflow imported, if used) here only
+    timer = cyg.StartupTimer(launch_time)
+    timer.mark('dca process started')
+    def first_batch():
+        timer.mark('first packet processed')
+        timer.report(logger, 'dca startup')
+    dca.start(on_first_batch=first_batch)
 
-def pamp_extraction(data):
-    """
-    extracting pamp signal value from reconstruction by autoencoder trained on benign samples.
-    the higher the RMSE value, the stronger indication the input is malicious
-    """
-    m = load_model(PAMP_MODEL_PATH) # m -> keras Model object (trained autoencoder)
-    reconstructed = m(data)
-    error_rate = cyg.rmse(data, reconstructed)
-    return error_rate
+def stage_metrics(name):
+    #the stage's metrics registry (None when instrumentation is disabled)
+    if not METRICS_ENABLED:
+        return None
+    return Metrics(name, METRICS_DIR, pipeline.METRICS_INTERVAL)
 
-def load_model(model_path):
-        return tf.keras.models.load_model(model_path)
+def stop_processes(processes):
+    for process in processes:
+        process.terminate()
+        process.join()
+        process.close()
 
-def main(company_key):    
+def log_transport_stats(dca_inputs, dca_output):
+    #queued/dropped counters of the rings (queues keep no stats)
+    stats = {'dca_inputs': [ring.stats() for ring in dca_inputs if hasattr(ring, 'stats')]}
+    if hasattr(dca_output, 'stats'):
+        stats['dca_output'] = dca_output.stats()
+    logger.info(f"transport stats: {stats}")
+
+def log_ring_drops(dca_inputs, dropped):
+    #logs the flow updates dropped by full rings (DROP policy) since the last check, returns the total
+    total = sum(ring.dropped() for ring in dca_inputs if hasattr(ring, 'dropped'))
+    if total > dropped:
+        logger.warning(f"flow update rings full - {total-dropped} updates dropped ({total} in total)")
+    return total
+
+def main(company_key):
+    STARTUP.mark('main')
     #initialising the interprocess sharing queues
-    dca_input_queue = Queue()
-    dca_output = Queue()
+    if SHARED_MEMORY_TRANSPORT:
+        #(the updates' trace stamps only take room in the rings when instrumented)
+        dca_input_queues = [FlowUpdateRing(pipeline.RING_CAPACITY, RING_POLICY, stamped=METRICS_ENABLED)
+                            for _ in range(DCA_WORKERS)]
+    else:
+        dca_input_queues = [Queue() for _ in range(DCA_WORKERS)]
+    if SHARED_MEMORY_TRANSPORT and DCA_WORKERS == 1:
+        dca_output = MigrationRing(pipeline.MAX_ANTIGENS, capacity=pipeline.MIGRATION_RING_CAPACITY)
+    else:
+        dca_output = Queue()
     alert_queue = Queue()
-    #starting communication with server (networking client)
-    #initial connection and client-side process run
-    #client's input queue = alert_queue
     hostname=socket.gethostname()
     addr=socket.gethostbyname(hostname)
-    server_hostname = (company_key.split(':'))[1]
-    server_addr = socket.gethostbyname(server_hostname)
-    server_port = int((company_key.split(':'))[2])
-    #alert_queue = Queue((alert_queue))
-    client = Client(address=addr,
-                    server_host=server_addr,
-                    server_port=server_port,
-                    name=hostname, 
-                    company_hash=company_key,
-                    alert_queue=alert_queue)  
-    
-    if not client.connect():
-        sys.exit(cyg.EXIT_FAIL)
-    
-    #now starting the actual algorithmic detection components    
-    sig_extractor = immune.SignalExtractor(
-        [pamp_extraction, safe_extraction]
-    )
-    anomaly_threshold = 0.65
+
+    #starting the detection components first - capture begins right away, while the
+    #models are loaded in the DCA process and the client authenticates against the server
+    sig_extractor = pipeline.signal_extractor()
     #run lymph node before DCA starts
-    lymph_node = immune.LymphNode(anomaly_threshold, dca_output, alert_queue)
+    profiles = ProfileStore(max_bytes=pipeline.PROFILE_MAX_BYTES, ttl=pipeline.PROFILE_TTL,
+                            half_life=pipeline.PROFILE_HALF_LIFE)
+    lymph_node = immune.LymphNode(pipeline.ANOMALY_THRESHOLD, dca_output, alert_queue, profiles=profiles,
+                                  metrics=stage_metrics('lymph_node'))
     lymph_node_process = Process(group=None, target=lymph_node.start, name="LymphNode")
     lymph_node_process.start()
-    #run DCA process with listening to to input_pipe
-    dca = immune.DCA(
-        dca_input_queue,
-        dca_output,
-        population_size=5,
-        migration_range=(5,15),
-        max_antigens=5,
-        csm_weights=[2,2],
-        k_weights=[2,-2],
-        segment_size=20,
-        signal_extractor=sig_extractor,
-        in_signal=2,
-    )
-    dca_process = Process(group=None, target=dca.start, name="DCA")
-    dca_process.start()
+    #run the DCA worker processes, each listening to its own input queue
+    dca_processes = []
+    for worker, dca_input_queue in enumerate(dca_input_queues):
+        name = "DCA" if DCA_WORKERS == 1 else f"DCA-{worker}"
+        dca = immune.DCA(
+            dca_input_queue,
+            dca_output,
+            population_size=5,
+            migration_range=(5,15),
+            max_antigens=pipeline.MAX_ANTIGENS,
+            csm_weights=[2,2],
+            k_weights=[2,-2],
+            segment_size=20,
+            signal_extractor=sig_extractor,
+            in_signal=2,
+            batch_size=pipeline.DCA_BATCH_SIZE,
+            batch_timeout_ms=pipeline.DCA_BATCH_TIMEOUT_MS,
+            metrics=stage_metrics(name.lower()),
+        )
+        dca_process = Process(group=None, target=run_dca, args=(dca, LAUNCH_TIME), name=name)
+        dca_process.start()
+        dca_processes.append(dca_process)
 
     #setting up netflow collection
-    hostname=socket.gethostname()
-    addr=socket.gethostbyname(hostname)
-    network_flows = {}
+    network_flows = FlowTable(
+        idle_timeout=pipeline.FLOW_IDLE_TIMEOUT,
+        active_timeout=pipeline.FLOW_ACTIVE_TIMEOUT,
+        max_flows=pipeline.MAX_FLOWS,
+    )
     sniff_filter = f"ip and (tcp or udp) and (host {addr})" #sniffing only packets with layer 3, and only TCP or UDP
     collector = NetworkCollector(
         bpf_filter=sniff_filter, 
         network_flows=network_flows, 
-        stdout=dca_input_queue
+        stdout=dca_input_queues[0] if DCA_WORKERS == 1 else dca_input_queues,
+        backend=CAPTURE_BACKEND,
+        host=addr,
+        emission=EmissionPolicy(pipeline.EMIT_EVERY_N, pipeline.EMIT_MIN_INTERVAL_MS, pipeline.EMIT_MIN_DELTA),
+        metrics=stage_metrics('collector'),
+        stats_interval=STATS_LOG_INTERVAL,
     )
     #starting sniffing process (data collection part of the system)
     sniffer_process = Process(group=None, target=collector.start, name="Sniffer")
     sniffer_process.start()
+    STARTUP.mark('capture started')
+
+    #starting communication with server (networking client)
+    #initial connection and client-side process run
+    #client's input queue = alert_queue
+    server_hostname = (company_key.split(':'))[1]
+    server_addr = socket.gethostbyname(server_hostname)
+    server_port = int((company_key.split(':'))[2])
+    spool = AlertSpool(SPOOL_DIR, SPOOL_SEGMENT_BYTES, SPOOL_MAX_BYTES)
+    if spool.pending():
+        logger.info(f"{spool.pending()} undelivered alerts spooled by the last run")
+    client = Client(address=addr,
+                    server_host=server_addr,
+                    server_port=server_port,
+                    name=hostname, 
+                    company_hash=company_key,
+                    alert_queue=alert_queue,
+                    metrics=stage_metrics('client'),
+                    batch_size=ALERT_BATCH_SIZE,
+                    batch_interval_ms=ALERT_BATCH_INTERVAL_MS,
+                    spool=spool,
+                    reconnect_min_delay=RECONNECT_MIN_DELAY,
+                    reconnect_max_delay=RECONNECT_MAX_DELAY)
+    if METRICS_ENABLED and METRICS_PORT != None:
+        serve_metrics(METRICS_DIR, METRICS_PORT)
+    with STARTUP.phase('connect'):
+        connected = client.maybe_reconnect()
+    if connected:
+        STARTUP.mark('connected')
+    else:
+        #detection keeps running - the alerts are spooled until the client reconnects (in send_alert)
+        logger.info("connection to the server failed - spooling alerts and reconnecting")
+    STARTUP.report(logger)
     
     terminator = cyg.Terminator()
+    next_stats = time.monotonic()+STATS_LOG_INTERVAL
+    dropped = 0
     while not terminator.kill:
-        #while the program is not terminated - sending alerts to server
+        #while the program is not terminated - sending alerts to server (blocks on the
+        #alert queue while there are none, for at most the client's IDLE_TIMEOUT)
         client.send_alert()
+        if RING_POLICY == DROP:
+            dropped = log_ring_drops(dca_input_queues, dropped)
+        if time.monotonic() >= next_stats:
+            log_transport_stats(dca_input_queues, dca_output)
+            next_stats = time.monotonic()+STATS_LOG_INTERVAL
     #graceful termination/cleanup
     client.disconnect()
-    dca_process.terminate()
-    sniffer_process.terminate()
-    dca_process.close()
-    sniffer_process.close()
+    log_transport_stats(dca_input_queues, dca_output)
+    logger.info(f"client stats: {client.stats()}")
+    spool.close()
+    stop_processes([sniffer_process, *dca_processes, lymph_node_process])
+    pipeline.release_rings([*dca_input_queues, dca_output])
     return
 
 if __name__=="__main__":
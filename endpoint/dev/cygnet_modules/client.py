@@ -1,15 +1,47 @@
+import base64
+import os
+import queue
+import random
 import socket
 import sys
 import threading
 from multiprocessing import Queue
 import json
 import threading
+import time
 from cygnet_modules import utils as cyg
-from cygnet_modules.encryption import CygCrypt
+from cygnet_modules.encryption import CygCrypt, SUPPORTED_CIPHERS, FERNET, X25519, RESUMPTION_NONCE_SIZE
+from cygnet_modules.metrics import Metrics, stage_durations
+from cygnet_modules.spool import AlertSpool
+
+#alert batching - a batch frame is sent once it holds BATCH_SIZE alerts, or BATCH_INTERVAL_MS
+#after its first alert
+BATCH_SIZE = 32
+BATCH_INTERVAL_MS = 50.0
+#max seconds the sender blocks on an empty alert queue - how soon it notices a stop/termination
+IDLE_TIMEOUT = 0.5
+#reconnection - jittered exponential backoff between RECONNECT_MIN_DELAY and RECONNECT_MAX_DELAY
+#seconds. the spooled alerts are replayed REPLAY_BATCHES frames at a time once reconnected
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 60.0
+REPLAY_BATCHES = 8
+#timeout of the socket's connect/handshake/sends (seconds) - a stalled server counts as down
+SOCKET_TIMEOUT = 10.0
+
+def backoff_delay(attempt, min_delay=RECONNECT_MIN_DELAY, max_delay=RECONNECT_MAX_DELAY):
+    """
+    delay before reconnection attempt number attempt (0 based) - "full jitter": uniform up to
+    the exponentially growing (capped) delay, so endpoints that lost the server together
+    don't all reconnect at once
+    """
+    return random.uniform(min_delay, min(max_delay, min_delay*2**attempt))
 
 class Client:    
     def __init__(self, address, server_host, server_port, name, 
-                 company_hash, alert_queue):
+                 company_hash, alert_queue, metrics: Metrics=None,
+                 batch_size=BATCH_SIZE, batch_interval_ms=BATCH_INTERVAL_MS, key_exchange=X25519,
+                 spool: AlertSpool=None, reconnect_min_delay=RECONNECT_MIN_DELAY,
+                 reconnect_max_delay=RECONNECT_MAX_DELAY, timeout=SOCKET_TIMEOUT):
         """
         :param address: _description_
         :param server_host: _description_
@@ -17,6 +49,14 @@ class Client:
         :param name: _description_
         :param company_hash: _description_
         :param alert_queue: _description_
+        :param metrics: latency metrics of the alert sending (None -> no instrumentation)
+        :param batch_size: max number of alerts sent in one frame
+        :param batch_interval_ms: max time an alert waits for its batch to fill up
+        :param key_exchange: key agreement of full handshakes (X25519 or DH_GROUP14)
+        :param spool: on-disk spool of the undelivered alerts (None -> they are dropped, counted)
+        :param reconnect_min_delay: first reconnection backoff (seconds)
+        :param reconnect_max_delay: cap of the reconnection backoff (seconds)
+        :param timeout: socket timeout (seconds)
         """        
         self._address = address
         if server_host == address:
@@ -28,74 +68,262 @@ class Client:
         self._name = name
         self._company_hash = company_hash
         self.alert_queue = alert_queue
+        self._metrics = metrics
+        self._batch_size = batch_size
+        self._batch_interval = batch_interval_ms/1000
+        self._batch = [] #pending alerts
+        self._batch_deadline = None
         self._stop_flag = threading.Event()
         self.crypt = CygCrypt()
+        self._cipher = FERNET #session cipher picked by the server (during authentication)
+        self._key_exchange = key_exchange
+        #resumption ticket issued by the server on the last handshake, and its secret
+        self._ticket = None
+        self._resumption_secret = None
+        self._nonce = None
+        #undelivered alerts and reconnection
+        self._spool = spool
+        self._reconnect_min_delay = reconnect_min_delay
+        self._reconnect_max_delay = reconnect_max_delay
+        self._timeout = timeout
+        self._reconnect_at = 0.0
+        self._reconnect_attempt = 0
+        #counters
+        self._sent = 0
+        self._dropped = 0
+        self._connections_lost = 0
+        self._reconnects = 0
 
     def is_connected(self):
         return self._socket!=None
     
     def enc(self):
-        self.crypt.generate_keys()
-        public_key = self.crypt.serialised_public_key()
-        self._socket.send(public_key)
-        server_public_key = self._socket.recv(cyg.RECV_SIZE)
-        self.crypt.shared_secret(server_public_key)
+        """
+        completes the handshake started by the credentials - resumes the session of the
+        ticket (if the server accepted it), else derives the key from the server's public key
+        """
+        handshake = json.loads(cyg.recv_frame(self._socket).decode())
+        if handshake['resumed']:
+            self.crypt.resume(self._resumption_secret, self._nonce, 
+                              base64.b64decode(handshake['nonce']), self._cipher, initiator=True)
+        else:
+            self.crypt.shared_secret(base64.b64decode(handshake['public_key']), 
+                                     self._cipher, initiator=True)
+        #the ticket to resume this session on the next connection
+        if 'ticket' in handshake:
+            self._ticket = base64.b64decode(handshake['ticket'])
+            self._resumption_secret = self.crypt.resumption_secret()
+        else:
+            self._ticket = None
 
     def connect(self):
+        if self.is_connected():
+            return False
         try:
-            if not self.is_connected():
-                self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self._socket.connect((self._server_host, self._server_port))
-                if self.authenticate():
-                    self.enc()
-                    return True
-            else:
-                return False
+            self._socket = socket.create_connection((self._server_host, self._server_port),
+                                                    timeout=self._timeout)
+            if self.authenticate():
+                self.enc()
+                return True
         except Exception as e:
             print(e)
-            return False
+        self._close_socket()
+        return False
         
     def disconnect(self):
+        if self._batch:
+            #(spooled if the connection is down)
+            self.flush()
+        if self._spool != None:
+            self._spool.flush()
         if self.is_connected():
+            self._close_socket()
+            return True
+        else:
+            return False
+
+    def _close_socket(self):
+        if self._socket != None:
             self._socket.close()
             self._socket = None
+
+    def connection_lost(self):
+        """drops the broken connection, the reconnection is attempted after a backoff delay"""
+        self._close_socket()
+        self._connections_lost += 1
+        self._reconnect_attempt = 0
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        self._reconnect_at = time.monotonic()+backoff_delay(self._reconnect_attempt, 
+                                                            self._reconnect_min_delay, 
+                                                            self._reconnect_max_delay)
+        self._reconnect_attempt += 1
+
+    def maybe_reconnect(self):
+        """
+        reconnects if the client isn't connected and the backoff delay is up (the next attempt
+        is scheduled on failure). returns True if connected
+        """
+        if self.is_connected():
             return True
-        else:
+        if time.monotonic() < self._reconnect_at:
             return False
+        if not self.connect():
+            self._schedule_reconnect()
+            return False
+        self._reconnect_attempt = 0
+        self._reconnects += 1
+        return True
         
     def stop(self):
         self._stop_flag.set()
+        #waking the sender if it is waiting on the queue (None alerts are skipped)
+        try:
+            self.alert_queue.put_nowait(None)
+        except queue.Full:
+            pass
                 
     def get_credentials(self):
         credentials = {
             'hostname': self._name,
-            'company_hash': self._company_hash
+            'company_hash': self._company_hash,
+            'ciphers': list(SUPPORTED_CIPHERS), #offered session ciphers, by preference
         }
+        #the key exchange starts with the credentials (the server's handshake reply completes it)
+        self.crypt.generate_keys(self._key_exchange)
+        credentials['public_key'] = base64.b64encode(self.crypt.serialised_public_key()).decode()
+        if self._ticket != None:
+            self._nonce = os.urandom(RESUMPTION_NONCE_SIZE)
+            credentials['ticket'] = base64.b64encode(self._ticket).decode()
+            credentials['nonce'] = base64.b64encode(self._nonce).decode()
         return credentials
     
     def authenticate(self):
         credentials = self.get_credentials()
         data = json.dumps(credentials).encode()
         try:
-            self._socket.send(data)
-            response = self._socket.recv(cyg.RECV_SIZE).decode()
-            if response!=cyg.AUTH_SUCCESS:
-                self.disconnect() #disconnection & return if fail
+            cyg.send_frame(self._socket, data)
+            response = cyg.recv_frame(self._socket).decode()
+            #"CONN:<cipher>" - the server picked one of the offered ciphers ("CONN" -> fernet)
+            result, _, cipher = response.partition(':')
+            if result!=cyg.AUTH_SUCCESS:
+                self._close_socket() #disconnection & return if fail
                 return False
+            self._cipher = cipher if cipher else FERNET
             return True
         except:
             return False
         
-    def send_alert(self):
+    def send_alert(self, timeout=IDLE_TIMEOUT):
         """
-        _summary_
-        """        
-        if not self.alert_queue.empty():
-            alert = self.alert_queue.get()
-            if alert == None:
+        waits for pending alerts (up to timeout seconds, or until the batch's interval is up),
+        adds all of them to the batch and sends the batch once it is full or its interval is up.
+        returns the number of alerts added. while the server is down the batches are spooled,
+        and once reconnected the spool is replayed (oldest first) before new batches are sent
+        """
+        if self.maybe_reconnect():
+            if self._spool != None and self._spool.pending():
+                self.replay_spool()
+                if self._spool.pending():
+                    timeout = 0.0
+        else:
+            timeout = min(timeout, max(0.0, self._reconnect_at-time.monotonic()))
+        if self._batch:
+            timeout = min(timeout, max(0.0, self._batch_deadline-time.monotonic()))
+        added = 0
+        try:
+            alert = self.alert_queue.get(timeout=timeout)
+            while True:
+                if alert != None:
+                    if not self._batch:
+                        self._batch_deadline = time.monotonic()+self._batch_interval
+                    self._batch.append(alert)
+                    added += 1
+                    if len(self._batch) >= self._batch_size:
+                        #a full batch is sent right away (the caller gets to check for a stop)
+                        self.flush()
+                        return added
+                alert = self.alert_queue.get_nowait()
+        except queue.Empty:
+            pass
+        if self._batch and time.monotonic() >= self._batch_deadline:
+            self.flush()
+        return added
+
+    def flush(self):
+        """
+        sends the pending alerts as one frame (a single encrypted JSON list) - spooled instead
+        if the connection is down or older alerts are still spooled
+        """
+        batch = [self.trace_alert(alert) if isinstance(alert, dict) else alert for alert in self._batch]
+        self._batch = []
+        if self._spool != None and self._spool.pending():
+            self._spool.append(batch)
+        elif not self.send_batch(batch):
+            self.undelivered(batch)
+        if self._metrics != None:
+            if self._spool != None:
+                self._metrics.gauge('client.spool_pending', self._spool.pending())
+            self._metrics.maybe_dump(time.monotonic())
+
+    def send_batch(self, batch):
+        """sends a batch frame, returns False if not connected/the connection is lost"""
+        if not self.is_connected():
+            return False
+        try:
+            cyg.send_frame(self._socket, self.crypt.encrypt_msg(json.dumps(batch)))
+        except OSError:
+            self.connection_lost()
+            return False
+        self._sent += len(batch)
+        return True
+
+    def undelivered(self, batch):
+        #spooling a batch that couldn't be sent (dropped without a spool)
+        if self._spool != None:
+            self._spool.append(batch)
+        else:
+            self._dropped += len(batch)
+
+    def replay_spool(self):
+        """
+        sends up to REPLAY_BATCHES frames of spooled alerts, oldest first (they are only
+        removed from the spool once sent)
+        """
+        for _ in range(REPLAY_BATCHES):
+            alerts = self._spool.peek(self._batch_size)
+            if not alerts or not self.send_batch(alerts):
                 return
-            data = self.crypt.encrypt_msg(json.dumps(alert))
-            self._socket.send(data)
+            self._spool.commit()
+
+    def stats(self):
+        stats = {
+            'sent': self._sent,
+            'dropped': self._dropped,
+            'connections_lost': self._connections_lost,
+            'reconnects': self._reconnects,
+        }
+        if self._spool != None:
+            stats['spool'] = self._spool.stats()
+        return stats
+
+    def trace_alert(self, alert: dict):
+        """
+        turns a traced alert's monotonic stamps (only meaningful on this machine) into the
+        per-stage durations, and stamps the wall-clock send time for the server
+        """
+        stamps = alert['stamps']
+        stamps['sent'] = time.monotonic()
+        if self._metrics != None:
+            self._metrics.observe('client.alert_queue', stamps['sent']-stamps['alerted'])
+            self._metrics.observe('endpoint.update_to_sent', stamps['sent']-stamps['update'])
+        return {
+            'flow': alert['flow'],
+            'trace_id': alert['trace_id'],
+            'stages_ms': stage_durations(stamps),
+            'sent': time.time(),
+        }
         
     def send_alerts(self):
         while not self._stop_flag.is_set():
@@ -110,7 +338,7 @@ class Client:
 
     def test(self, example="10.0.0.1:1-10.0.0.5:443"):
         try:
-            self._socket.send(self.crypt.encrypt_msg(f"TEST: {example}"))
+            cyg.send_frame(self._socket, self.crypt.encrypt_msg(json.dumps([f"TEST: {example}"])))
             return True
         except Exception as e:
             raise e
@@ -131,11 +359,10 @@ def main(company_key, raw_alert_queue):
                     company_hash=company_key,
                     alert_queue=alert_queue)
     
-    if not client.authenticate():
-        return
-    
+    #(connects in send_alert - and reconnects with backoff whenever the server is lost)
     terminator = cyg.Terminator()
     while not terminator.kill:
+        #blocks on the alert queue while idle (checking for termination every IDLE_TIMEOUT)
         client.send_alert()
     client.disconnect()
     return
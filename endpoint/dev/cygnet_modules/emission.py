@@ -0,0 +1,104 @@
+import numpy as np
+from cygnet_modules.netflow import FlowStore, SPKTS, DPKTS, N_FEATURES
+
+class EmissionPolicy:
+    """
+    Decides which flow updates the collector emits to the DCA, so a bulk transfer doesn't
+    turn every packet into an inference request. An update of a flow is emitted only if,
+    since the flow's last emitted update:
+        - at least every_n packets were seen
+        - at least min_interval_ms milliseconds (packet time) passed
+        - some feature changed by more than min_delta, relative to its last emitted value
+    The final state of every ended flow is always emitted (see final). The default policy
+    emits every update.
+
+    The state of a flow's last emitted update is kept by flow store slot (reset by start),
+    in columns allocated only for the conditions the policy uses - packets (uint32), time
+    since the flow's start (float32 - ~0.1ms precision over the default 1800s active timeout)
+    and the feature row (float32, for min_delta) - so the default policy costs no memory per flow.
+
+    Attributes:
+        every_n (int): packets between emitted updates of a flow (1 -> every packet)
+        min_interval_ms (float): min milliseconds between emitted updates of a flow (0 -> no limit)
+        min_delta (float): min relative change of some feature (0 -> any update)
+    """
+    def __init__(self, every_n=1, min_interval_ms=0.0, min_delta=0.0):
+        self._every_n = every_n
+        self._min_interval = min_interval_ms/1000
+        self._min_delta = min_delta
+        self._emit_all = every_n <= 1 and min_interval_ms <= 0 and min_delta <= 0
+        #last emitted update of every slot (None -> not needed by the policy)
+        self._packets = np.zeros(0, dtype=np.uint32) if every_n > 1 else None
+        self._offsets = np.zeros(0, dtype=np.float32) if min_interval_ms > 0 else None
+        self._rows = np.zeros((0, N_FEATURES), dtype=np.float32) if min_delta > 0 else None
+        self._emitted = 0
+        self._suppressed = 0
+        self._final = 0
+
+    def _columns(self):
+        return [column for column in (self._packets, self._offsets, self._rows) if column is not None]
+
+    def _grow(self, capacity):
+        #grows the state columns to (at least) the flow store's capacity
+        for name in ('_packets', '_offsets', '_rows'):
+            column = getattr(self, name)
+            if column is not None:
+                grown = np.zeros((capacity,)+column.shape[1:], dtype=column.dtype)
+                grown[:len(column)] = column
+                setattr(self, name, grown)
+
+    def start(self, store: FlowStore, slot):
+        """resets the state of a new flow's slot - nothing emitted yet (its first packet never is)"""
+        if self._emit_all:
+            return
+        if slot >= len(self._columns()[0]):
+            self._grow(store.capacity())
+        for column in self._columns():
+            column[slot] = 0
+
+    def admit(self, store: FlowStore, slot, now) -> bool:
+        """returns whether the flow's update is emitted, recording it as the flow's last emitted one"""
+        if not self._emit_all:
+            row = store.features[slot]
+            if self._packets is not None:
+                packets = row[SPKTS]+row[DPKTS]
+                if packets-self._packets[slot] < self._every_n:
+                    self._suppressed += 1
+                    return False
+            if self._offsets is not None:
+                offset = now-store.times[slot, 0]
+                if offset-self._offsets[slot] < self._min_interval:
+                    self._suppressed += 1
+                    return False
+            if self._rows is not None:
+                last = self._rows[slot]
+                change = np.abs(row-last)
+                if not np.any(change > self._min_delta*np.abs(last)):
+                    self._suppressed += 1
+                    return False
+                last[:] = row
+            if self._packets is not None:
+                self._packets[slot] = packets
+            if self._offsets is not None:
+                self._offsets[slot] = offset
+        self._emitted += 1
+        return True
+
+    def final(self):
+        #the final state of an ended flow - always emitted
+        self._final += 1
+
+    def nbytes(self):
+        """bytes held by the per-flow state columns"""
+        return sum(column.nbytes for column in self._columns())
+
+    def stats(self):
+        """returns the emitted/suppressed update counters, the emitted final states and the state size"""
+        total = self._emitted+self._suppressed
+        return {
+            'emitted': self._emitted,
+            'suppressed': self._suppressed,
+            'final': self._final,
+            'suppressed_ratio': self._suppressed/total if total else 0.0,
+            'state_bytes': self.nbytes(),
+        }
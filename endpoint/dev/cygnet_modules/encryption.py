@@ -1,10 +1,46 @@
 from cryptography.hazmat.backends import default_backend
 from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.asymmetric import dh
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
 from cryptography.hazmat.primitives.serialization import PublicFormat, Encoding, load_der_public_key
 import base64
+import json
+import os
+import struct
+import time
+
+#session ciphers
+FERNET = 'fernet' #the original cipher - AES-CBC + HMAC-SHA256 base64 tokens
+AES_GCM = 'aes-gcm'
+CHACHA20_POLY1305 = 'chacha20-poly1305'
+#supported ciphers, in order of preference (offered by the client, picked by the server)
+SUPPORTED_CIPHERS = (AES_GCM, CHACHA20_POLY1305, FERNET)
+_AEADS = {AES_GCM: AESGCM, CHACHA20_POLY1305: ChaCha20Poly1305}
+#AEAD messages - 8 byte big endian message counter + ciphertext + 16 byte tag. the 12 byte
+#nonce is the sender's direction prefix + the counter, so the two directions never share a nonce
+_COUNTER = struct.Struct('!Q')
+_INITIATOR_PREFIX = b'\x00\x00\x00\x01'
+_RESPONDER_PREFIX = b'\x00\x00\x00\x02'
+
+#key agreements
+DH_GROUP14 = 'dh-group14' #2048 bit finite field DH (RFC 3526 group 14)
+X25519 = 'x25519'
+#session resumption - ticket lifetime (seconds) and the nonce size of each side
+TICKET_LIFETIME = 24*3600
+RESUMPTION_NONCE_SIZE = 16
+_TICKET_NONCE_SIZE = 12
+_TICKET_AAD = b'cygnet session ticket'
+
+def negotiate_cipher(offered):
+    """returns the first of the peer's offered ciphers that is supported (FERNET if none/no offer)"""
+    for cipher in offered or ():
+        if cipher in SUPPORTED_CIPHERS:
+            return cipher
+    return FERNET
 
 class CygCrypt:
     #setting param numbers (p, g) as defined in RFC-3526 (DH group 14)
@@ -17,16 +53,29 @@ class CygCrypt:
         self.public_key = public_key
         self._private_key = private_key
         self._encryption_key = None
+        self.cipher = None
+        self._session = None #the session cipher object, created once per key
+        self._send_prefix = None
+        self._recv_prefix = None
+        self._send_counter = 0
+        self._recv_counter = 0
+        self._resumption_secret = None
 
-    def generate_keys(self):
-        #generating new keys (public+private) for one side of DH exchange
-        private_key = CygCrypt._parameters.generate_private_key()
+    def generate_keys(self, key_exchange=DH_GROUP14):
+        #generating new keys (public+private) for one side of the key exchange (DH or X25519)
+        if key_exchange == X25519:
+            private_key = X25519PrivateKey.generate()
+        else:
+            private_key = CygCrypt._parameters.generate_private_key()
         self.public_key = private_key.public_key()
         self._private_key = private_key
         return self.public_key
 
-    def shared_secret(self, peer_public_key: bytes):
-        """gets peer's public key and derives the encryption key to be used"""
+    def shared_secret(self, peer_public_key: bytes, cipher=FERNET, initiator=True):
+        """
+        gets peer's public key and derives the encryption key to be used, then sets up
+        the session cipher (the client is the initiator, the server the responder)
+        """
 
         #deriving shared secret
         shared_key = self._private_key.exchange(CygCrypt.deserialise_public_key(peer_public_key))
@@ -37,18 +86,131 @@ class CygCrypt:
             salt=None,
             info=b'handshake data'
         ).derive(shared_key)
-    
+        self.set_cipher(cipher, initiator)
+
+    def resume(self, resumption_secret: bytes, client_nonce: bytes, server_nonce: bytes,
+               cipher=FERNET, initiator=True):
+        """
+        derives a fresh session key from the resumption secret of a previous session and
+        both sides' nonces (no key exchange), then sets up the session cipher
+        """
+        self._encryption_key = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=client_nonce+server_nonce,
+            info=b'resumed session'
+        ).derive(resumption_secret)
+        self.set_cipher(cipher, initiator)
+
+    def resumption_secret(self):
+        """secret the session can be resumed with (derived from the session key)"""
+        return self._resumption_secret
+
+    def set_cipher(self, cipher, initiator=True):
+        """creates the session cipher of the derived key (message counters start over)"""
+        if cipher == FERNET:
+            self._session = Fernet(base64.urlsafe_b64encode(self._encryption_key))
+        elif cipher in _AEADS:
+            self._session = _AEADS[cipher](self._encryption_key)
+        else:
+            raise Exception('UNSUPPORTED CIPHER')
+        self._resumption_secret = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'resumption'
+        ).derive(self._encryption_key)
+        self.cipher = cipher
+        self._send_prefix = _INITIATOR_PREFIX if initiator else _RESPONDER_PREFIX
+        self._recv_prefix = _RESPONDER_PREFIX if initiator else _INITIATOR_PREFIX
+        self._send_counter = 0
+        self._recv_counter = 0
+
     def serialised_public_key(self):
         return self.public_key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
-    
+
     @staticmethod
     def deserialise_public_key(pkey: bytes):
         return load_der_public_key(pkey, backend=default_backend())
 
+    @staticmethod
+    def key_exchange_of(pkey: bytes):
+        """returns the key agreement (DH_GROUP14 or X25519) of a serialised public key"""
+        if isinstance(CygCrypt.deserialise_public_key(pkey), X25519PublicKey):
+            return X25519
+        return DH_GROUP14
+
+    def encrypt(self, data: bytes) -> bytes:
+        if self.cipher == FERNET:
+            return self._session.encrypt(data)
+        self._send_counter += 1
+        counter = _COUNTER.pack(self._send_counter)
+        return counter+self._session.encrypt(self._send_prefix+counter, data, None)
+
+    def decrypt(self, encrypted: bytes) -> bytes:
+        if self.cipher == FERNET:
+            return self._session.decrypt(encrypted)
+        counter = _COUNTER.unpack_from(encrypted)[0]
+        #messages arrive in order - an old counter is a replayed message
+        if counter <= self._recv_counter:
+            raise InvalidTag('REPLAYED MESSAGE')
+        data = self._session.decrypt(self._recv_prefix+encrypted[:_COUNTER.size],
+                                     encrypted[_COUNTER.size:], None)
+        self._recv_counter = counter
+        return data
+
     def encrypt_msg(self, msg):
-        f = Fernet(base64.urlsafe_b64encode(self._encryption_key))
-        return f.encrypt(msg.encode())
+        return self.encrypt(msg.encode())
 
     def decrypt_msg(self, encrypted):
-        f = Fernet(base64.urlsafe_b64encode(self._encryption_key))
-        return f.decrypt(encrypted).decode()
\ No newline at end of file
+        return self.decrypt(encrypted).decode()
+
+class SessionTickets:
+    """
+    Issues and redeems session resumption tickets - a session's resumption secret, the
+    endpoint's hostname and an expiry time, encrypted (AES-GCM) under the server's ticket key.
+    the endpoint presents the ticket when it reconnects, so both sides can derive a new
+    session key from the secret without a key exchange. with a persisted ticket key,
+    tickets stay valid across server restarts
+
+    Attributes:
+        key (bytes): 32 byte ticket key
+        lifetime (float): seconds a ticket is valid for
+    """
+    def __init__(self, key: bytes, lifetime=TICKET_LIFETIME):
+        self._aead = AESGCM(key)
+        self._lifetime = lifetime
+
+    def issue(self, resumption_secret: bytes, hostname):
+        nonce = os.urandom(_TICKET_NONCE_SIZE)
+        state = json.dumps({
+            'secret': base64.b64encode(resumption_secret).decode(),
+            'hostname': hostname,
+            'expires': time.time()+self._lifetime,
+        }).encode()
+        return nonce+self._aead.encrypt(nonce, state, _TICKET_AAD)
+
+    def redeem(self, ticket: bytes, hostname):
+        """returns the resumption secret of a valid ticket issued to the hostname, else None"""
+        try:
+            state = json.loads(self._aead.decrypt(ticket[:_TICKET_NONCE_SIZE], ticket[_TICKET_NONCE_SIZE:], _TICKET_AAD))
+        except (InvalidTag, ValueError):
+            return None
+        if state['hostname'] != hostname or state['expires'] < time.time():
+            return None
+        return base64.b64decode(state['secret'])
+
+def load_ticket_key(path):
+    """reads the ticket key file, creating it (with a new random key, owner-only) if missing"""
+    try:
+        with open(path, 'rb') as f:
+            key = f.read()
+        if len(key) == 32:
+            return key
+    except FileNotFoundError:
+        pass
+    key = AESGCM.generate_key(bit_length=256)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
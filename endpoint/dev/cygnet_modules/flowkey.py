@@ -0,0 +1,84 @@
+"""
+Canonical (direction-normalised) flow keys.
+
+A flow key packs (ip_a, port_a, ip_b, port_b, proto) into a single int, where the
+(ip, port) endpoints are ordered so both directions of a flow map to the same key:
+    bits 56-103: min endpoint (ip << 16 | port)
+    bits 8-55:   max endpoint (ip << 16 | port)
+    bits 0-7:    transport protocol number
+The keys the collector emits (directed_key) also carry the flow's direction in bit 104 -
+set when its initiator (the sender of its first packet) is the max endpoint - so the
+"{sip}:{sport}-{dip}:{dport}" string form, only rendered (key_to_str) when an alert leaves
+the detection process, starts with the initiator. the flow table uses the canonical keys.
+"""
+import socket
+import struct
+import numpy as np
+
+#transport protocol numbers (udp=17, tcp=6)
+PROTO_TCP = 6
+PROTO_UDP = 17
+PROTO_NAMES = {PROTO_TCP: 'TCP', PROTO_UDP: 'UDP'}
+PROTO_NUMBERS = {'TCP': PROTO_TCP, 'UDP': PROTO_UDP}
+
+_ipv4 = struct.Struct('!I')
+_ENDPOINT = 0xFFFFFFFFFFFF
+_LOW = 0xFFFFFFFFFFFFFFFF
+DIRECTION_BIT = 1 << 104
+
+def ip_to_int(ip: str) -> int:
+    return _ipv4.unpack(socket.inet_aton(ip))[0]
+
+def int_to_ip(ip: int) -> str:
+    return socket.inet_ntoa(_ipv4.pack(ip))
+
+def make_key(sip: int, sport: int, dip: int, dport: int, proto: int) -> int:
+    """returns the canonical key of the flow between (sip, sport) and (dip, dport)"""
+    a = (sip << 16) | sport
+    b = (dip << 16) | dport
+    if a > b:
+        a, b = b, a
+    return (a << 56) | (b << 8) | proto
+
+def directed_key(key: int, sip: int, sport: int) -> int:
+    """returns the key with the flow's direction - (sip, sport) is the flow's initiator"""
+    if ((key >> 56) & _ENDPOINT) == (sip << 16) | sport:
+        return key
+    return key | DIRECTION_BIT
+
+def canonical_key(key: int) -> int:
+    return key & (DIRECTION_BIT-1)
+
+def split_key(key: int):
+    """returns (ip_a, port_a, ip_b, port_b, proto) of a (canonical or directed) key"""
+    a = (key >> 56) & _ENDPOINT
+    b = (key >> 8) & _ENDPOINT
+    return a >> 16, a & 0xFFFF, b >> 16, b & 0xFFFF, key & 0xFF
+
+def split_keys(keys):
+    #flow keys -> (N, 2) uint64 [high, low] array (the compact form keys travel in between processes)
+    return np.array([(key >> 64, key & _LOW) for key in keys], dtype=np.uint64).reshape(-1, 2)
+
+def join_keys(pairs: np.ndarray):
+    #(N, 2) uint64 [high, low] array -> flow keys (shifted as python ints of an object array)
+    return ((pairs[:, 0].astype(object) << 64) | pairs[:, 1].astype(object)).tolist()
+
+def key_shard(key: int, n_shards: int) -> int:
+    """
+    returns the shard (0..n_shards-1) of a canonical key - a stable hash, identical across
+    processes and runs, so all the updates of a flow always go to the same worker
+    """
+    key &= DIRECTION_BIT-1
+    h = ((key >> 64) ^ key) & 0xFFFFFFFFFFFFFFFF
+    h = ((h ^ (h >> 33))*0xFF51AFD7ED558CCD) & 0xFFFFFFFFFFFFFFFF
+    return (h ^ (h >> 33)) % n_shards
+
+def key_to_str(key: int) -> str:
+    """
+    renders a key in the "{sip}:{sport}-{dip}:{dport}" alert format - from the initiator
+    for a directed key (from the min endpoint for a canonical one)
+    """
+    ip_a, port_a, ip_b, port_b, _ = split_key(key)
+    if key & DIRECTION_BIT:
+        ip_a, port_a, ip_b, port_b = ip_b, port_b, ip_a, port_a
+    return f"{int_to_ip(ip_a)}:{port_a}-{int_to_ip(ip_b)}:{port_b}"
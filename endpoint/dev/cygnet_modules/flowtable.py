@@ -0,0 +1,192 @@
+from collections import OrderedDict
+from cygnet_modules.netflow import FlowStore, Netflow, PacketInfo, TCP_SYN
+from cygnet_modules.flowkey import PROTO_TCP
+
+#flow end (eviction) reasons
+IDLE_TIMEOUT = 'idle'
+ACTIVE_TIMEOUT = 'active'
+TCP_CLOSE = 'tcp_close'
+CAPACITY = 'capacity'
+FLUSH = 'flush'
+
+class FlowTable:
+    """
+    Flow table (canonical flow key -> FlowStore slot) with flow lifecycle management.
+    The flows' counters live in a columnar FlowStore; the table only maps keys to slots,
+    kept in least-recently-seen order, so idle flows are always at the front.
+
+    A flow ends when:
+        - no packet was seen for idle_timeout seconds (checked every sweep_interval seconds)
+        - it lived longer than active_timeout seconds (checked when its next packet arrives,
+          which then starts a new flow)
+        - its tcp connection was torn down (FIN from both sides, or RST)
+        - the table is full (max_flows) and it is the least recently seen flow
+    Every ended flow is handed to on_expire(key, flow), so a final feature vector can be emitted.
+    A torn down tcp flow's key is remembered for close_grace seconds, so the late packets of the
+    connection (the last ACK, retransmitted FINs) don't start a new flow - a SYN does.
+    All times are packet (capture) timestamps, so replays behave like live captures.
+
+    Attributes:
+        idle_timeout (float): seconds without packets before a flow ends (None -> never)
+        active_timeout (float): max lifetime of a flow in seconds (None -> unlimited)
+        max_flows (int): max number of tracked flows (None -> unlimited)
+        sweep_interval (float): seconds between idle flow sweeps
+        on_expire (callable): called with (key, flow) for every ended flow - the Netflow
+            view is only valid during the call, its slot is reused afterwards
+        capacity (int): initial number of FlowStore slots (doubled when full)
+        close_grace (float): seconds the late packets of a torn down tcp flow are ignored for
+    """
+    def __init__(self,
+            idle_timeout=60.0,
+            active_timeout=1800.0,
+            max_flows=65536,
+            sweep_interval=1.0,
+            on_expire=None,
+            capacity=1024,
+            close_grace=10.0,
+        ):
+        self._idle_timeout = idle_timeout
+        self._active_timeout = active_timeout
+        self._max_flows = max_flows
+        self._sweep_interval = sweep_interval
+        self._on_expire = on_expire
+        self._flows = OrderedDict() #key -> slot
+        self._store = FlowStore(capacity if max_flows == None else min(capacity, max_flows))
+        self._next_sweep = None
+        self._close_grace = close_grace
+        self._closed = OrderedDict() #key -> time its tcp connection was torn down (oldest first)
+        self._late_packets = 0
+        self._evictions = {
+            IDLE_TIMEOUT: 0,
+            ACTIVE_TIMEOUT: 0,
+            TCP_CLOSE: 0,
+            CAPACITY: 0,
+            FLUSH: 0,
+        }
+
+    def set_on_expire(self, on_expire):
+        self._on_expire = on_expire
+
+    def __len__(self):
+        return len(self._flows)
+
+    def __contains__(self, key):
+        return key in self._flows
+
+    def __getitem__(self, key):
+        return Netflow.view(self._store, self._flows[key])
+
+    def get_store(self):
+        return self._store
+
+    def keys(self):
+        return self._flows.keys()
+
+    def values(self):
+        return (Netflow.view(self._store, slot) for slot in self._flows.values())
+
+    def items(self):
+        return ((key, Netflow.view(self._store, slot)) for key, slot in self._flows.items())
+
+    def slots(self):
+        return self._flows.values()
+
+    def get_sweep_interval(self):
+        return self._sweep_interval
+
+    def lookup(self, key, now):
+        """
+        returns the slot of the key's live flow (marking it as most recently seen), or None
+        if there is none - including when the flow just exceeded its active timeout
+        """
+        slot = self._flows.get(key)
+        if slot == None:
+            return None
+        if self._active_timeout != None and now-self._store.start_time(slot) >= self._active_timeout:
+            self.end(key, ACTIVE_TIMEOUT)
+            return None
+        self._flows.move_to_end(key)
+        return slot
+
+    def insert(self, key, info: PacketInfo):
+        """
+        starts a new flow with its first packet, evicting the least recently seen flow
+        if the table is full. returns the flow's slot
+        """
+        if self._max_flows != None and len(self._flows) >= self._max_flows:
+            self.end(next(iter(self._flows)), CAPACITY)
+        slot = self._store.allocate_from_info(key, info)
+        self._flows[key] = slot
+        return slot
+
+    def is_late(self, key, info: PacketInfo):
+        """
+        returns whether the packet (of a key with no live flow) is a late packet of a tcp
+        connection torn down less than close_grace seconds ago - to be ignored
+        """
+        closed = self._closed.get(key)
+        if closed == None:
+            return False
+        if info.proto == PROTO_TCP and not info.flags & TCP_SYN and info.time-closed < self._close_grace:
+            self._late_packets += 1
+            return True
+        #a new connection (or a packet past the grace period) - the key starts a new flow
+        del self._closed[key]
+        return False
+
+    def end(self, key, reason):
+        """removes the flow of the key from the table, handing it to on_expire"""
+        slot = self._flows.pop(key)
+        self._evictions[reason] += 1
+        if reason == TCP_CLOSE and self._close_grace:
+            self._closed[key] = self._store.times[slot, 1]
+            self._closed.move_to_end(key)
+            if self._max_flows != None and len(self._closed) > self._max_flows:
+                self._closed.popitem(last=False)
+        if self._on_expire != None:
+            self._on_expire(key, Netflow.view(self._store, slot))
+        self._store.release(slot)
+
+    def feature_rows(self):
+        """returns (keys, (N, 8) feature rows) of all tracked flows"""
+        keys = list(self._flows.keys())
+        slots = list(self._flows.values())
+        return keys, self._store.feature_rows(slots)
+
+    def sweep(self, now):
+        """
+        ends the flows that have been idle for idle_timeout and forgets the torn down flows
+        past their close grace (at most once per sweep_interval)
+        """
+        if self._next_sweep != None and now < self._next_sweep:
+            return
+        self._next_sweep = now+self._sweep_interval
+        closed = self._closed
+        while closed and next(iter(closed.values())) <= now-self._close_grace:
+            closed.popitem(last=False)
+        if self._idle_timeout == None:
+            return
+        deadline = now-self._idle_timeout
+        flows = self._flows
+        last_seen = self._store.times
+        while flows:
+            key = next(iter(flows))
+            if last_seen[flows[key], 1] > deadline:
+                break
+            self.end(key, IDLE_TIMEOUT)
+
+    def flush(self):
+        """ends all the flows in the table (e.g. on shutdown or at the end of a capture)"""
+        while self._flows:
+            self.end(next(iter(self._flows)), FLUSH)
+
+    def stats(self):
+        """returns the number of tracked flows, store size and the eviction counters (by reason)"""
+        return {
+            'flows': len(self._flows),
+            'capacity': self._store.capacity(),
+            'store_bytes': self._store.nbytes(),
+            'evictions': dict(self._evictions),
+            'closed': len(self._closed),
+            'late_packets': self._late_packets,
+        }
@@ -1,168 +1,413 @@
 import numpy as np
-import random
+import time
+import queue
+import logging
 from multiprocessing import Process, Queue
+from cygnet_modules import flowkey
+from cygnet_modules.profiles import ProfileStore
+from cygnet_modules.metrics import Metrics, new_trace_id, queue_depth
+
+logger = logging.getLogger(__name__)
+
+def batch_stats(counters: dict):
+    """throughput/latency summary of a stage's batch counters (items, batches, busy seconds)"""
+    stats = dict(counters)
+    batches = counters['batches']
+    busy = counters['busy_seconds']
+    stats['mean_batch_seconds'] = busy/batches if batches else 0.0
+    stats['items_per_busy_second'] = counters['items']/busy if busy > 0 else 0.0
+    return stats
+
+def _count_batch(counters: dict, items, seconds):
+    counters['items'] += items
+    counters['batches'] += 1
+    counters['busy_seconds'] += seconds
+    if seconds > counters['max_batch_seconds']:
+        counters['max_batch_seconds'] = seconds
 
 class SignalExtractor:
-    def __init__(self, funcs):
+    def __init__(self, funcs, initialiser=None, batch_funcs=None):
+        """
+        :param funcs: signal extraction functions (data -> signal value). a function with an
+            n_signals attribute extracts that many signals at once (data -> n_signals values)
+        :param initialiser: called once in the process running the extraction, before
+            the first extraction (e.g. to load and warm up models)
+        :param batch_funcs: optional batched versions of funcs, in the same order
+            ((N, n_features) batch -> (N,) or (N, n_signals) signal values)
+        """
         self._funcs = funcs
+        self._initialiser = initialiser
+        self._batch_funcs = batch_funcs
+        self._widths = [getattr(f, 'n_signals', 1) for f in funcs]
+        self._n_signals = sum(self._widths)
+
+    def n_signals(self):
+        return self._n_signals
+
+    def initialise(self):
+        if self._initialiser != None:
+            self._initialiser()
 
     def extract(self, data):
-        signals = np.zeros(shape=len(self._funcs))
+        signals = np.zeros(shape=self._n_signals)
         i=0
-        for f in self._funcs:
-            signals[i]=f(data)
-            i+=1
+        for f, width in zip(self._funcs, self._widths):
+            if width == 1:
+                signals[i]=f(data)
+            else:
+                signals[i:i+width]=np.reshape(f(data), width)
+            i+=width
         return signals
 
-class Antigen:
-    def __init__(self, 
-            antigen_id
-        ):
-        self._id = antigen_id
+    def extract_batch(self, data):
+        """returns the (N, n_signals) signal matrix of a (N, n_features) batch"""
+        n = len(data)
+        signals = np.zeros(shape=(n, self._n_signals))
+        if self._batch_funcs != None:
+            i = 0
+            for f, width in zip(self._batch_funcs, self._widths):
+                signals[:, i:i+width] = np.reshape(f(data), (n, width))
+                i += width
+        else:
+            for j in range(len(data)):
+                signals[j] = self.extract(data[j:j+1])
+        return signals
 
-    def get_id(self):
-        return self._id
-            
-    def __eq__(self, other):
-        if self._id == other.get_id():
-            return True
-        return False
-        
-class AntigenProfile(Antigen):
-    def __init__(self, antigen_id):
-        super().__init__(antigen_id)
-        self._mature_presentation = 0
-        self._total_presentaion = 0
+class AntigenIds:
+    """
+    interns the (arbitrary precision int) flow keys of sampled antigens as small int ids, so the
+    DC antigen stores can be int64 arrays. an id is reference counted (once per stored copy)
+    and recycled once no cell holds its antigen anymore. the keys are also kept split in
+    uint64 pairs (flowkey.split_keys), so the keys of a migration are a single array lookup
+    """
+    def __init__(self, capacity=1024):
+        self._ids = {} #key -> id
+        self._keys = [] #id -> key
+        self._refs = [] #id -> number of stored copies
+        self._free = []
+        self._pairs = np.zeros(shape=(capacity, 2), dtype=np.uint64) #id -> [high, low] of the key
+
+    def __len__(self):
+        return len(self._ids)
+
+    def acquire(self, key):
+        #returns the id of the key, taking a reference to it
+        ag_id = self._ids.get(key)
+        if ag_id == None:
+            if self._free:
+                ag_id = self._free.pop()
+                self._keys[ag_id] = key
+            else:
+                ag_id = len(self._keys)
+                self._keys.append(key)
+                self._refs.append(0)
+                if ag_id == len(self._pairs):
+                    self._pairs = np.concatenate([self._pairs, np.zeros_like(self._pairs)])
+            self._ids[key] = ag_id
+            self._pairs[ag_id] = flowkey.split_keys((key,))
+        self._refs[ag_id] += 1
+        return ag_id
+
+    def pairs(self, ids)->np.ndarray:
+        #(N, 2) uint64 split keys of the ids
+        return self._pairs[ids]
+
+    def release(self, ids):
+        #drops a reference to every id, recycling the ids no cell holds anymore
+        for ag_id in ids:
+            self._refs[ag_id] -= 1
+            if self._refs[ag_id] == 0:
+                del self._ids[self._keys[ag_id]]
+                self._keys[ag_id] = None
+                self._free.append(ag_id)
 
-    @staticmethod
-    def init_from_antigen(antigen: Antigen):
-        return AntigenProfile(antigen_id=antigen.get_id())
-    
-    def presented(self, context):
-        if context==1:
-            self._mature_presentation+=1
-        self._total_presentaion+=1
-    
-    def mcav(self):
-        return self._mature_presentation/(self._total_presentaion+1)
-    
 class DCOutput:
+    """
+    presentation of a migrated DC to the lymph node
+
+    Attributes:
+    k (float): context value
+    csm (float): costimulation level
+    keys (ndarray): (N, 2) uint64 flow keys of the sampled antigens, split in [high, low]
+        (flowkey.split_keys)
+    stamps (tuple): monotonic trace stamps (flow update that triggered the migration, migration),
+        None if not instrumented
+    """
     def __init__(self,
             k, 
             csm,
-            antigens
+            keys,
+            stamps=None,
     ):
         self.k = k
         self.csm = csm
-        self.antigens = antigens
+        self.keys = keys
+        self.stamps = stamps
     
-class DC:
+class DCPopulation:
     """
-    represents a Dendritic Cell (DC) of the immune system
+    array-backed population of Dendritic Cells - the state of all the cells is kept in
+    per-population arrays (a row/entry per cell), so updating, migration detection and resets
+    are single NumPy operations across the whole population
     
     Attributes:
-    antigen_store (list): list of sampled antigens
-    max_antigens (int): max antigens to sample
-    migration_threshokd (float): migration threshold; if csm>migration_threshold, migration occurs
-    signals (ndarray): signal matrix - 
-        row 1 - pamp signal: [x1, x2, ..., Xn],\n
-        row 2 - safe signal: [x1, x2, ..., Xn],\n
-        row 3 - damp signal: [x1, x2, ..., Xn]
-    weights (ndarray) weights to apply on signals for output signals
-    output signals (ndarray):
-            row 0: csm => costimulation level (accumulated in RT until csm > lifespan)
-            row 1: k => context value (accumulated in RT)
+    migration_thresholds (ndarray): (population,) per-cell migration thresholds
+    max_antigens (int): max antigens a cell holds (see DCA.sample_antigen for full stores)
+    weights (ndarray): (2, in_signal) weights to apply on signals for output signals
+    signals (ndarray): (population, in_signal) accumulated input signals of every cell
+    output_signals (ndarray): (population, 2) output signals of every cell -
+            column 0: csm => costimulation level
+            column 1: k => context value
+    antigen_ids (ndarray): (population, max_antigens) ids of the antigens sampled by every cell
+    ag_counts (ndarray): (population,) number of antigens sampled by every cell (its next free slot)
     """
-    def __init__(self, 
-            migration_threshold, 
-            max_antigens, 
-            csm_weights, 
-            k_weights, 
-            in_signal=2, 
+    def __init__(self,
+            migration_thresholds,
+            max_antigens,
+            csm_weights,
+            k_weights,
+            in_signal=2,
         ):
-            self._migration_threshold = migration_threshold
-            self._max_antigens = max_antigens
-            self._ag_count = 0
-            self._antigen_store = []
-            self._weights = np.array([csm_weights[0:in_signal], k_weights[0:in_signal]])
-            self._in_signal = in_signal
-            self._signals = np.zeros(shape=in_signal, dtype=np.float64)
-            self._output_signals = np.zeros(shape=2, dtype=np.float64)
-            
-    def phagocytose(self, antigen):
-        if self._ag_count < self._max_antigens:
-            self._antigen_store.append(antigen)
+            self.migration_thresholds = np.asarray(migration_thresholds, dtype=np.float64)
+            size = len(self.migration_thresholds)
+            self.max_antigens = max_antigens
+            self.weights = np.array([csm_weights[0:in_signal], k_weights[0:in_signal]], dtype=np.float64)
+            self.signals = np.zeros(shape=(size, in_signal), dtype=np.float64)
+            self.output_signals = np.zeros(shape=(size, 2), dtype=np.float64)
+            self.antigen_ids = np.zeros(shape=(size, max_antigens), dtype=np.int64)
+            self.ag_counts = np.zeros(shape=size, dtype=np.int64)
+            self._has_room = np.ones(shape=size, dtype=bool) #cells with room in their antigen store
+            self._n_full = 0
+
+    @staticmethod
+    def random(size, migration_range, max_antigens, csm_weights, k_weights, in_signal=2):
+        """creates a population whose migration thresholds are uniform in migration_range"""
+        thresholds = np.random.uniform(migration_range[0], migration_range[1], size=size)
+        return DCPopulation(thresholds, max_antigens, csm_weights, k_weights, in_signal)
+
+    def __len__(self):
+        return len(self.migration_thresholds)
+
+    def phagocytose(self, i, ag_id):
+        count = self.ag_counts[i]
+        if count < self.max_antigens:
+            self.antigen_ids[i, count] = ag_id
+            self.ag_counts[i] = count+1
+            if count+1 == self.max_antigens:
+                self._has_room[i] = False
+                self._n_full += 1
             return True
         return False
 
-    def signal_update(self, signal_vector: np.ndarray):
-        self._signals = self._signals+signal_vector
-        self.update_output_signals()
+    def next_with_capacity(self, start)->int:
+        """
+        returns the index of the first cell from start on (wrapping around) with room in its
+        antigen store, or -1 if every store is full
+        """
+        has_room = self._has_room
+        if has_room[start]:
+            return start
+        if self._n_full == len(has_room):
+            return -1
+        #argmax of a boolean array stops at the first True
+        index = start+int(has_room[start:].argmax())
+        if has_room[index]:
+            return index
+        return int(has_room[:start].argmax())
 
-    def update_output_signals(self):
-        self._output_signals = self._weights.dot(self._signals)
-    
-    def set_signals(self, signal_vector):
-        self._signals = signal_vector
+    def antigens(self, i)->np.ndarray:
+        #ids of the antigens sampled by cell i
+        return self.antigen_ids[i, :self.ag_counts[i]]
+
+    def signal_update(self, i, signal_vector: np.ndarray)->bool:
+        """adds the signals to cell i, returns whether it should migrate"""
+        signals = self.signals[i]
+        signals += signal_vector
+        self.output_signals[i] = self.weights.dot(signals)
+        return self.output_signals[i, 0]>=self.migration_thresholds[i]
+
+    def signal_update_all(self, signal_vector: np.ndarray)->np.ndarray:
+        """adds the signals to every cell, returns the mask of the cells that should migrate"""
+        self.signals += signal_vector
+        np.dot(self.signals, self.weights.T, out=self.output_signals)
+        return self.migrating()
+
+    def migrating(self)->np.ndarray:
+        #boolean mask of the cells whose csm reached their migration threshold
+        return self.output_signals[:, 0]>=self.migration_thresholds
 
-    def set_output_signals(self, signal_vector):
-        self._output_signals = signal_vector
-    
     def csm(self):
-        return self._output_signals[0]
-    
+        return self.output_signals[:, 0]
+
     def k(self):
-        return self._output_signals[1]
-    
-    def should_migrate(self)->bool:
-        return self.csm()>=self._migration_threshold
-    
-    def present(self):
-        return DCOutput(self.k, self.csm, self._antigen_store)
-    
-    def reset(self):
-        self._signals = np.zeros(shape=self._in_signal, dtype=np.float64)
-        self._output_signals = np.zeros(shape=2, dtype=np.float64)
+        return self.output_signals[:, 1]
+
+    def present(self, i, keys):
+        #keys - the split flow keys of the cell's antigens
+        return DCOutput(self.output_signals[i, 1], self.output_signals[i, 0], keys)
+
+    def reset(self, cells=None):
+        """zeroes the signals of the cells (index, index array or boolean mask; None -> all)"""
+        if cells is None:
+            self.signals.fill(0)
+            self.output_signals.fill(0)
+        else:
+            self.signals[cells] = 0
+            self.output_signals[cells] = 0
+
+    def clear_antigens(self, i):
+        #the presented antigens are handed over - the cell starts sampling afresh
+        if not self._has_room[i]:
+            self._has_room[i] = True
+            self._n_full -= 1
+        self.ag_counts[i] = 0
 
 class LymphNode():
-    def __init__(self, anomaly_threshold, input_queue, alert_queue):
+    def __init__(self, 
+            anomaly_threshold, 
+            input_queue, 
+            alert_queue, 
+            poll_timeout=1.0, 
+            max_batch=256, 
+            profiles: ProfileStore=None,
+            stats_interval=60.0,
+            metrics: Metrics=None,
+        ):
+        """
+        :param poll_timeout: seconds to block waiting for a presentation before checking again
+        :param max_batch: max number of pending presentations drained and processed together
+        :param profiles: antigen profile store (None -> unbounded store without decay)
+        :param stats_interval: seconds between profile store stats log lines (None -> never)
+        :param metrics: latency metrics - the alerts carry their trace (None -> no instrumentation)
+        """
         self._anomaly_threshold = anomaly_threshold
         self._input_queue = input_queue
         self._alert_queue = alert_queue
-        self._antigen_profiles = {}
+        self._poll_timeout = poll_timeout
+        self._max_batch = max_batch
+        self._profiles = ProfileStore(max_profiles=None) if profiles == None else profiles
+        self._stats_interval = stats_interval
+        self._metrics = metrics
+        self._next_stats = None
+        self._stopped = False
+        #items = presented antigens
+        self._counters = {'items': 0, 'batches': 0, 'busy_seconds': 0.0, 'max_batch_seconds': 0.0,
+                          'presentations': 0, 'alerts': 0}
 
-    def update_antigen_profile(self, ag: Antigen, context):
-        ag_id = ag.get_id()
-        if ag_id not in self._antigen_profiles:
-            self._antigen_profiles[ag_id] = AntigenProfile.init_from_antigen(ag)
-        self._antigen_profiles[ag_id].presented(context)
+    def get_profiles(self):
+        return self._profiles
 
-    def detect_anomaly(self, ag_profile: AntigenProfile)->bool:
-        if ag_profile.mcav()>self._anomaly_threshold:
-            return True
-        return False
-    
-    def anomaly_found(self, ag):
-        self._alert_queue.put(ag.get_id())
+    def get_metrics(self):
+        return self._metrics
 
-    def get_migration(self, output: DCOutput):
-        if output.k>1:
-            context = 1
+    def anomaly_found(self, key, stamps=None):
+        #the flow key is only rendered as a string once the alert leaves the detection process
+        if stamps == None:
+            self._alert_queue.put(flowkey.key_to_str(key))
         else:
-            context = 0
-        for ag in output.antigens:
-            self.update_antigen_profile(ag, context)
-            is_anomaly = self.detect_anomaly(self._antigen_profiles[ag.get_id()])
-            if is_anomaly:
-                self.anomaly_found(ag)
+            #instrumented alert - the flow key and the trace of the presentation that raised it
+            update, migrated = stamps
+            self._alert_queue.put({
+                'flow': flowkey.key_to_str(key),
+                'trace_id': new_trace_id(),
+                'stamps': {'update': update, 'migrated': migrated, 'alerted': time.monotonic()},
+            })
+        self._counters['alerts'] += 1
+
+    def get_migrations(self, outputs):
+        """
+        updates the profiles of all the antigens presented by the outputs at once, then alerts
+        on every presentation after which its antigen's MCAV exceeds the threshold (as if the
+        outputs had been presented one by one)
+        """
+        counts = [len(output.keys) for output in outputs]
+        if not sum(counts):
+            return
+        keys = flowkey.join_keys(np.concatenate([output.keys for output in outputs]))
+        #mature context (k>1) of every presentation
+        contexts = np.repeat(np.array([output.k>1 for output in outputs], dtype=np.float64), counts)
+        rows = self._profiles.present(keys, contexts, time.monotonic())
+        anomalous = self._profiles.anomalous(rows, contexts, self._anomaly_threshold).tolist()
+        if self._metrics == None:
+            for i in anomalous:
+                self.anomaly_found(keys[i])
+        elif anomalous:
+            #tracing every alert to the presentation that raised it
+            owners = np.repeat(np.arange(len(outputs)), counts)
+            for i in anomalous:
+                self.anomaly_found(keys[i], outputs[owners[i]].stamps)
+
+    def get_migration(self, output: DCOutput):
+        self.get_migrations([output])
+
+    def get_batch(self):
+        """
+        blocks (up to poll_timeout) for the next presentation, then drains the pending ones.
+        returns the list of presentations (empty on timeout, or once the None sentinel was received)
+        """
+        if self._stopped:
+            return []
+        try:
+            presentation = self._input_queue.get(timeout=self._poll_timeout)
+        except queue.Empty:
+            return []
+        if presentation is None:
+            self._stopped = True
+            return []
+        batch = [presentation]
+        while len(batch) < self._max_batch:
+            try:
+                presentation = self._input_queue.get_nowait()
+            except queue.Empty:
+                break
+            if presentation is None:
+                self._stopped = True
+                break
+            batch.append(presentation)
+        return batch
+
+    def observe_batch(self, batch):
+        #migration -> lymph node queue wait of the presentations, and the queue depth
+        metrics = self._metrics
+        now = time.monotonic()
+        for output in batch:
+            if output.stamps != None:
+                metrics.observe('lymph_node.queue_wait', now-output.stamps[1])
+        metrics.gauge('lymph_node.input_depth', queue_depth(self._input_queue))
+
+    def log_stats(self, now):
+        #periodic profile store report (memory per profile, eviction rate)
+        if self._stats_interval == None:
+            return
+        if self._next_stats == None:
+            self._next_stats = now+self._stats_interval
+        elif now >= self._next_stats:
+            self._next_stats = now+self._stats_interval
+            logger.info("antigen profiles: %s", self._profiles.stats())
+
+    def stats(self):
+        """returns the presentation/alert counters, batch latency and the profile store stats"""
+        stats = batch_stats(self._counters)
+        stats['profiles'] = self._profiles.stats()
+        return stats
 
     def start(self):
-        while True:
-            if not self._input_queue.empty():
-                presentation = self._input_queue.get()
-                if presentation==None:
-                    break
-                self.get_migration(presentation)
+        while not self._stopped:
+            batch = self.get_batch()
+            if batch:
+                start = time.perf_counter()
+                if self._metrics != None:
+                    self.observe_batch(batch)
+                self.get_migrations(batch)
+                self._counters['presentations'] += len(batch)
+                _count_batch(self._counters, sum(len(output.keys) for output in batch),
+                             time.perf_counter()-start)
+                if self._metrics != None:
+                    self._metrics.observe('lymph_node.batch', time.perf_counter()-start)
+            now = time.monotonic()
+            self.log_stats(now)
+            if self._metrics != None:
+                self._metrics.maybe_dump(now)
 
 class DCA:
     def __init__(self,
@@ -176,7 +421,15 @@ class DCA:
             segment_size,
             signal_extractor,
             in_signal=2, 
+            batch_size=1,
+            batch_timeout_ms=0,
+            metrics: Metrics=None,
         ):
+        """
+        :param batch_size: max number of flow updates whose signals are extracted together
+        :param batch_timeout_ms: max time to wait for a batch to fill up, after its first update
+        :param metrics: latency metrics - the migrations carry trace stamps (None -> no instrumentation)
+        """
         self._input_queue = input_queue
         self._output_queue = output_queue
         self._population_size = population_size
@@ -187,67 +440,182 @@ class DCA:
         self._segment_size = segment_size
         self._signal_extractor = signal_extractor
         self._in_signal = in_signal
-        self._population = []
+        self._batch_size = batch_size
+        self._batch_timeout = batch_timeout_ms/1000
+        self._metrics = metrics
+        self._population = None
+        self._antigen_ids = AntigenIds()
         self._antigen_count = 0
+        self._stopped = False
+        #items = flow updates, full_migrations = cells migrated early because every store was full
+        self._counters = {'items': 0, 'batches': 0, 'busy_seconds': 0.0, 'max_batch_seconds': 0.0,
+                          'migrations': 0, 'full_migrations': 0}
         
     def initialise_population(self):
-        for _ in range(self._population_size):
-            mt = random.uniform(self._migration_range[0], self._migration_range[1])
-            cell = DC(
-                migration_threshold=mt,
-                max_antigens=self._max_antigens,
-                csm_weights=self._csm_weights,
-                k_weights=self._k_weights,
-                in_signal=self._in_signal,
-            )
-            self._population.append(cell)
-
-    def migrate(self, dc: DC):
-        #send dc's k value to the LymphNode
-        self._output_queue.put(dc.present())
+        self._population = DCPopulation.random(
+            self._population_size,
+            self._migration_range,
+            max_antigens=self._max_antigens,
+            csm_weights=self._csm_weights,
+            k_weights=self._k_weights,
+            in_signal=self._in_signal,
+        )
+
+    def migrate(self, i, stamp=0.0):
+        #send dc's k value (and its antigens) to the LymphNode, the cell starts afresh
+        ids = self._population.antigens(i)
+        output = self._population.present(i, self._antigen_ids.pairs(ids))
+        if stamp:
+            #trace - the flow update that triggered the migration
+            output.stamps = (float(stamp), time.monotonic())
+        self._output_queue.put(output)
+        self._counters['migrations'] += 1
+        self._antigen_ids.release(ids)
+        self._population.clear_antigens(i)
 
     def signal_update_all(self, signals):
-        for cell in self._population:
-            cell.signal_update(signals)
-            if cell.should_migrate():
-                self.migrate(cell)
-                cell.reset()
-
-    def signal_update(self, cell, signals):
-        cell.signal_update(signals)
-        if cell.should_migrate():
-            self.migrate(cell)
-            cell.reset()
-
-    def sample_antigen(self, antigen: Antigen):
+        migrating = self._population.signal_update_all(signals)
+        if migrating.any():
+            for i in np.flatnonzero(migrating):
+                self.migrate(i)
+            self._population.reset(migrating)
+
+    def signal_update(self, i, signals, stamp=0.0):
+        if self._population.signal_update(i, signals):
+            self.migrate(i, stamp)
+            self._population.reset(i)
+
+    def sample_antigen(self, key, stamp=0.0):
+        """
+        returns the index of the cell sampling the antigen (flow key) - the next cell (round robin)
+        with room in its antigen store. if every store is full, the cell in turn migrates early
+        (presenting its antigens, counted in full_migrations) so no antigen goes unpresented,
+        and samples the antigen afresh
+        """
         if self._antigen_count<self._segment_size:
-            index = self._antigen_count % self._population_size
-            accept_ag = self._population[index].phagocytose(antigen)
-            while accept_ag == False:
-                index = (index+1) % self._population_size
-                accept_ag = self._population[index].phagocytose(antigen)
+            start = self._antigen_count % self._population_size
+            index = self._population.next_with_capacity(start)
+            if index < 0:
+                index = start
+                self.migrate(index, stamp)
+                self._population.reset(index)
+                self._counters['full_migrations'] += 1
+            self._population.phagocytose(index, self._antigen_ids.acquire(key))
             return index
         return None
-                
+
     def population_context_reset(self):
-        for cell in self._population:
-            cell.reset()
+        self._population.reset()
+
+    def get_batch(self):
+        """
+        blocks for the next flow update, then drains up to batch_size updates, waiting
+        at most batch_timeout_ms for more to arrive. returns the list of updates
+        (empty once the None sentinel was received)
+        """
+        if self._stopped:
+            return []
+        data = self._input_queue.get()
+        if data is None:
+            self._stopped = True
+            return []
+        batch = [data]
+        deadline = time.monotonic()+self._batch_timeout
+        while len(batch) < self._batch_size:
+            remaining = deadline-time.monotonic()
+            try:
+                if remaining > 0:
+                    data = self._input_queue.get(timeout=remaining)
+                else:
+                    data = self._input_queue.get_nowait()
+            except queue.Empty:
+                break
+            if data is None:
+                self._stopped = True
+                break
+            batch.append(data)
+        return batch
+
+    def next_batch(self):
+        """
+        returns (flow keys, (N, 8) feature rows, (N,) trace stamps or None) of the next batch
+        of flow updates, or None once the input ended. inputs with a batch read (shared memory
+        rings) are read directly, queues through get_batch
+        """
+        if self._stopped:
+            return None
+        read_batch = getattr(self._input_queue, 'get_batch', None)
+        if read_batch != None:
+            batch = read_batch(self._batch_size, self._batch_timeout)
+            if batch == None:
+                self._stopped = True
+            return batch
+        batch = self.get_batch()
+        if not batch:
+            return None
+        stamps = None
+        if self._metrics != None:
+            stamps = np.array([update[2] if len(update) > 2 else 0.0 for update in batch])
+        return [update[0] for update in batch], np.concatenate([update[1] for update in batch]), stamps
+
+    def get_metrics(self):
+        return self._metrics
+
+    def observe_batch(self, stamps):
+        #collector -> DCA queue wait of the (stamped) updates, and the queue depth
+        metrics = self._metrics
+        if stamps is not None:
+            stamped = stamps[stamps > 0]
+            if len(stamped):
+                metrics.observe_many('dca.queue_wait', time.monotonic()-stamped)
+        metrics.gauge('dca.input_depth', queue_depth(self._input_queue))
+
+    def stats(self):
+        """returns the flow update/migration counters and the batch latency"""
+        return batch_stats(self._counters)
+
+    def process_antigen(self, key, signals, stamp=0.0):
+        j = self.sample_antigen(key, stamp) #index of DC sampling the Ag
+        self._antigen_count += 1
+        self.signal_update(j, signals, stamp)
 
-    def start(self, iteration_limit=0):
+    def start(self, iteration_limit=0, on_first_batch=None):
+        """
+        :param iteration_limit: number of segments to process before returning (0 -> unlimited)
+        :param on_first_batch: optional callback, called once the first batch was processed
+        """
+        self._signal_extractor.initialise()
         self.initialise_population()
         i = 0
         while True:
-            while self._antigen_count<self._segment_size:
-                data = self._input_queue.get()
-                if data is None:
-                    break
-                #getting antigen and signals (ag-specific)
-                ag, signals = Antigen(data[0]), self._signal_extractor.extract(data[1])
-                j = self.sample_antigen(ag) #index of DC sampling the Ag 
-                self._antigen_count += 1
-                self.signal_update(self._population[j], signals)
-            self.population_context_reset()
-            i+=1
-            if iteration_limit>0:
-                if i>=iteration_limit:
-                    break
\ No newline at end of file
+            batch = self.next_batch()
+            if batch == None:
+                break
+            keys, data, stamps = batch
+            start = time.perf_counter()
+            if self._metrics == None:
+                stamps = None
+            else:
+                self.observe_batch(stamps)
+            #getting the signals of the whole batch at once (one model pass per signal)
+            signals = self._signal_extractor.extract_batch(data)
+            if stamps is not None:
+                self._metrics.observe('dca.inference', time.perf_counter()-start)
+            #feeding the antigens and their signals to the DCs in arrival order
+            for j, (key, ag_signals) in enumerate(zip(keys, signals)):
+                self.process_antigen(key, ag_signals, 0.0 if stamps is None else stamps[j])
+                if self._antigen_count >= self._segment_size:
+                    #end of segment
+                    self.population_context_reset()
+                    self._antigen_count = 0
+                    i+=1
+                    if iteration_limit>0:
+                        if i>=iteration_limit:
+                            return
+            _count_batch(self._counters, len(keys), time.perf_counter()-start)
+            if stamps is not None:
+                self._metrics.observe('dca.batch', time.perf_counter()-start)
+                self._metrics.maybe_dump(time.monotonic())
+            if on_first_batch != None:
+                on_first_batch()
+                on_first_batch = None
\ No newline at end of file
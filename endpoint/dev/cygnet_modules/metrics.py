@@ -0,0 +1,247 @@
+"""
+Lightweight per-stage latency instrumentation.
+
+Every pipeline process owns a Metrics registry of HDR-style latency histograms and
+queue-depth gauges, and periodically dumps a JSON snapshot of it to its own file in
+a shared metrics directory. serve_metrics serves the merged snapshots of the directory
+over HTTP. Components take a Metrics (or None) - with None, nothing is stamped or recorded.
+
+Trace stamps are time.monotonic() values, which are comparable between the processes
+of one machine (the stages of the endpoint), but not between machines.
+"""
+import json
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+#histogram resolution - 2**SUB_BUCKET_BITS linear sub-buckets per power of 2 (~3% relative error)
+SUB_BUCKET_BITS = 5
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+_N_BUCKETS = (64-SUB_BUCKET_BITS)*_SUB_BUCKETS
+PERCENTILES = (50, 90, 99, 99.9)
+
+def _bucket(value):
+    #bucket index of a non-negative integer value
+    bits = value.bit_length()
+    if bits <= SUB_BUCKET_BITS+1:
+        return value
+    shift = bits-SUB_BUCKET_BITS-1
+    return (shift+1)*_SUB_BUCKETS+(value >> shift)-_SUB_BUCKETS
+
+def _bucket_value(index):
+    #lowest value of a bucket
+    if index < 2*_SUB_BUCKETS:
+        return index
+    shift = index//_SUB_BUCKETS-1
+    return (index % _SUB_BUCKETS+_SUB_BUCKETS) << shift
+
+class Histogram:
+    """
+    HDR-style histogram of non-negative integer values (e.g. latencies in microseconds) -
+    log-linear buckets (2**SUB_BUCKET_BITS linear sub-buckets per power of 2), so recording
+    is O(1) and the relative error of the percentiles is bounded, for any value range.
+
+    Attributes:
+        counts (ndarray): per bucket value counts
+    """
+    def __init__(self):
+        self.counts = np.zeros(_N_BUCKETS, dtype=np.int64)
+        self._count = 0
+        self._total = 0
+        self._min = None
+        self._max = 0
+
+    def record(self, value):
+        value = max(0, int(value))
+        self.counts[_bucket(value)] += 1
+        self._count += 1
+        self._total += value
+        if self._min == None or value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+
+    def record_many(self, values):
+        """records an array of values at once"""
+        values = np.maximum(np.asarray(values, dtype=np.float64), 0).astype(np.int64)
+        if len(values) == 0:
+            return
+        #bit lengths (frexp's exponent is the bit length of an integer)
+        bits = np.frexp(values.astype(np.float64))[1]
+        shift = np.maximum(bits-SUB_BUCKET_BITS-1, 0)
+        index = np.where(shift > 0, (shift+1)*_SUB_BUCKETS+(values >> shift)-_SUB_BUCKETS, values)
+        np.add.at(self.counts, index, 1)
+        self._count += len(values)
+        self._total += int(values.sum())
+        low = int(values.min())
+        if self._min == None or low < self._min:
+            self._min = low
+        self._max = max(self._max, int(values.max()))
+
+    def count(self):
+        return self._count
+
+    def percentile(self, p):
+        """returns the (bucket resolution) value below which p percent of the values are"""
+        if self._count == 0:
+            return 0
+        rank = max(1, math.ceil(p/100*self._count))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(_bucket_value(index), self._max)
+
+    def snapshot(self):
+        """returns the count, min, mean, max and percentiles"""
+        snapshot = {
+            'count': self._count,
+            'min': self._min or 0,
+            'mean': self._total/self._count if self._count else 0.0,
+            'max': self._max,
+        }
+        for p in PERCENTILES:
+            snapshot[f'p{p:g}'] = self.percentile(p)
+        return snapshot
+
+class Gauge:
+    """last (and max) value of a sampled quantity, e.g. a queue depth"""
+    def __init__(self):
+        self.value = 0
+        self.max = 0
+
+    def set(self, value):
+        self.value = value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        return {'value': self.value, 'max': self.max}
+
+def queue_depth(q):
+    #number of items waiting on a queue/ring (-1 if the platform can't tell, e.g. macos)
+    try:
+        return q.qsize()
+    except NotImplementedError:
+        return -1
+
+class Metrics:
+    """
+    Latency histograms (microseconds) and gauges of one process, dumped to
+    directory/<name>.json every interval seconds (by maybe_dump).
+
+    Attributes:
+        name (str): name of the process/stage - the snapshot file name
+        directory (str): directory the snapshots are written to (None -> not written)
+        interval (float): seconds between snapshots
+    """
+    def __init__(self, name, directory=None, interval=10.0):
+        self.name = name
+        self._directory = directory
+        self._interval = interval
+        self._histograms = {}
+        self._gauges = {}
+        self._next_dump = None
+
+    def histogram(self, name) -> Histogram:
+        histogram = self._histograms.get(name)
+        if histogram == None:
+            histogram = self._histograms[name] = Histogram()
+        return histogram
+
+    def observe(self, name, seconds):
+        """records a latency (seconds) in the histogram"""
+        self.histogram(name).record(seconds*1e6)
+
+    def observe_many(self, name, seconds):
+        self.histogram(name).record_many(np.asarray(seconds)*1e6)
+
+    def gauge(self, name, value):
+        gauge = self._gauges.get(name)
+        if gauge == None:
+            gauge = self._gauges[name] = Gauge()
+        gauge.set(value)
+
+    def snapshot(self):
+        return {
+            'time': time.time(),
+            'pid': os.getpid(),
+            'latency_us': {name: h.snapshot() for name, h in self._histograms.items()},
+            'gauges': {name: g.snapshot() for name, g in self._gauges.items()},
+        }
+
+    def dump(self):
+        """writes the snapshot file (atomically replaced, so readers never see a partial file)"""
+        if self._directory == None:
+            return
+        os.makedirs(self._directory, exist_ok=True)
+        path = os.path.join(self._directory, self.name+'.json')
+        with open(path+'.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path+'.tmp', path)
+
+    def maybe_dump(self, now):
+        #dumps once per interval (now = time.monotonic())
+        if self._next_dump == None:
+            self._next_dump = now+self._interval
+        elif now >= self._next_dump:
+            self._next_dump = now+self._interval
+            self.dump()
+
+def read_snapshots(directory):
+    """returns the snapshots of the directory's metrics files (stage name -> snapshot)"""
+    snapshots = {}
+    if not os.path.isdir(directory):
+        return snapshots
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith('.json'):
+            try:
+                with open(os.path.join(directory, file_name)) as f:
+                    snapshots[file_name[:-5]] = json.load(f)
+            except (OSError, ValueError):
+                continue
+    return snapshots
+
+def serve_metrics(directory, port, host="127.0.0.1"):
+    """
+    serves the merged snapshots of the directory as JSON on http://host:port/metrics,
+    from a daemon thread. returns the server (shutdown() stops it)
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') != '/metrics':
+                self.send_error(404)
+                return
+            body = json.dumps(read_snapshots(directory)).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+#Traces - an alert's monotonic stamps, in pipeline order: the flow update that triggered the
+#DC's migration, the migration, the alert, the client sending it
+TRACE_STAGES = ('update', 'migrated', 'alerted', 'sent')
+
+def new_trace_id():
+    return os.urandom(8).hex()
+
+def stage_durations(stamps: dict):
+    """returns the milliseconds between the consecutive stamps of a trace ('update->migrated': ms, ...)"""
+    durations = {}
+    previous = None
+    for stage in TRACE_STAGES:
+        stamp = stamps.get(stage)
+        if not stamp:
+            continue
+        if previous != None:
+            durations[f'{previous[0]}->{stage}'] = (stamp-previous[1])*1000
+        previous = (stage, stamp)
+    return durations
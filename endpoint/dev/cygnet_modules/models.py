@@ -0,0 +1,196 @@
+import logging
+import time
+import numpy as np
+
+#number of input features of the autoencoders
+N_FEATURES = 8
+#inference backends
+KERAS_BACKEND = 'keras' #the SavedModels, through tensorflow
+NUMPY_BACKEND = 'numpy' #exported .npz weights, plain NumPy matmuls (no tensorflow import)
+#rows in the dummy batch used to warm the models up
+WARMUP_BATCH = 32
+
+logger = logging.getLogger(__name__)
+
+def load_keras_model(model_path):
+    import tensorflow as tf #imported only when the keras backend is used
+    try:
+        return tf.keras.models.load_model(model_path)
+    except ValueError:
+        #keras 3 can't load legacy SavedModels - falling back to the SavedModel's serving signature
+        saved_model = tf.saved_model.load(model_path)
+        serving = saved_model.signatures['serving_default']
+        input_name = list(serving.structured_input_signature[1].keys())[0]
+        def model(x, training=False):
+            outputs = serving(**{input_name: x})
+            return outputs[list(outputs.keys())[0]]
+        model.saved_model = saved_model #keeping the loaded variables alive
+        return model
+
+class CompiledModel:
+    """
+    Compiled inference callable of a loaded keras model - a tf.function with a fixed
+    (None, N_FEATURES) float64 input signature, so it is traced once and reused for any batch size.
+    """
+    def __init__(self, model, n_features=N_FEATURES):
+        import tensorflow as tf
+        self._tf = tf
+        self._model = model
+        self._function = tf.function(
+            lambda x: model(x, training=False),
+            input_signature=[tf.TensorSpec(shape=(None, n_features), dtype=tf.float64)],
+        )
+
+    def __call__(self, data):
+        """returns the model's reconstruction of the (N, n_features) batch as an ndarray"""
+        return self._function(self._tf.constant(data, dtype=self._tf.float64)).numpy()
+
+class NumpyAutoencoder:
+    """
+    TensorFlow-free inference of the exported 8-4-2-4-8 denoising autoencoders
+    (training/dae.py export_numpy_weights). The GaussianNoise layer is inactive at inference,
+    so the network is just its Dense layers, evaluated with NumPy matmuls on the whole batch.
+
+    Attributes:
+        weights (list): per Dense layer kernel (in, out) matrices
+        biases (list): per Dense layer bias vectors
+        activations (list): per Dense layer activation - 'relu' or 'linear'
+    """
+    def __init__(self, weights, biases, activations):
+        self.weights = [np.asarray(w, dtype=np.float64) for w in weights]
+        self.biases = [np.asarray(b, dtype=np.float64) for b in biases]
+        self.activations = list(activations)
+
+    @staticmethod
+    def load(npz_path):
+        with np.load(npz_path) as f:
+            n_layers = len(f['activations'])
+            return NumpyAutoencoder(
+                [f[f'kernel_{i}'] for i in range(n_layers)],
+                [f[f'bias_{i}'] for i in range(n_layers)],
+                [str(a) for a in f['activations']],
+            )
+
+    def __call__(self, data):
+        """returns the reconstruction of the (N, n_features) batch"""
+        x = np.asarray(data, dtype=np.float64)
+        for w, b, activation in zip(self.weights, self.biases, self.activations):
+            x = x @ w
+            x += b
+            if activation == 'relu':
+                np.maximum(x, 0, out=x)
+        return x
+
+class FusedAutoencoders:
+    """
+    Evaluates several structurally identical NumpyAutoencoders (e.g. the PAMP and safe
+    autoencoders) on the same input in one pass: the first layers' kernels are concatenated
+    and the following ones stacked block-diagonally, so every layer of all the models is a
+    single matmul over the whole batch.
+
+    Attributes:
+        n_signals (int): number of fused models - one reconstruction error (signal) per model
+    """
+    def __init__(self, models: list):
+        first = models[0]
+        for model in models[1:]:
+            if ([w.shape for w in model.weights] != [w.shape for w in first.weights]
+                    or model.activations != first.activations):
+                raise Exception('AUTOENCODERS ARE NOT STRUCTURALLY IDENTICAL')
+        self.n_signals = len(models)
+        self._activations = first.activations
+        self._n_outputs = first.weights[-1].shape[1]
+        self._weights = []
+        self._biases = []
+        for i in range(len(first.weights)):
+            layer_weights = [model.weights[i] for model in models]
+            if i == 0:
+                #all models read the same input
+                fused = np.concatenate(layer_weights, axis=1)
+            else:
+                rows = sum(w.shape[0] for w in layer_weights)
+                cols = sum(w.shape[1] for w in layer_weights)
+                fused = np.zeros((rows, cols), dtype=np.float64)
+                r = c = 0
+                for w in layer_weights:
+                    fused[r:r+w.shape[0], c:c+w.shape[1]] = w
+                    r += w.shape[0]
+                    c += w.shape[1]
+            self._weights.append(fused)
+            self._biases.append(np.concatenate([model.biases[i] for model in models]))
+
+    def reconstruct(self, data):
+        """returns the (n_signals, N, n_features) reconstructions of the (N, n_features) batch"""
+        x = np.asarray(data, dtype=np.float64)
+        for w, b, activation in zip(self._weights, self._biases, self._activations):
+            x = x @ w
+            x += b
+            if activation == 'relu':
+                np.maximum(x, 0, out=x)
+        return x.reshape(len(x), self.n_signals, self._n_outputs).transpose(1, 0, 2)
+
+    def __call__(self, data):
+        """returns the (N, n_signals) per-row RMSE of every model's reconstruction"""
+        data = np.asarray(data, dtype=np.float64)
+        errors = self.reconstruct(data)-data
+        return np.sqrt(np.mean(np.square(errors), axis=2)).T
+
+class ModelRegistry:
+    """
+    Loads every model once per process (on first use or via load_all), warms it up
+    with a dummy batch and hands back its inference callable - a CompiledModel
+    (keras backend) or a NumpyAutoencoder (numpy backend).
+
+    Attributes:
+        model_paths (dict): model name -> SavedModel path (keras) or .npz weights path (numpy)
+        n_features (int): number of input features of the models
+        backend (str): KERAS_BACKEND or NUMPY_BACKEND
+        timings (dict): model name -> {'load': seconds, 'warmup': seconds}
+    """
+    def __init__(self, model_paths: dict, n_features=N_FEATURES, backend=KERAS_BACKEND):
+        self._model_paths = model_paths
+        self._n_features = n_features
+        self._backend = backend
+        self._models = {}
+        self._fused = {}
+        self.timings = {}
+
+    def get(self, name):
+        model = self._models.get(name)
+        if model == None:
+            model = self.load(name)
+        return model
+
+    def load(self, name):
+        """loads, compiles and warms up a model, recording how long each step took"""
+        start = time.perf_counter()
+        if self._backend == NUMPY_BACKEND:
+            model = NumpyAutoencoder.load(self._model_paths[name])
+        else:
+            model = CompiledModel(load_keras_model(self._model_paths[name]), self._n_features)
+        loaded = time.perf_counter()
+        model(np.zeros((WARMUP_BATCH, self._n_features), dtype=np.float64))
+        warmed = time.perf_counter()
+        self._models[name] = model
+        self.timings[name] = {'load': loaded-start, 'warmup': warmed-loaded}
+        logger.info("model %s (%s): load %.3fs, warm-up %.3fs", name, self._backend,
+                    loaded-start, warmed-loaded)
+        return model
+
+    def get_fused(self, names) -> FusedAutoencoders:
+        """returns the fused evaluator of the given models (numpy backend only)"""
+        names = tuple(names)
+        fused = self._fused.get(names)
+        if fused == None:
+            if self._backend != NUMPY_BACKEND:
+                raise Exception('FUSED EVALUATION NEEDS THE NUMPY BACKEND')
+            fused = FusedAutoencoders([self.get(name) for name in names])
+            self._fused[names] = fused
+        return fused
+
+    def load_all(self):
+        """loads every registered model that isn't loaded yet"""
+        for name in self._model_paths:
+            if name not in self._models:
+                self.load(name)
+        return self.timings
@@ -1,12 +1,70 @@
-from scapy.all import Packet
+from typing import TYPE_CHECKING
 import numpy as np
 import json
-import pickle
 import sys
 import os
+from cygnet_modules import flowkey
+from cygnet_modules.scaler import FeatureScaler
+if TYPE_CHECKING:
+    #scapy takes ~1s to import - only the scapy capture backend needs it at runtime
+    from scapy.all import Packet
 
 CURDIR = os.path.dirname(os.path.abspath(__file__))
-SCALER_PATH = CURDIR+"../assets/scaler.pkl"
+SCALER_PATH = CURDIR+"/../assets/scaler.pkl"
+SCALER_NPZ_PATH = CURDIR+"/../assets/scaler.npz" #preconverted scaler - no sklearn needed
+
+#the training data scaler, loaded once per process (see get_scaler)
+_scaler = None
+
+def get_scaler():
+    """returns the training data scaler, loading it on first use"""
+    global _scaler
+    if _scaler == None:
+        path = SCALER_NPZ_PATH if os.path.isfile(SCALER_NPZ_PATH) else SCALER_PATH
+        _scaler = FeatureScaler.load(path)
+    return _scaler
+
+#tcp flags
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+
+#tcp connection teardown state of a flow
+FIN_SRC = 0x01 #FIN seen from the source side
+FIN_DST = 0x02 #FIN seen from the destination side
+RST_SEEN = 0x04
+FIN_BOTH = FIN_SRC | FIN_DST
+
+class PacketInfo:
+    """
+    Minimal decoded view of an IPv4 packet carrying TCP or UDP - only the fields Netflow needs.
+    Produced either from a scapy packet (Pktops.packet_info) or straight from a raw frame
+    (rawcapture.parse_frame), so both capture backends feed the flow table the same way.
+
+    Attributes:
+        sip(int): source ip (as an int)
+        dip(int): destination ip (as an int)
+        sport(int): source port
+        dport(int): destination port
+        proto(int): transport protocol number - flowkey.PROTO_TCP or flowkey.PROTO_UDP
+        size(int): total packet (frame) size in bytes
+        payload_size(int): size of everything above the first (link) layer of the frame
+        time(float): capture timestamp
+        flags(int): tcp flags (0 for udp)
+    """
+    __slots__ = ('sip', 'dip', 'sport', 'dport', 'proto', 'size', 'payload_size', 'time',
+                 'flags')
+
+    def __init__(self, sip, dip, sport, dport, proto, size, payload_size, time, flags=0):
+        self.sip = sip
+        self.dip = dip
+        self.sport = sport
+        self.dport = dport
+        self.proto = proto
+        self.size = size
+        self.payload_size = payload_size
+        self.time = time
+        self.flags = flags
 
 class Pktops:
     @staticmethod
@@ -32,26 +90,191 @@ class Pktops:
         return proto
  
     @staticmethod
-    def get_key(sip, dip, sport, dport):
-        key = f"{sip}:{sport}-{dip}:{dport}"
-        return key
+    def get_key(sip, dip, sport, dport, proto):
+        """
+        returns the canonical (direction-normalised) flow key - see flowkey.
+        ips may be given as strings or ints, proto as 'TCP'/'UDP' or its protocol number
+        """
+        if isinstance(sip, str):
+            sip = flowkey.ip_to_int(sip)
+        if isinstance(dip, str):
+            dip = flowkey.ip_to_int(dip)
+        if isinstance(proto, str):
+            proto = flowkey.PROTO_NUMBERS[proto]
+        return flowkey.make_key(sip, sport, dip, dport, proto)
     
     @staticmethod
-    def get_key_from_packet(pkt: Packet):
+    def get_key_from_packet(pkt: 'Packet'):
         proto = Pktops.get_proto(pkt)
         return Pktops.get_key(pkt['IP'].src, pkt['IP'].dst, pkt[proto].sport,
-                            pkt[proto].dport)
+                            pkt[proto].dport, proto)
+
+    @staticmethod
+    def packet_info(pkt: 'Packet'):
+        """walks the scapy layers once and returns the PacketInfo of a valid packet"""
+        ip = pkt['IP']
+        proto = 'UDP' if ip.proto==17 else 'TCP'
+        transport = pkt[proto]
+        flags = int(transport.flags) if proto == 'TCP' else 0
+        return PacketInfo(flowkey.ip_to_int(ip.src), flowkey.ip_to_int(ip.dst),
+                          transport.sport, transport.dport, ip.proto,
+                          len(pkt), len(pkt.payload), float(pkt.time), flags)
+
+#columns of the flow feature matrix (the autoencoders' input features, in order)
+SPKTS, DPKTS, SBYTES, DBYTES, SMEAN, DMEAN, IS_TCP, IS_UDP = range(8)
+N_FEATURES = 8
+#NumPy columns of the FlowStore
+COLUMNS = ('features', 'sizes', 'sources', 'source_ports', 'times', 'tcp_state')
+
+class FlowStore:
+    """
+    Columnar store of netflow counters. Every tracked flow owns a slot (row) in
+    preallocated NumPy columns; freed slots are reused and the columns double in size
+    when full, so tracking a flow needs no per-flow Python object or per-packet allocation.
+
+    Attributes:
+        features (ndarray): (capacity, 8) feature matrix -
+            spkts, dpkts, sbytes, dbytes, smean, dmean, is_tcp, is_udp
+        sizes (ndarray): (capacity, 2) total packet bytes - spkts_size, dpkts_size
+        sources (ndarray): (capacity,) source ip - the sender of the flow's first packet
+        source_ports (ndarray): (capacity,) source port
+        times (ndarray): (capacity, 2) stime, ltime
+        tcp_state (ndarray): (capacity,) tcp teardown flags seen (FIN_SRC | FIN_DST | RST_SEEN)
+        keys (list): flow key of every slot (None for free slots)
+    """
+    def __init__(self, capacity=1024):
+        self._capacity = 0
+        self.features = np.zeros((0, N_FEATURES), dtype=np.float64)
+        self.sizes = np.zeros((0, 2), dtype=np.float64)
+        self.sources = np.zeros(0, dtype=np.uint32)
+        self.source_ports = np.zeros(0, dtype=np.uint16)
+        self.times = np.zeros((0, 2), dtype=np.float64)
+        self.tcp_state = np.zeros(0, dtype=np.uint8)
+        self.keys = []
+        self._free = []
+        self.grow(max(capacity, 1))
+
+    def __len__(self):
+        """number of slots in use"""
+        return self._capacity-len(self._free)
+
+    def capacity(self):
+        return self._capacity
+
+    def grow(self, capacity=None):
+        """grows the columns to the given capacity (default - double the current one)"""
+        old = self._capacity
+        if capacity == None:
+            capacity = 2*old
+        for name in COLUMNS:
+            column = getattr(self, name)
+            grown = np.zeros((capacity,)+column.shape[1:], dtype=column.dtype)
+            grown[:old] = column
+            setattr(self, name, grown)
+        self.keys.extend([None]*(capacity-old))
+        #lowest slots are handed out first
+        self._free.extend(range(capacity-1, old-1, -1))
+        self._capacity = capacity
+
+    def allocate(self, key, sip, dip, sport, dport, stime, proto, ibytes, packet_size):
+        """allocates a slot for a new flow (its first packet already counted) and returns it"""
+        if not self._free:
+            self.grow()
+        slot = self._free.pop()
+        is_tcp = 1.0 if proto == 'TCP' else 0.0
+        self.features[slot] = (1, 0, ibytes, 0, packet_size, 0, is_tcp, 1.0-is_tcp)
+        self.sizes[slot] = (packet_size, 0)
+        self.sources[slot] = sip
+        self.source_ports[slot] = sport
+        self.times[slot] = (stime, stime)
+        self.tcp_state[slot] = 0
+        self.keys[slot] = key
+        return slot
+
+    def allocate_from_info(self, key, info: PacketInfo):
+        """allocates a slot for a new flow, starting with the given (first) packet"""
+        slot = self.allocate(key, info.sip, info.dip, info.sport, info.dport, info.time,
+                             flowkey.PROTO_NAMES[info.proto], info.payload_size, info.size)
+        if info.flags & TCP_RST:
+            self.tcp_state[slot] = RST_SEEN
+        elif info.flags & TCP_FIN:
+            self.tcp_state[slot] = FIN_SRC
+        return slot
+
+    def release(self, slot):
+        """frees the slot of an ended flow for reuse"""
+        self.keys[slot] = None
+        self._free.append(slot)
+
+    def update(self, slot, info: PacketInfo):
+        """updates the flow in the slot with a new packet"""
+        row = self.features[slot]
+        sizes = self.sizes[slot]
+        flags = info.flags
+        if info.sip == self.sources[slot]:
+            row[SPKTS] += 1
+            sizes[0] += info.size
+            row[SMEAN] = sizes[0]/row[SPKTS]
+            row[SBYTES] += info.payload_size
+            if flags & TCP_FIN:
+                self.tcp_state[slot] |= FIN_SRC
+        else:
+            row[DPKTS] += 1
+            sizes[1] += info.size
+            row[DMEAN] = sizes[1]/row[DPKTS]
+            row[DBYTES] += info.payload_size
+            if flags & TCP_FIN:
+                self.tcp_state[slot] |= FIN_DST
+        if flags & TCP_RST:
+            self.tcp_state[slot] |= RST_SEEN
+        self.times[slot, 1] = info.time
+
+    def tcp_closed(self, slot):
+        """returns whether the flow's tcp connection was torn down (RST, or FIN from both sides)"""
+        state = self.tcp_state[slot]
+        return bool(state & RST_SEEN) or (state & FIN_BOTH) == FIN_BOTH
+
+    def directed_key(self, slot):
+        """the flow's key with its direction (initiator = the sender of the first packet)"""
+        return flowkey.directed_key(self.keys[slot], int(self.sources[slot]), int(self.source_ports[slot]))
+
+    def start_time(self, slot):
+        return self.times[slot, 0]
+
+    def last_time(self, slot):
+        return self.times[slot, 1]
+
+    def feature_vector(self, slot):
+        """(1, 8) view of the flow's feature row"""
+        return self.features[slot:slot+1]
+
+    def feature_rows(self, slots=None):
+        """
+        returns the feature rows of many flows as a single (N, 8) array -
+        a view of all slots if slots is None, else the rows of the given slots
+        """
+        if slots is None:
+            return self.features[:self._capacity]
+        return self.features[slots]
+
+    def nbytes(self):
+        """bytes held by the NumPy columns"""
+        return sum(getattr(self, name).nbytes for name in COLUMNS)
 
 class Netflow:
     """
-    Network flow (2-sided communication stream metadata) object.
+    Network flow (2-sided communication stream metadata) object - a thin view of a
+    FlowStore slot, where the flow's counters actually live.
     
     Attributes:
-        sip(str): source ip
-        dip(string): destination ip
+        sip(int): source ip (as an int)
+        dip(int): destination ip (as an int)
         sport(int): source port
         dport(int): destination port
-        key(str): unique id key, in the format "{sip}:{dport}-{dip}:{dport}"
+        key(int): unique id key - the canonical flow key of the flow (see flowkey)
+        stime(float): timestamp of the flow's first packet
+        ltime(float): timestamp of the flow's last packet
+        tcp_state(int): tcp teardown flags seen (FIN_SRC | FIN_DST | RST_SEEN)
         proto(str): transaction protocol
         spkts(int): number of source->destination packets
         dpkts(int): number of destination->source packets
@@ -62,6 +285,8 @@ class Netflow:
         smean(float): mean source->destination packet size
         dmean(float): mean destination->source packet size
     """
+    __slots__ = ('_store', '_slot')
+
     def __init__(self, 
             sip, 
             dip, 
@@ -71,85 +296,117 @@ class Netflow:
             proto, 
             ibytes, 
             packet_size,
-            key=None
+            key=None,
+            store=None,
         ):
-        self._sip = sip
-        self._dip = dip
-        self._sport = sport
-        self._dport = dport
+        if isinstance(sip, str):
+            sip = flowkey.ip_to_int(sip)
+        if isinstance(dip, str):
+            dip = flowkey.ip_to_int(dip)
         if key==None:
-            self._key = Pktops.get_key(self._sip, self._dip, self._sport, self._dport)
-        else:
-            self._key = key
-        self._proto = proto
-        self._spkts = 1
-        self._dpkts = 0
-        self._sbytes = ibytes
-        self._dbytes = 0
-        self._spkts_size = packet_size
-        self._dpkts_size = 0
-        self._smean = packet_size
-        self._dmean = 0
+            key = Pktops.get_key(sip, dip, sport, dport, proto)
+        if store==None:
+            store = FlowStore(capacity=1)
+        self._store = store
+        self._slot = store.allocate(key, sip, dip, sport, dport, stime, proto, ibytes, packet_size)
+
+    @staticmethod
+    def view(store: FlowStore, slot):
+        """returns a Netflow view of an existing FlowStore slot"""
+        flow = Netflow.__new__(Netflow)
+        flow._store = store
+        flow._slot = slot
+        return flow
         
     @staticmethod
-    def netflow_from_packet(pkt):
-        proto = Pktops.get_proto(pkt)
-        return Netflow(
-                pkt['IP'].src, 
-                pkt['IP'].dst, 
-                pkt[proto].sport, 
-                pkt[proto].dport,
-                proto,
-                len(pkt.payload),
-                len(pkt),
-            )
+    def netflow_from_packet(pkt, store=None):
+        Pktops.packet_validator(pkt)
+        return Netflow.netflow_from_info(Pktops.packet_info(pkt), store=store)
+
+    @staticmethod
+    def netflow_from_info(info: PacketInfo, key=None, store=None):
+        if key==None:
+            key = flowkey.make_key(info.sip, info.sport, info.dip, info.dport, info.proto)
+        if store==None:
+            store = FlowStore(capacity=1)
+        return Netflow.view(store, store.allocate_from_info(key, info))
+
     def get_key(self):
-        return self._key
+        return self._store.keys[self._slot]
+
+    def get_directed_key(self):
+        return self._store.directed_key(self._slot)
+
+    def get_slot(self):
+        return self._slot
     
-    def update(self, pkt: Packet):
-        """update the netflow with a new packet"""
-        Pktops.packet_validator(pkt)
-        side = 'src' if pkt['IP'].src == self._sip else 'dst'
-        if side == 'src':
-            self._spkts += 1
-            self._spkts_size += len(pkt)
-            self._smean = self._spkts_size/self._spkts
-            self._sbytes += len(pkt.payload)
-        elif side == 'dst':
-            self._dpkts += 1
-            self._dpkts_size += len(pkt)
-            self._dmean = self._dpkts_size/self._dpkts
-            self._dbytes += len(pkt.payload)
+    def update(self, pkt):
+        """update the netflow with a new packet (scapy Packet or PacketInfo)"""
+        if not isinstance(pkt, PacketInfo):
+            Pktops.packet_validator(pkt)
+            pkt = Pktops.packet_info(pkt)
+        self._store.update(self._slot, pkt)
+
+    def get_start_time(self):
+        return float(self._store.start_time(self._slot))
+
+    def get_last_time(self):
+        return float(self._store.last_time(self._slot))
+
+    def tcp_closed(self):
+        """returns whether the tcp connection was torn down (RST, or FIN from both sides)"""
+        return self._store.tcp_closed(self._slot)
+
+    def counters(self):
+        """returns the raw flow counters (spkts, dpkts, sbytes, dbytes, spkts_size, dpkts_size)"""
+        row = self._store.features[self._slot]
+        sizes = self._store.sizes[self._slot]
+        return (int(row[SPKTS]), int(row[DPKTS]), int(row[SBYTES]), int(row[DBYTES]),
+                int(sizes[0]), int(sizes[1]))
     
     @staticmethod
     def scale_vector(vector):
-        #scaled according to training data scaler
-        numericals, categoricals = vector[:,:6], vector[:, 6:]
-        with open(SCALER_PATH, 'rb') as f:
-            scaler = pickle.load(f)
-        scaled_numericals = scaler.transform(numericals)
-        return np.concatenate([scaled_numericals, categoricals], axis=1)
+        #scaled according to training data scaler (returns a scaled copy)
+        return get_scaler().transform(vector)
     
     def get_feature_vector(self):
-        #defining the features
-        is_tcp = 1 if self._proto == 'TCP' else 0
-        is_udp = 1-is_tcp
-
-        features = np.array(
-            [self._spkts,
-            self._dpkts,
-            self._sbytes,
-            self._dbytes,
-            self._smean,
-            self._dmean,
-            is_tcp,
-            is_udp]
-        )
-        return features.reshape(1,-1) #transposing the arr bc. it represents 1 sample
+        #(1, 8) view of the flow's row - 1 sample of the features
+        return self._store.feature_vector(self._slot)
     
     def vectorise(self):
         #scaling the feature vector to match autoencoder training input
         return Netflow.scale_vector(self.get_feature_vector())
+
+    def to_dict(self):
+        store, slot = self._store, self._slot
+        sip, sport = int(store.sources[slot]), int(store.source_ports[slot])
+        #the other side of the flow is the other endpoint of its canonical key
+        ip_a, port_a, ip_b, port_b, _ = flowkey.split_key(self.get_key())
+        if (ip_a, port_a) == (sip, sport):
+            dip, dport = ip_b, port_b
+        else:
+            dip, dport = ip_a, port_a
+        spkts, dpkts, sbytes, dbytes, spkts_size, dpkts_size = self.counters()
+        row = store.features[slot]
+        return {
+            'sip': flowkey.int_to_ip(sip),
+            'dip': flowkey.int_to_ip(dip),
+            'sport': sport,
+            'dport': dport,
+            'key': flowkey.key_to_str(self.get_directed_key()),
+            'stime': self.get_start_time(),
+            'ltime': self.get_last_time(),
+            'tcp_state': int(store.tcp_state[slot]),
+            'proto': 'TCP' if row[IS_TCP] else 'UDP',
+            'spkts': spkts,
+            'dpkts': dpkts,
+            'sbytes': sbytes,
+            'dbytes': dbytes,
+            'spkts_size': spkts_size,
+            'dpkts_size': dpkts_size,
+            'smean': float(row[SMEAN]),
+            'dmean': float(row[DMEAN]),
+        }
     
     def toJSON(self):
-        return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True, indent=4)
\ No newline at end of file
+        return json.dumps(self.to_dict(), sort_keys=True, indent=4)
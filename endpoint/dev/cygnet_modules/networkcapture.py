@@ -1,52 +1,168 @@
-from scapy.all import sniff, Packet
+from typing import TYPE_CHECKING
+from contextlib import nullcontext
+import logging
 import time
 from cygnet_modules.netflow import *
-from cygnet_modules import immune
-from multiprocessing import Process, Pipe, Queue
+from cygnet_modules import rawcapture
+from cygnet_modules.flowkey import make_key, key_shard
+from cygnet_modules.flowtable import FlowTable, TCP_CLOSE
+from cygnet_modules.emission import EmissionPolicy
+from cygnet_modules.metrics import Metrics
 import threading
+if TYPE_CHECKING:
+    from scapy.all import Packet
+
+logger = logging.getLogger(__name__)
+
+#capture backends
+SCAPY_BACKEND = 'scapy'
+RAW_BACKEND = 'raw' #AF_PACKET socket + offset based header parsing (linux only)
 
 class NetworkCollector:
     def __init__(
-            self, 
+            self,
             bpf_filter: str,
-            network_flows: dict,
-            stdout=None
+            network_flows: FlowTable,
+            stdout=None,
+            backend=SCAPY_BACKEND,
+            interface=None,
+            host=None,
+            emission: EmissionPolicy=None,
+            metrics: Metrics=None,
+            stats_interval=None,
         ):
+        """
+        :param bpf_filter: BPF filter for the scapy backend
+        :param network_flows: flow table (flow key -> Netflow) managing the flows' lifecycle
+        :param stdout: queue the (flow key, feature vector) updates are put on, or a list of
+            queues (one per DCA worker) the updates are sharded to by a stable hash of the flow key
+        :param backend: capture backend - SCAPY_BACKEND or RAW_BACKEND
+        :param interface: interface the raw backend binds to (None -> all)
+        :param host: ip address the raw backend filters on (None -> no filtering)
+        :param emission: which flow updates are emitted (None -> every update)
+        :param metrics: latency metrics - the updates carry a monotonic trace stamp (None -> no instrumentation)
+        :param stats_interval: seconds between the collector's stats log lines - flow table and
+            emission counters - of a live capture (None -> never)
+        """
         self._bpf_filter = bpf_filter
         self._network_flows = network_flows
         self._stdout = stdout
+        self._shards = list(stdout) if isinstance(stdout, (list, tuple)) else None
+        self._backend = backend
+        self._interface = interface
+        self._host = host
+        self._emission = EmissionPolicy() if emission == None else emission
+        self._metrics = metrics
+        self._stats_interval = stats_interval
+        self._live = False #capture lag is only measured for live captures
+        #the flow table is shared by the capture and the sweep timer thread of a live capture
+        #(a lock is only needed then - created in start, as locks can't be sent to the process)
+        self._lock = nullcontext()
+        self._total_packets = 0
+        #every flow that ends gets a final feature vector emitted
+        self._network_flows.set_on_expire(self.emit_final)
 
     def start(self):
-        sniff(count=0,filter=self._bpf_filter,prn=self.process_packet, store=False)
-        
-    def process_packet(self, pkt: Packet):
-            def pkt_proc(pkt: Packet):
-                if pkt.haslayer('IP'):
-                    #(limiting to TCP or UDP based packets only)
-                    if pkt.haslayer('UDP') or pkt.haslayer('TCP'):
-                        self._total_packets += 1
-                        candidate1 = Pktops.get_key_from_packet(pkt) #first flow id candidate
-                        #the bases of each side in the 2-sided bidrectional (!) flow
-                        #e.g. for {192.10.67.8:90-8.8.8.8:443}, the bases are the substrings seperated by '-'
-                        key_bases = candidate1.split('-')
-                        candidate2 = f"{key_bases[1]}-{key_bases[0]}" #inverse of candidate1
-                        #Checking if flow exists for the packet
-                        if candidate1 in self._network_flows:
-                            flow_id = candidate1
-                        elif candidate2 in self._network_flows:
-                            flow_id = candidate2
-                        else:
-                            flow_id = None
-                        if flow_id != None:
-                            #Updating flow
-                            flow = self._network_flows[flow_id]
-                            #if current source = netflow source
-                            flow.update(pkt)
-                            if self._stdout!=None:
-                                self._stdout.put((flow.get_key(), flow.vectorise()))
-                        else:
-                            #if flow doesnt exist for the packet -> create new flow
-                            flow = Netflow.netflow_from_packet(pkt)
-                            self._network_flows[flow.get_key()] = flow
-                return
-            return pkt_proc(pkt)
\ No newline at end of file
+        self._live = True
+        self._lock = threading.Lock()
+        threading.Thread(target=self.sweep_periodically, name="FlowSweep", daemon=True).start()
+        if self._backend == RAW_BACKEND:
+            self.process_source(rawcapture.AFPacketSource(self._interface, self._host))
+        else:
+            #scapy is imported only when its backend is used (its import alone takes ~1s)
+            from scapy.all import sniff
+            sniff(count=0,filter=self._bpf_filter,prn=self.process_packet, store=False)
+
+    def replay(self, pcap_path, flush=True):
+        """feeds the packets of a pcap file through the collector using the raw parser"""
+        self.process_source(rawcapture.PcapSource(pcap_path), flush)
+
+    def process_source(self, source, flush=True):
+        #fast path - the source decodes the headers itself, no scapy dissection involved
+        process_info = self.process_info
+        for info in source.packets():
+            process_info(info)
+        if flush:
+            #end of capture - all remaining flows end
+            self._network_flows.flush()
+
+    def process_packet(self, pkt: 'Packet'):
+        if pkt.haslayer('IP'):
+            #(limiting to TCP or UDP based packets only)
+            if pkt.haslayer('UDP') or pkt.haslayer('TCP'):
+                self.process_info(Pktops.packet_info(pkt))
+
+    def sweep_periodically(self):
+        #idle flows also end on a quiet link (the packets' sweeps need packets to arrive),
+        #and the stats are logged from here (in the capture process)
+        flows = self._network_flows
+        next_stats = None if self._stats_interval == None else time.monotonic()+self._stats_interval
+        while True:
+            time.sleep(flows.get_sweep_interval())
+            with self._lock:
+                flows.sweep(time.time())
+                if next_stats != None and time.monotonic() >= next_stats:
+                    next_stats = time.monotonic()+self._stats_interval
+                    logger.info("collector stats: %s", self.stats())
+
+    def process_info(self, info: PacketInfo):
+        with self._lock:
+            self._process_info(info)
+
+    def _process_info(self, info: PacketInfo):
+        self._total_packets += 1
+        metrics = self._metrics
+        if metrics != None:
+            if self._live:
+                #capture (kernel timestamp) -> processing
+                metrics.observe('collector.capture_lag', time.time()-info.time)
+            metrics.maybe_dump(time.monotonic())
+        #both directions of the bidirectional (!) flow share the same canonical key
+        key = make_key(info.sip, info.sport, info.dip, info.dport, info.proto)
+        flows = self._network_flows
+        flows.sweep(info.time)
+        slot = flows.lookup(key, info.time)
+        if slot != None:
+            #Updating flow (in place, in the flow store's columns)
+            store = flows.get_store()
+            store.update(slot, info)
+            if store.tcp_closed(slot):
+                flows.end(key, TCP_CLOSE) #emits the final vector
+            elif self._stdout!=None and self._emission.admit(store, slot, info.time):
+                self.output(store.directed_key(slot), Netflow.scale_vector(store.feature_vector(slot)))
+        elif not flows.is_late(key, info):
+            #if flow doesnt exist for the packet -> create new flow (unless it is a late packet
+            #of a torn down connection) - a first packet can already end it (RST)
+            slot = flows.insert(key, info)
+            self._emission.start(flows.get_store(), slot)
+            if flows.get_store().tcp_closed(slot):
+                flows.end(key, TCP_CLOSE)
+
+    def emit_final(self, key, flow: Netflow):
+        #final feature vector of an ended flow
+        if self._stdout!=None:
+            self._emission.final()
+            self.output(flow.get_directed_key(), flow.vectorise())
+
+    def output(self, key, vector):
+        #puts the update (directed flow key - alerts are rendered from the flow's initiator) on
+        #the queue of the flow's DCA worker (stamped, when instrumented)
+        update = (key, vector) if self._metrics == None else (key, vector, time.monotonic())
+        if self._shards == None:
+            self._stdout.put(update)
+        else:
+            shards = self._shards
+            shards[key_shard(key, len(shards))].put(update)
+
+    def get_metrics(self):
+        return self._metrics
+
+    def get_total_packets(self):
+        return self._total_packets
+
+    def stats(self):
+        """returns the packet count, number of tracked flows, evictions by reason and emission counters"""
+        stats = self._network_flows.stats()
+        stats['packets'] = self._total_packets
+        stats['emission'] = self._emission.stats()
+        return stats
@@ -0,0 +1,210 @@
+from collections import OrderedDict
+import numpy as np
+
+#profile eviction reasons
+TTL_EXPIRED = 'ttl'
+CAPACITY = 'capacity'
+#estimated bytes of a profile's table entry (OrderedDict entry + flow key + row int),
+#on top of its 3 float64 counter columns
+ENTRY_BYTES = 116
+COLUMN_BYTES = 3*8
+
+class ProfileStore:
+    """
+    Antigen profiles of the lymph node - mature/total presentation counters per flow key,
+    kept in NumPy columns (a row per profile) and updated in bulk for a batch of presentations.
+    The table (flow key -> row) is kept in least-recently-presented order, so stale profiles
+    are always at the front.
+
+    With a half_life, the counters decay exponentially over time (halving every half_life
+    seconds without presentations), so the MCAV reflects the antigen's recent behaviour.
+    A profile is evicted when:
+        - it wasn't presented for ttl seconds (checked every sweep_interval seconds)
+        - the store is full (max_profiles, or the max_bytes memory cap) and it is the
+          least recently presented profile (profiles of the batch being presented aren't
+          evicted - a batch with more keys than max_profiles grows the store past it)
+
+    Attributes:
+        max_profiles (int): max number of profiles (None -> unlimited)
+        max_bytes (int): memory cap in bytes, lowers max_profiles accordingly (None -> no cap)
+        ttl (float): seconds without presentations before a profile is evicted (None -> never)
+        half_life (float): half life of the counters in seconds (None -> no decay)
+        sweep_interval (float): seconds between ttl sweeps
+        capacity (int): initial number of rows (doubled when full)
+    """
+    def __init__(self,
+            max_profiles=65536,
+            max_bytes=None,
+            ttl=None,
+            half_life=None,
+            sweep_interval=1.0,
+            capacity=1024,
+        ):
+        if max_bytes != None:
+            by_bytes = max(1, max_bytes//(ENTRY_BYTES+COLUMN_BYTES))
+            max_profiles = by_bytes if max_profiles == None else min(max_profiles, by_bytes)
+        self._max_profiles = max_profiles
+        self._ttl = ttl
+        self._half_life = half_life
+        self._sweep_interval = sweep_interval
+        if max_profiles != None:
+            capacity = min(capacity, max_profiles)
+        self._rows = OrderedDict() #key -> row
+        #recency order is only kept up to date when profiles can be evicted
+        self._lru = max_profiles != None or ttl != None
+        self._free = []
+        self._n_rows = 0 #rows handed out so far
+        self.mature = np.zeros(shape=capacity, dtype=np.float64)
+        self.total = np.zeros(shape=capacity, dtype=np.float64)
+        self.last_seen = np.zeros(shape=capacity, dtype=np.float64)
+        self._next_sweep = None
+        self._first_seen = None
+        self._now = None
+        self._presented = 0
+        self._evictions = {
+            TTL_EXPIRED: 0,
+            CAPACITY: 0,
+        }
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def capacity(self):
+        return len(self.total)
+
+    def _grow(self):
+        capacity = self.capacity()*2
+        if self._max_profiles != None:
+            #(past max_profiles only for a batch with more keys than that)
+            capacity = max(min(capacity, self._max_profiles), self.capacity()+1)
+        for name in ('mature', 'total', 'last_seen'):
+            column = getattr(self, name)
+            grown = np.zeros(shape=capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def _allocate(self):
+        if self._free:
+            return self._free.pop()
+        if self._n_rows == self.capacity():
+            self._grow()
+        self._n_rows += 1
+        return self._n_rows-1
+
+    def evict(self, reason):
+        """evicts the least recently presented profile"""
+        _, row = self._rows.popitem(last=False)
+        self._free.append(row)
+        self._evictions[reason] += 1
+
+    def present(self, keys, contexts, now) -> np.ndarray:
+        """
+        records a batch of presentations - the i'th antigen (flow key) presented in
+        contexts[i] (1 -> mature, 0 -> semi-mature) - decaying the presented profiles'
+        counters to now first. returns the profile rows of the keys
+        """
+        self.sweep(now)
+        if self._first_seen == None:
+            self._first_seen = now
+        self._now = now
+        table = self._rows
+        batch = dict.fromkeys(keys) #unique keys of the batch
+        missing = [key for key in batch if key not in table]
+        if self._lru:
+            #marking the known keys as recently presented first, so they aren't evicted below
+            for key in (batch if not missing else [key for key in batch if key in table]):
+                table.move_to_end(key)
+        if missing:
+            new_rows = []
+            #profiles of the batch (at the back of the table) - never evicted for it, the store
+            #grows past max_profiles instead when the batch alone has more keys
+            in_batch = len(batch)-len(missing)
+            for key in missing:
+                while self._max_profiles != None and len(table) >= self._max_profiles and len(table) > in_batch:
+                    self.evict(CAPACITY)
+                in_batch += 1
+                row = self._allocate()
+                table[key] = row
+                new_rows.append(row)
+            self.mature[new_rows] = 0
+            self.total[new_rows] = 0
+            self.last_seen[new_rows] = now
+        rows = np.fromiter(map(table.__getitem__, keys), dtype=np.int64, count=len(keys))
+        presented = np.fromiter(map(table.__getitem__, batch), dtype=np.int64, count=len(batch))
+        if self._half_life != None:
+            decay = np.exp2((self.last_seen[presented]-now)/self._half_life)
+            self.mature[presented] *= decay
+            self.total[presented] *= decay
+        self.last_seen[presented] = now
+        np.add.at(self.mature, rows, contexts)
+        np.add.at(self.total, rows, 1)
+        self._presented += len(keys)
+        return rows
+
+    def mcav(self, rows) -> np.ndarray:
+        return self.mature[rows]/(self.total[rows]+1)
+
+    def anomalous(self, rows, contexts, threshold) -> np.ndarray:
+        """
+        returns the indices of the batch's presentations (rows, contexts as given to present)
+        after which their antigen's MCAV exceeds the threshold - the MCAV as it was right after
+        each presentation, as if the batch had been presented one by one
+        """
+        n = len(rows)
+        if not n:
+            return np.zeros(0, dtype=np.int64)
+        #presentations grouped by profile, in batch order within a profile
+        order = np.argsort(rows, kind='stable')
+        sorted_rows = rows[order]
+        sorted_contexts = np.asarray(contexts, dtype=np.float64)[order]
+        starts = np.flatnonzero(np.r_[True, sorted_rows[1:] != sorted_rows[:-1]])
+        ends = np.r_[starts[1:], n]-1
+        group = np.repeat(np.arange(len(starts)), ends-starts+1)
+        #running mature/total counts of every presentation within its profile's presentations
+        mature = np.cumsum(sorted_contexts)
+        before = (mature-sorted_contexts)[starts]
+        running_mature = mature-before[group]
+        running_total = np.arange(n)-starts[group]+1
+        #counters before the batch = counters now - the batch's presentations
+        base_mature = self.mature[sorted_rows]-(mature[ends]-before)[group]
+        base_total = self.total[sorted_rows]-(ends-starts+1)[group]
+        mcav = (base_mature+running_mature)/(base_total+running_total+1)
+        return np.sort(order[mcav>threshold])
+
+    def sweep(self, now):
+        """evicts the profiles that weren't presented for ttl (at most once per sweep_interval)"""
+        if self._ttl == None:
+            return
+        if self._next_sweep != None and now < self._next_sweep:
+            return
+        self._next_sweep = now+self._sweep_interval
+        deadline = now-self._ttl
+        table = self._rows
+        last_seen = self.last_seen
+        while table:
+            key = next(iter(table))
+            if last_seen[table[key]] > deadline:
+                break
+            self.evict(TTL_EXPIRED)
+
+    def nbytes(self):
+        """estimated memory used by the profiles (counter columns + table entries)"""
+        return 3*self.total.nbytes+len(self._rows)*ENTRY_BYTES
+
+    def stats(self):
+        """returns the profile count, memory use (total and per profile) and the evictions"""
+        n = len(self._rows)
+        evictions = sum(self._evictions.values())
+        elapsed = 0 if self._first_seen == None else self._now-self._first_seen
+        return {
+            'profiles': n,
+            'capacity': self.capacity(),
+            'bytes': self.nbytes(),
+            'bytes_per_profile': self.nbytes()/n if n else 0,
+            'presented': self._presented,
+            'evictions': dict(self._evictions),
+            'evictions_per_sec': evictions/elapsed if elapsed > 0 else 0,
+        }
@@ -0,0 +1,317 @@
+import socket
+import struct
+import time
+from cygnet_modules.netflow import PacketInfo
+from cygnet_modules import flowkey
+
+#link layer types (as defined by tcpdump.org/linktypes)
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+
+#ethernet
+ETH_HLEN = 14
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+ETH_P_8021Q = 0x8100
+ETH_P_8021AD = 0x88A8
+SLL_HLEN = 16
+#AF_PACKET link (ARPHRD) types -> link layer type of their frames, as read from a SOCK_RAW
+#socket (loopback frames have an ethernet header, tun/ppp frames start at the ip header)
+ARPHRD_ETHER = 1
+ARPHRD_PPP = 512
+ARPHRD_LOOPBACK = 772
+ARPHRD_NONE = 0xFFFE
+HATYPE_LINKTYPES = {
+    ARPHRD_ETHER: LINKTYPE_ETHERNET,
+    ARPHRD_LOOPBACK: LINKTYPE_ETHERNET,
+    ARPHRD_PPP: LINKTYPE_RAW,
+    ARPHRD_NONE: LINKTYPE_RAW,
+}
+#packet type of the frames sent by this host
+PACKET_OUTGOING = 4
+
+#pcap file magic numbers (microsecond/nanosecond resolution)
+PCAP_MAGIC_US = 0xA1B2C3D4
+PCAP_MAGIC_NS = 0xA1B23C4D
+#pcapng block types and byte order magic
+PCAPNG_SHB = 0x0A0D0D0A #section header
+PCAPNG_IDB = 0x00000001 #interface description
+PCAPNG_PB = 0x00000002 #packet (obsolete)
+PCAPNG_SPB = 0x00000003 #simple packet
+PCAPNG_EPB = 0x00000006 #enhanced packet
+PCAPNG_BYTE_ORDER = 0x1A2B3C4D
+PCAPNG_OPT_TSRESOL = 9
+
+#max frame size read from the raw socket
+SNAPLEN = 65535
+
+_ports = struct.Struct('!HH')
+_addrs = struct.Struct('!II')
+_u16 = struct.Struct('!H')
+
+def parse_frame(frame, timestamp, linktype=LINKTYPE_ETHERNET):
+    """
+    decodes only the IPv4/TCP/UDP header fields Netflow needs, using offsets into the raw frame.
+
+    Args:
+        frame (bytes-like): the captured frame, starting at the link layer
+        timestamp (float): capture time of the frame
+        linktype (int): link layer type of the frame
+
+    Returns:
+        PacketInfo: decoded packet, or None if the frame is not a (first fragment)
+        IPv4 packet carrying TCP or UDP
+    """
+    length = len(frame)
+    if linktype == LINKTYPE_ETHERNET:
+        if length < ETH_HLEN:
+            return None
+        offset = ETH_HLEN
+        ethertype = _u16.unpack_from(frame, 12)[0]
+        #skipping (possibly stacked) vlan tags
+        while ethertype == ETH_P_8021Q or ethertype == ETH_P_8021AD:
+            if length < offset+4:
+                return None
+            ethertype = _u16.unpack_from(frame, offset+2)[0]
+            offset += 4
+        if ethertype != ETH_P_IP:
+            return None
+        #matching scapy: the payload of an ethernet frame is everything after its header
+        payload_size = length-ETH_HLEN
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if length < SLL_HLEN or _u16.unpack_from(frame, 14)[0] != ETH_P_IP:
+            return None
+        offset = SLL_HLEN
+        payload_size = length-SLL_HLEN
+    elif linktype == LINKTYPE_RAW:
+        offset = 0
+        payload_size = None #the ip header is the first layer - set below
+    else:
+        return None
+
+    if length < offset+20:
+        return None
+    version_ihl = frame[offset]
+    if version_ihl >> 4 != 4:
+        return None
+    ihl = (version_ihl & 0x0F)*4
+    proto = frame[offset+9]
+    if proto != flowkey.PROTO_TCP and proto != flowkey.PROTO_UDP:
+        return None
+    #non-first fragments carry no transport header
+    if _u16.unpack_from(frame, offset+6)[0] & 0x1FFF:
+        return None
+    if length < offset+ihl+4:
+        return None
+    sip, dip = _addrs.unpack_from(frame, offset+12)
+    sport, dport = _ports.unpack_from(frame, offset+ihl)
+    flags = 0
+    if proto == flowkey.PROTO_TCP and length > offset+ihl+13:
+        flags = frame[offset+ihl+13]
+    if payload_size is None:
+        payload_size = length-ihl
+    return PacketInfo(
+        sip,
+        dip,
+        sport,
+        dport,
+        proto,
+        length,
+        payload_size,
+        timestamp,
+        flags,
+    )
+
+class AFPacketSource:
+    """
+    Reads frames straight from an AF_PACKET socket (linux only), bypassing scapy. Every frame
+    is parsed as the link layer of the interface it was captured on (its sll_hatype) - frames
+    of other link types are skipped, as are loopback frames sent by this host (the loopback
+    interface also receives them)
+
+    Attributes:
+        interface (str): interface to bind to (None -> all interfaces)
+        host (str): if given, only packets to/from this ip address are yielded
+            (the "host {addr}" part of the collector's BPF filter)
+    """
+    def __init__(self, interface=None, host=None):
+        self._interface = interface
+        self._host = flowkey.ip_to_int(host) if host != None else None
+        self._socket = None
+
+    def open(self):
+        self._socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.ntohs(ETH_P_ALL))
+        if self._interface != None:
+            self._socket.bind((self._interface, 0))
+
+    def close(self):
+        if self._socket != None:
+            self._socket.close()
+            self._socket = None
+
+    def packets(self):
+        """yields the PacketInfo of every valid captured packet, forever"""
+        if self._socket == None:
+            self.open()
+        buf = bytearray(SNAPLEN)
+        view = memoryview(buf)
+        host = self._host
+        recvfrom_into = self._socket.recvfrom_into
+        linktypes = HATYPE_LINKTYPES
+        try:
+            while True:
+                n, address = recvfrom_into(buf)
+                #address - (interface, protocol, packet type, hatype, hardware address)
+                linktype = linktypes.get(address[3])
+                if linktype == None or (address[3] == ARPHRD_LOOPBACK and address[2] == PACKET_OUTGOING):
+                    continue
+                info = parse_frame(view[:n], time.time(), linktype)
+                if info == None:
+                    continue
+                if host != None and info.sip != host and info.dip != host:
+                    continue
+                yield info
+        finally:
+            self.close()
+
+class PcapSource:
+    """
+    Reads frames from a libpcap (.pcap) or pcapng capture file, bypassing scapy.
+
+    Attributes:
+        path (str): path of the capture file
+    """
+    def __init__(self, path):
+        self._path = path
+
+    def frames(self):
+        """yields (timestamp, frame, linktype) for every record in the file"""
+        with open(self._path, 'rb') as f:
+            magic = f.read(4)
+            if len(magic) < 4:
+                return
+            if struct.unpack('<I', magic)[0] == PCAPNG_SHB:
+                yield from _pcapng_frames(f, magic)
+            else:
+                yield from _pcap_frames(f, magic)
+
+    def packets(self):
+        """yields the PacketInfo of every valid packet in the file"""
+        for timestamp, frame, linktype in self.frames():
+            info = parse_frame(frame, timestamp, linktype)
+            if info != None:
+                yield info
+
+def _pcap_frames(f, magic_bytes):
+    header = magic_bytes+f.read(20)
+    if len(header) < 24:
+        return
+    magic = struct.unpack('<I', header[:4])[0]
+    if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+        endian = '<'
+    else:
+        magic = struct.unpack('>I', header[:4])[0]
+        if magic not in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+            raise Exception('INVALID PCAP FILE')
+        endian = '>'
+    ts_div = 1e9 if magic == PCAP_MAGIC_NS else 1e6
+    linktype = struct.unpack(endian+'I', header[20:24])[0] & 0x0FFFFFFF
+    record_header = struct.Struct(endian+'IIII')
+    read = f.read
+    while True:
+        rec = read(16)
+        if len(rec) < 16:
+            return
+        ts_sec, ts_frac, incl_len, _ = record_header.unpack(rec)
+        data = read(incl_len)
+        if len(data) < incl_len:
+            return
+        yield ts_sec+ts_frac/ts_div, data, linktype
+
+def _tsresol_divisor(options, endian):
+    #timestamp units per second of an interface (if_tsresol option, default microseconds)
+    i = 0
+    while i+4 <= len(options):
+        code, length = struct.unpack(endian+'HH', options[i:i+4])
+        if code == 0:
+            break
+        if code == PCAPNG_OPT_TSRESOL and length >= 1:
+            resol = options[i+4]
+            return 2**(resol & 0x7F) if resol & 0x80 else 10**resol
+        i += 4+((length+3) & ~3)
+    return 1e6
+
+def _pcapng_frames(f, type_bytes):
+    """yields (timestamp, frame, linktype) of the packet blocks of a pcapng file"""
+    read = f.read
+    endian = '<'
+    interfaces = [] #(linktype, timestamp units per second) of the current section's interfaces
+    while len(type_bytes) == 4:
+        length_bytes = read(4)
+        if len(length_bytes) < 4:
+            return
+        if struct.unpack('<I', type_bytes)[0] == PCAPNG_SHB:
+            #a new section - its byte order magic decides the endianness of its blocks
+            byte_order = read(4)
+            if len(byte_order) < 4:
+                return
+            if struct.unpack('<I', byte_order)[0] == PCAPNG_BYTE_ORDER:
+                endian = '<'
+            elif struct.unpack('>I', byte_order)[0] == PCAPNG_BYTE_ORDER:
+                endian = '>'
+            else:
+                raise Exception('INVALID PCAPNG FILE')
+            read(struct.unpack(endian+'I', length_bytes)[0]-12)
+            interfaces = []
+        else:
+            block_type = struct.unpack(endian+'I', type_bytes)[0]
+            length = struct.unpack(endian+'I', length_bytes)[0]
+            if length < 12:
+                raise Exception('INVALID PCAPNG FILE')
+            body = read(length-12)
+            if len(body) < length-12:
+                return
+            read(4) #trailing block length
+            if block_type == PCAPNG_IDB:
+                linktype = struct.unpack(endian+'H', body[:2])[0]
+                interfaces.append((linktype, _tsresol_divisor(body[8:], endian)))
+            elif block_type == PCAPNG_EPB:
+                interface, ts_high, ts_low, caplen = struct.unpack(endian+'IIII', body[:16])
+                linktype, divisor = interfaces[interface]
+                yield ((ts_high << 32) | ts_low)/divisor, body[20:20+caplen], linktype
+            elif block_type == PCAPNG_PB:
+                interface, _, ts_high, ts_low, caplen = struct.unpack(endian+'HHIII', body[:16])
+                linktype, divisor = interfaces[interface]
+                yield ((ts_high << 32) | ts_low)/divisor, body[20:20+caplen], linktype
+            elif block_type == PCAPNG_SPB and interfaces:
+                #simple packet blocks carry no timestamp
+                caplen = struct.unpack(endian+'I', body[:4])[0]
+                yield 0.0, body[4:4+caplen], interfaces[0][0]
+        type_bytes = read(4)
+
+class PacedSource:
+    """
+    Replays the packets of another source at their original pace (packet timestamps),
+    sped up by a multiplier.
+
+    Attributes:
+        source: packet source (e.g. a PcapSource)
+        speed (float): speed multiplier (2 -> twice as fast; 0 -> no pacing, as fast as possible)
+    """
+    def __init__(self, source, speed=1.0):
+        self._source = source
+        self._speed = speed
+
+    def packets(self):
+        if self._speed <= 0:
+            yield from self._source.packets()
+            return
+        start = None
+        for info in self._source.packets():
+            if start == None:
+                start = (info.time, time.perf_counter())
+            delay = (info.time-start[0])/self._speed-(time.perf_counter()-start[1])
+            if delay > 0:
+                time.sleep(delay)
+            yield info
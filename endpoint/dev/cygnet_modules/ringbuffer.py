@@ -0,0 +1,328 @@
+"""
+Single-producer/single-consumer ring buffers of fixed-size records in shared memory.
+
+A ring carries its records between exactly two processes without pickling, pipes or
+feeder threads: the producer writes a record in place and advances the tail index, the
+consumer reads the records between its head index and the tail and advances the head.
+Each index is only ever written by one side, so no lock is needed (record writes are
+published by the index store that follows them). An idle consumer blocks on a semaphore
+the producer releases only while the consumer is waiting, so writes cost no system call
+while the consumer is busy and an idle consumer doesn't wake up.
+
+The rings expose the multiprocessing.Queue methods the pipeline uses (put, get,
+get_nowait, put(None) as the end sentinel), so they can replace the queues as they are,
+plus a batch read (get_batch) for the DCA.
+"""
+import multiprocessing
+import queue
+import time
+from abc import ABC, abstractmethod
+import numpy as np
+from multiprocessing import shared_memory
+from cygnet_modules.immune import DCOutput
+from cygnet_modules.flowkey import join_keys
+
+#backpressure policies of a full ring
+BLOCK = 'block' #the producer waits for room
+DROP = 'drop' #the record is dropped (and counted)
+
+#header - uint64 slots, head and tail on separate cache lines
+_HEAD = 0
+_TAIL = 8
+_DROPPED = 16
+_CLOSED = 24
+_WAITING = 32 #the consumer is (about to be) blocked on the semaphore
+_HEADER_BYTES = 320
+#waiting backs off from MIN_WAIT to MAX_WAIT seconds between index checks, then the consumer
+#blocks on the ring's semaphore - for at most WAKEUP_TIMEOUT seconds at a time, the bound on
+#the delay of a wakeup lost to the race of the two sides' flag/index checks
+MIN_WAIT = 0.00002
+MAX_WAIT = 0.002
+WAKEUP_TIMEOUT = 0.1
+
+#flow update record - flow key (split in high/low 64 bits) + scaled feature row, and the
+#monotonic trace stamp of an instrumented pipeline's records
+FLOW_RECORD = np.dtype([('key', '<u8', (2,)), ('features', '<f8', (8,))])
+STAMPED_FLOW_RECORD = np.dtype([('key', '<u8', (2,)), ('features', '<f8', (8,)), ('stamp', '<f8')])
+_LOW = 0xFFFFFFFFFFFFFFFF
+
+def migration_record(max_antigens):
+    """record of a DC migration carrying up to max_antigens flow keys (and its trace stamps)"""
+    return np.dtype([('k', '<f8'), ('csm', '<f8'), ('n', '<u4'), ('keys', '<u8', (max_antigens, 2)),
+                     ('stamps', '<f8', (2,))])
+
+class RingBuffer(ABC):
+    """
+    fixed-capacity SPSC ring of numpy records in a multiprocessing.shared_memory block.
+    pickling a ring (e.g. passing it to a Process) attaches the other process to the same block
+    (and shares its wakeup semaphore) - subclasses define the record encoding
+
+    Attributes:
+        capacity (int): number of records (rounded up to a power of 2)
+        dtype (np.dtype): record dtype
+        policy (str): BLOCK or DROP - what put does when the ring is full
+        name (str): shared memory block name (None -> generated)
+    """
+    def __init__(self, capacity, dtype, policy=BLOCK, name=None, create=True, ready=None):
+        capacity = 1 << max(0, int(capacity)-1).bit_length()
+        self._capacity = capacity
+        self._dtype = np.dtype(dtype)
+        self._policy = policy
+        self._owner = create
+        size = _HEADER_BYTES+capacity*self._dtype.itemsize
+        self._shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self._header = np.ndarray(_HEADER_BYTES//8, dtype=np.uint64, buffer=self._shm.buf)
+        self._records = np.ndarray(capacity, dtype=self._dtype, buffer=self._shm.buf, offset=_HEADER_BYTES)
+        self._mask = capacity-1
+        #released by the producer to wake up a blocked consumer
+        self._ready = multiprocessing.Semaphore(0) if ready == None else ready
+        if create:
+            self._header[:] = 0
+
+    def __getstate__(self):
+        return (self._capacity, self._dtype, self._policy, self._shm.name, self._ready)
+
+    def __setstate__(self, state):
+        capacity, dtype, policy, name, ready = state
+        RingBuffer.__init__(self, capacity, dtype, policy, name=name, create=False, ready=ready)
+
+    def name(self):
+        return self._shm.name
+
+    def capacity(self):
+        return self._capacity
+
+    def qsize(self):
+        return int(self._header[_TAIL]-self._header[_HEAD])
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def dropped(self):
+        return int(self._header[_DROPPED])
+
+    def closed(self):
+        return bool(self._header[_CLOSED])
+
+    def close(self):
+        #producer side - no more records will be written (the consumer drains what's left)
+        self._header[_CLOSED] = 1
+        self.notify()
+
+    def notify(self):
+        #producer side - wakes the consumer if it is blocked waiting for records
+        header = self._header
+        if header[_WAITING]:
+            header[_WAITING] = 0
+            self._ready.release()
+
+    def release(self):
+        """detaches from the shared memory block (and frees it, in the creating process)"""
+        self._header = None
+        self._records = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    def reserve(self):
+        """
+        returns the tail index the next record is written at, or -1 if the ring is full and
+        the policy is DROP (the drop is counted). the write is published by commit(tail)
+        """
+        header = self._header
+        tail = int(header[_TAIL])
+        if tail-int(header[_HEAD]) >= self._capacity:
+            if self._policy == DROP:
+                header[_DROPPED] += 1
+                return -1
+            wait = MIN_WAIT
+            while tail-int(header[_HEAD]) >= self._capacity:
+                time.sleep(wait)
+                wait = min(wait*2, MAX_WAIT)
+        return tail
+
+    def commit(self, tail):
+        self._header[_TAIL] = tail+1
+        self.notify()
+
+    def write(self, records: np.ndarray) -> int:
+        """writes a batch of records, returns how many were written (fewer if DROP and full)"""
+        header = self._header
+        written = 0
+        while written < len(records):
+            tail = int(header[_TAIL])
+            room = self._capacity-(tail-int(header[_HEAD]))
+            if room <= 0:
+                if self._policy == DROP:
+                    header[_DROPPED] += len(records)-written
+                    break
+                time.sleep(MIN_WAIT)
+                continue
+            start = tail & self._mask
+            n = min(room, len(records)-written, self._capacity-start)
+            self._records[start:start+n] = records[written:written+n]
+            header[_TAIL] = tail+n
+            written += n
+        self.notify()
+        return written
+
+    def wait(self, timeout=None) -> bool:
+        """
+        waits until a record can be read or the ring is closed (up to timeout seconds,
+        None -> forever). returns whether a record can be read. short waits (a busy producer)
+        are sleeps backing off to MAX_WAIT, longer ones block on the semaphore
+        """
+        header = self._header
+        if header[_TAIL] != header[_HEAD]:
+            return True
+        deadline = None if timeout == None else time.monotonic()+timeout
+        wait = MIN_WAIT
+        while header[_TAIL] == header[_HEAD]:
+            if header[_CLOSED]:
+                return header[_TAIL] != header[_HEAD]
+            remaining = WAKEUP_TIMEOUT
+            if deadline != None:
+                remaining = deadline-time.monotonic()
+                if remaining <= 0:
+                    return False
+            if wait < MAX_WAIT:
+                time.sleep(min(wait, remaining))
+                wait *= 2
+                continue
+            #the flag is set before the last index check, so a record written after it wakes us
+            header[_WAITING] = 1
+            if header[_TAIL] == header[_HEAD] and not header[_CLOSED]:
+                self._ready.acquire(timeout=min(remaining, WAKEUP_TIMEOUT))
+            header[_WAITING] = 0
+        return True
+
+    def read(self, max_records) -> np.ndarray:
+        """reads (copies out) up to max_records available records"""
+        header = self._header
+        head = int(header[_HEAD])
+        available = int(header[_TAIL])-head
+        n = min(available, max_records)
+        start = head & self._mask
+        first = min(n, self._capacity-start)
+        if first == n:
+            records = self._records[start:start+n].copy()
+        else:
+            records = np.concatenate([self._records[start:], self._records[:n-first]])
+        header[_HEAD] = head+n
+        return records
+
+    def stats(self):
+        return {'capacity': self._capacity, 'queued': self.qsize(), 'dropped': self.dropped()}
+
+    #Queue interface
+    def put(self, item):
+        if item is None:
+            self.close()
+            return True
+        tail = self.reserve()
+        if tail < 0:
+            return False
+        self.encode(tail & self._mask, item)
+        self.commit(tail)
+        return True
+
+    def get(self, block=True, timeout=None):
+        """returns the next item - None once the ring is closed and drained"""
+        if not self.wait(timeout if block else 0):
+            if self.closed():
+                return None
+            raise queue.Empty
+        return self.decode(self.read(1)[0])
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    @abstractmethod
+    def encode(self, i, item):
+        #writes the item to record i
+        pass
+
+    @abstractmethod
+    def decode(self, record):
+        pass
+
+class FlowUpdateRing(RingBuffer):
+    """
+    ring of the collector's (flow key, (1, 8) feature row) updates - with their trace stamp,
+    (flow key, feature row, stamp), when stamped (instrumented pipeline). the records of an
+    unstamped ring have no stamp field
+    """
+    def __init__(self, capacity=65536, policy=BLOCK, name=None, create=True, stamped=False):
+        super().__init__(capacity, STAMPED_FLOW_RECORD if stamped else FLOW_RECORD, policy, name, create)
+        self._stamped = stamped
+
+    def __getstate__(self):
+        return super().__getstate__()+(self._stamped,)
+
+    def __setstate__(self, state):
+        super().__setstate__(state[:-1])
+        self._stamped = state[-1]
+
+    def encode(self, i, item):
+        key = item[0]
+        records = self._records
+        records['key'][i] = (key >> 64, key & _LOW)
+        records['features'][i] = item[1]
+        if self._stamped:
+            #(an unstamped update of a stamped ring gets 0 - not traced)
+            records['stamp'][i] = item[2] if len(item) > 2 else 0.0
+
+    def decode(self, record):
+        high, low = record['key'].tolist()
+        key, vector = (high << 64) | low, record['features'].reshape(1, 8)
+        if not self._stamped:
+            return (key, vector)
+        stamp = float(record['stamp'])
+        return (key, vector) if stamp == 0.0 else (key, vector, stamp)
+
+    def get_batch(self, max_records, timeout=0):
+        """
+        blocks for the next update, then waits up to timeout seconds for up to max_records
+        updates. returns (flow keys, (N, 8) feature rows, (N,) trace stamps - None if not
+        stamped), or None once closed and drained
+        """
+        if not self.wait():
+            return None
+        if timeout > 0 and self.qsize() < max_records:
+            deadline = time.monotonic()+timeout
+            while self.qsize() < max_records and not self.closed():
+                remaining = deadline-time.monotonic()
+                if remaining <= 0:
+                    break
+                time.sleep(min(MAX_WAIT, remaining))
+        records = self.read(max_records)
+        return join_keys(records['key']), records['features'], records['stamp'] if self._stamped else None
+
+class MigrationRing(RingBuffer):
+    """ring of the DCA's DCOutput migrations (k, csm and up to max_antigens flow keys)"""
+    def __init__(self, max_antigens, capacity=4096, policy=BLOCK, name=None, create=True):
+        super().__init__(capacity, migration_record(max_antigens), policy, name, create)
+        self._max_antigens = max_antigens
+
+    def __getstate__(self):
+        return super().__getstate__()+(self._max_antigens,)
+
+    def __setstate__(self, state):
+        super().__setstate__(state[:-1])
+        self._max_antigens = state[-1]
+
+    def encode(self, i, item: DCOutput):
+        record = self._records[i]
+        keys = item.keys[:self._max_antigens]
+        record['k'] = item.k
+        record['csm'] = item.csm
+        record['n'] = len(keys)
+        record['keys'][:len(keys)] = keys
+        record['stamps'] = (0.0, 0.0) if item.stamps == None else item.stamps
+
+    def decode(self, record):
+        n = int(record['n'])
+        update, migrated = record['stamps'].tolist()
+        #(the record was copied out of the ring - its keys are handed over as they are)
+        return DCOutput(float(record['k']), float(record['csm']), record['keys'][:n],
+                        None if migrated == 0.0 else (update, migrated))
@@ -0,0 +1,241 @@
+"""
+On-disk spool of the alerts the client couldn't deliver (server down/restarting).
+
+The spool is a directory of fixed-size, memory-mapped segment files, written append-only -
+each alert is a 4 byte (big endian) length + its JSON. a segment's header holds its write
+and read offsets, so the undelivered alerts survive an endpoint restart, and fully delivered
+segments are deleted. the total size is capped - when a new segment would exceed it, the
+oldest segments are dropped (with their undelivered alerts, counted).
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+
+SEGMENT_SIZE = 1024*1024
+MAX_BYTES = 64*1024*1024
+#segment header - magic, write offset (end of the last record), read offset (next undelivered record)
+HEADER = struct.Struct('!4sII')
+MAGIC = b'CYGS'
+RECORD_HEADER = struct.Struct('!I')
+SEGMENT_SUFFIX = '.seg'
+
+logger = logging.getLogger(__name__)
+
+class SpoolSegment:
+    """
+    one memory-mapped segment file of the spool
+
+    Attributes:
+        path (str): the segment file
+        size (int): file size of a new segment (None -> opens the existing file)
+    """
+    def __init__(self, path, size=None):
+        self.path = path
+        if size != None:
+            with open(path, 'wb') as f:
+                f.truncate(size)
+        self._file = open(path, 'r+b')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        except ValueError:
+            #empty file (e.g. cut short by a crash while being created)
+            self._file.close()
+            raise
+        self.size = len(self._map)
+        if self.size < HEADER.size:
+            #(cut short by a crash while being created)
+            self.close()
+            raise ValueError('INVALID SPOOL SEGMENT')
+        if size != None:
+            self.end = self.read = HEADER.size
+            self._write_header()
+        else:
+            magic, self.end, self.read = HEADER.unpack_from(self._map)
+            if magic != MAGIC or not HEADER.size <= self.read <= self.end <= self.size:
+                self.close()
+                raise ValueError('INVALID SPOOL SEGMENT')
+
+    def _write_header(self):
+        HEADER.pack_into(self._map, 0, MAGIC, self.end, self.read)
+
+    def append(self, record: bytes):
+        """appends a record, returns False if the segment is full"""
+        end = self.end+RECORD_HEADER.size+len(record)
+        if end > self.size:
+            return False
+        RECORD_HEADER.pack_into(self._map, self.end, len(record))
+        self._map[self.end+RECORD_HEADER.size:end] = record
+        #the record is written before the header points past it
+        self.end = end
+        self._write_header()
+        return True
+
+    def records(self, offset, n):
+        """returns up to n records from the offset, and the offset after them"""
+        records = []
+        while offset < self.end and len(records) < n:
+            length = RECORD_HEADER.unpack_from(self._map, offset)[0]
+            offset += RECORD_HEADER.size
+            records.append(bytes(self._map[offset:offset+length]))
+            offset += length
+        return records, offset
+
+    def unread(self):
+        #number of undelivered records
+        return len(self.records(self.read, self.size)[0])
+
+    def consume(self, offset):
+        self.read = offset
+        self._write_header()
+
+    def is_consumed(self):
+        return self.read == self.end
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def remove(self):
+        #(the file can't be deleted while mapped on windows)
+        self.close()
+        os.remove(self.path)
+
+class AlertSpool:
+    """
+    Bounded, append-only on-disk FIFO of undelivered alerts (JSON serialisable values).
+    alerts are read with peek (oldest first) and only removed by commit, once delivered.
+
+    Attributes:
+        directory (str): directory of the segment files (created if missing)
+        segment_size (int): size of a segment file (bytes)
+        max_bytes (int): cap of the total size of the segments - the oldest are dropped past it
+    """
+    def __init__(self, directory, segment_size=SEGMENT_SIZE, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self._segment_size = segment_size
+        self._max_bytes = max_bytes
+        self._segments = [] #oldest first - the last one is appended to
+        self._next_seq = 0
+        self._peeked = [] #(segment, offset, records) read positions after the last peek
+        self._pending = 0
+        #counters
+        self._spooled = 0
+        self._replayed = 0
+        self._dropped = 0
+        self._dropped_segments = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        #reopens the segments left by a previous run (in order), deleting invalid ones. files
+        #named like segments but without a sequence number (leftover/renamed) are left alone
+        names = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            if name[:-len(SEGMENT_SUFFIX)].isdigit():
+                names.append(name)
+            else:
+                logger.info(f"skipping spool file {name} (not a spool segment name)")
+        names.sort(key=lambda name: int(name[:-len(SEGMENT_SUFFIX)]))
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                segment = SpoolSegment(path)
+            except ValueError:
+                os.remove(path)
+                continue
+            if segment.is_consumed():
+                segment.remove()
+                continue
+            self._segments.append(segment)
+            self._pending += segment.unread()
+        if names:
+            self._next_seq = int(names[-1][:-len(SEGMENT_SUFFIX)])+1
+
+    def _new_segment(self, record_size):
+        #opens the next segment (big enough for the record), dropping the oldest past the cap
+        size = max(self._segment_size, HEADER.size+RECORD_HEADER.size+record_size)
+        while self._segments and self.size()+size > self._max_bytes:
+            oldest = self._segments.pop(0)
+            unread = oldest.unread()
+            self._pending -= unread
+            self._dropped += unread
+            self._dropped_segments += 1
+            oldest.remove()
+        if self._segments:
+            self._segments[-1].flush()
+        path = os.path.join(self.directory, f"{self._next_seq:010d}{SEGMENT_SUFFIX}")
+        self._next_seq += 1
+        segment = SpoolSegment(path, size)
+        self._segments.append(segment)
+        return segment
+
+    def append(self, alerts):
+        """spools a list of alerts"""
+        for alert in alerts:
+            record = json.dumps(alert).encode()
+            if not self._segments or not self._segments[-1].append(record):
+                self._new_segment(len(record)).append(record)
+            self._pending += 1
+            self._spooled += 1
+
+    def peek(self, n):
+        """returns up to n of the oldest undelivered alerts (they stay spooled until commit)"""
+        alerts = []
+        self._peeked = []
+        for segment in self._segments:
+            if len(alerts) >= n:
+                break
+            records, offset = segment.records(segment.read, n-len(alerts))
+            alerts += [json.loads(record) for record in records]
+            self._peeked.append((segment, offset, len(records)))
+        return alerts
+
+    def commit(self):
+        """removes the alerts of the last peek (delivered), deleting the segments read to the end"""
+        for segment, offset, delivered in self._peeked:
+            if segment not in self._segments:
+                continue
+            segment.consume(offset)
+            self._pending -= delivered
+            self._replayed += delivered
+            if segment.is_consumed():
+                self._segments.remove(segment)
+                segment.remove()
+        self._peeked = []
+
+    def pending(self):
+        """number of undelivered alerts"""
+        return self._pending
+
+    def size(self):
+        """total size of the segment files (bytes)"""
+        return sum(segment.size for segment in self._segments)
+
+    def flush(self):
+        #writes the last segment's changes to disk (the earlier ones were flushed when it was opened)
+        if self._segments:
+            self._segments[-1].flush()
+
+    def close(self):
+        for segment in self._segments:
+            segment.flush()
+            segment.close()
+        self._segments = []
+
+    def stats(self):
+        return {
+            'pending': self._pending,
+            'bytes': self.size(),
+            'segments': len(self._segments),
+            'spooled': self._spooled,
+            'replayed': self._replayed,
+            'dropped': self._dropped,
+            'dropped_segments': self._dropped_segments,
+        }
@@ -1,7 +1,10 @@
 import signal
+import struct
 import subprocess
+import time
+from contextlib import contextmanager
 import numpy as np
-import pickle
+from cygnet_modules.scaler import FeatureScaler
 
 #exit codes
 EXIT_SUCCESS = 0 
@@ -14,6 +17,10 @@ AUTH_FAILURE = "FAIL"
 #bytes for socket.recv to recieve 
 RECV_SIZE = 1024
 
+#framing of the endpoint<->server messages - a 4 byte (big endian) payload length + the payload
+FRAME_HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 16*1024*1024
+
 #Process handling
 class Terminator:
     """
@@ -50,10 +57,86 @@ def terminate_external_process(proc: subprocess.Popen):
             return False
     return False
 
+#Startup profiling
+class StartupTimer:
+    """
+    Records how long each startup phase (import, model loading, ...) took, and when
+    milestones (e.g. first packet processed) were reached relative to the launch time.
+    Milestones use wall-clock time, so they can be marked in child processes too.
+
+    Attributes:
+        origin (float): time.time() of the launch (defaults to the timer's creation)
+        phases (list): (name, seconds) of the timed phases, in order
+        marks (list): (name, seconds since origin) of the reached milestones
+    """
+    def __init__(self, origin=None):
+        self.origin = time.time() if origin == None else origin
+        self.phases = []
+        self.marks = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter()-start))
+
+    def mark(self, name):
+        elapsed = time.time()-self.origin
+        self.marks.append((name, elapsed))
+        return elapsed
+
+    def report(self, logger, title='startup'):
+        """writes the phase durations and milestones to the logger"""
+        for name, seconds in self.phases:
+            logger.info("%s phase %s: %.3fs", title, name, seconds)
+        for name, elapsed in self.marks:
+            logger.info("%s %s at +%.3fs", title, name, elapsed)
+
+#Framing
+def send_frame(sock, payload: bytes):
+    """sends the payload as one length-prefixed frame"""
+    if len(payload) > MAX_FRAME_SIZE:
+        raise Exception('FRAME TOO LARGE')
+    sock.sendall(FRAME_HEADER.pack(len(payload))+payload)
+
+def recv_exact(sock, size):
+    """receives exactly size bytes (looping over partial reads), or None if the connection closed first"""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = sock.recv(min(remaining, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+def recv_frame(sock):
+    """
+    receives the next frame's payload - reads are repeated until the whole frame arrived,
+    however the stream was split or coalesced. returns None once the connection closed
+    """
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if header == None:
+        return None
+    size = FRAME_HEADER.unpack(header)[0]
+    if size > MAX_FRAME_SIZE:
+        raise Exception('FRAME TOO LARGE')
+    payload = recv_exact(sock, size)
+    if payload == None:
+        raise Exception('CONNECTION CLOSED MID FRAME')
+    return payload
+
 #DataOps
 def rmse(y_true, y_pred):
     return np.sqrt(np.mean(np.square(y_true-y_pred)))
 
+def rmse_rows(y_true, y_pred):
+    #per-row (per-sample) rmse of a batch
+    return np.sqrt(np.mean(np.square(y_true-y_pred), axis=1))
+
 def get_numericals_categoricals(data):
     numericals = np.zeros((len(data),6), dtype=np.float64)
     categoricals = np.zeros((len(data),2), dtype=np.float64)
@@ -62,10 +145,13 @@ def get_numericals_categoricals(data):
         categoricals[i]=data[i][6:]
     return numericals, categoricals
 
+#loaded scalers by path (each scaler file is loaded once per process)
+_scalers = {}
+
 def scale_test_data(data, scaler_path):
     #scaling data using the trained scaler
-    numericals, categoricals = get_numericals_categoricals(data)
-    with open(scaler_path, 'rb') as f:
-        scaler = pickle.load(f)
-    scaled_numericals = scaler.transform(numericals)
-    return np.concatenate([scaled_numericals, categoricals], axis=1)
\ No newline at end of file
+    scaler = _scalers.get(scaler_path)
+    if scaler == None:
+        scaler = FeatureScaler.load(scaler_path)
+        _scalers[scaler_path] = scaler
+    return scaler.transform(np.asarray(data, dtype=np.float64))
\ No newline at end of file
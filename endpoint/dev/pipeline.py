@@ -0,0 +1,113 @@
+"""
+Configuration and building blocks of the detection pipeline (NetworkCollector -> DCA -> LymphNode)
+shared by the endpoint (client_main) and the offline replay (replay_main) - the models, the
+signal extractor and the stages' settings. importing it has no side effects (no output
+redirection, no logging setup), the models are only loaded in the process that uses them.
+"""
+import os
+from cygnet_modules import utils as cyg
+from cygnet_modules import immune
+from cygnet_modules.models import ModelRegistry, KERAS_BACKEND, NUMPY_BACKEND
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+PAMP_MODEL_PATH = CURDIR+"/assets/models/dae3_benign"
+SAFE_MODEL_PATH = CURDIR+"/assets/models/dae3_malicious"
+#numpy backend weights (exported from the SavedModels by training/dae.py)
+PAMP_WEIGHTS_PATH = CURDIR+"/assets/models/dae3_benign.npz"
+SAFE_WEIGHTS_PATH = CURDIR+"/assets/models/dae3_malicious.npz"
+#inference backend - NUMPY_BACKEND doesn't import tensorflow at all
+MODEL_BACKEND = NUMPY_BACKEND
+#flow table lifecycle (seconds/entries)
+FLOW_IDLE_TIMEOUT = 60.0
+FLOW_ACTIVE_TIMEOUT = 1800.0
+MAX_FLOWS = 65536
+#flow update emission (coalescing) - every Nth packet, at most once per T ms and only on a
+#relative feature change above the delta, per flow (final states are always emitted). the
+#defaults emit every update - coalescing changes what the DCA sees, so it is opt-in
+EMIT_EVERY_N = 1
+EMIT_MIN_INTERVAL_MS = 0.0
+EMIT_MIN_DELTA = 0.0
+#antigens a DC samples before migrating, and the MCAV above which an antigen is anomalous
+MAX_ANTIGENS = 5
+ANOMALY_THRESHOLD = 0.65
+#micro-batching of the DCA's signal extraction
+DCA_BATCH_SIZE = 64
+DCA_BATCH_TIMEOUT_MS = 5
+#shared memory ring capacities - flow updates per DCA worker ring, DC migrations
+RING_CAPACITY = 65536
+MIGRATION_RING_CAPACITY = 4096
+#lymph node antigen profiles - memory cap (bytes), idle ttl and counter half life (seconds)
+PROFILE_MAX_BYTES = 16*1024*1024
+PROFILE_TTL = 3600.0
+PROFILE_HALF_LIFE = 600.0
+#seconds between the metrics snapshots of an instrumented stage
+METRICS_INTERVAL = 10.0
+
+#the trained autoencoders - loaded once per (DCA) process
+if MODEL_BACKEND == NUMPY_BACKEND:
+    MODELS = ModelRegistry({'pamp': PAMP_WEIGHTS_PATH, 'safe': SAFE_WEIGHTS_PATH},
+                           backend=NUMPY_BACKEND)
+else:
+    MODELS = ModelRegistry({'pamp': PAMP_MODEL_PATH, 'safe': SAFE_MODEL_PATH},
+                           backend=KERAS_BACKEND)
+
+def safe_extraction(data):
+    """
+    extracting safe signal value from reconstruction by autoencoder trained on malicious samples.
+    the higher the RMSE value, the stronger indication input is benign
+    """
+    m = MODELS.get('safe') # m -> compiled trained autoencoder
+    reconstructed = m(data)
+    error_rate = cyg.rmse(data, reconstructed)
+    return error_rate
+
+def pamp_extraction(data):
+    """
+    extracting pamp signal value from reconstruction by autoencoder trained on benign samples.
+    the higher the RMSE value, the stronger indication the input is malicious
+    """
+    m = MODELS.get('pamp') # m -> compiled trained autoencoder
+    reconstructed = m(data)
+    error_rate = cyg.rmse(data, reconstructed)
+    return error_rate
+
+def safe_extraction_batch(data):
+    #batched safe_extraction - (N, 8) batch -> (N,) per-row RMSE values
+    return cyg.rmse_rows(data, MODELS.get('safe')(data))
+
+def pamp_extraction_batch(data):
+    #batched pamp_extraction - (N, 8) batch -> (N,) per-row RMSE values
+    return cyg.rmse_rows(data, MODELS.get('pamp')(data))
+
+def pamp_safe_extraction(data):
+    """
+    extracting the pamp and safe signals together, in one fused pass of both autoencoders
+    (numpy backend) - (N, 8) batch -> (N, 2) per-row RMSE values [pamp, safe]
+    """
+    return MODELS.get_fused(['pamp', 'safe'])(data)
+pamp_safe_extraction.n_signals = 2
+
+def load_models():
+    #loading + warming up the models when the DCA process starts (reports the timings to the log)
+    MODELS.load_all()
+    if MODEL_BACKEND == NUMPY_BACKEND:
+        MODELS.get_fused(['pamp', 'safe'])
+
+def signal_extractor():
+    if MODEL_BACKEND == NUMPY_BACKEND:
+        return immune.SignalExtractor(
+            [pamp_safe_extraction],
+            initialiser=load_models,
+            batch_funcs=[pamp_safe_extraction],
+        )
+    return immune.SignalExtractor(
+        [pamp_extraction, safe_extraction],
+        initialiser=load_models,
+        batch_funcs=[pamp_extraction_batch, safe_extraction_batch],
+    )
+
+def release_rings(transports):
+    #frees the shared memory of the rings (queues need no cleanup)
+    for transport in transports:
+        if hasattr(transport, 'release'):
+            transport.release()
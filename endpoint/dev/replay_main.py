@@ -0,0 +1,203 @@
+"""
+Offline replay of pcap/pcapng captures through the detection pipeline
+(NetworkCollector -> DCA -> LymphNode), without capturing live traffic or contacting the server.
+The alerts are written to a JSON lines file and the per-stage throughput/latency stats to a JSON file.
+
+usage: python replay_main.py capture.pcap [capture2.pcapng ...] [--speed 0] [--workers 1]
+                             [--alerts alerts.jsonl] [--stats stats.json] [--metrics metrics_dir]
+"""
+import argparse
+import json
+import queue
+import sys
+import time
+from multiprocessing import Process, Queue, freeze_support
+import pipeline
+from cygnet_modules import utils as cyg
+from cygnet_modules import immune
+from cygnet_modules import rawcapture
+from cygnet_modules.profiles import ProfileStore
+from cygnet_modules.ringbuffer import FlowUpdateRing, MigrationRing, BLOCK
+from cygnet_modules.networkcapture import NetworkCollector
+from cygnet_modules.flowtable import FlowTable
+from cygnet_modules.emission import EmissionPolicy
+from cygnet_modules.metrics import Metrics, read_snapshots, stage_durations
+
+def dump_metrics(stage):
+    #final metrics snapshot of a stage (if instrumented)
+    if stage.get_metrics() != None:
+        stage.get_metrics().dump()
+
+def run_collector(collector: NetworkCollector, paths, speed, outputs, stats_queue):
+    #collector process target - replays the captures, then ends the DCA inputs
+    start = time.perf_counter()
+    for i, path in enumerate(paths):
+        source = rawcapture.PacedSource(rawcapture.PcapSource(path), speed)
+        #the flows are only flushed (final vectors emitted) at the end of the last capture
+        collector.process_source(source, flush=i == len(paths)-1)
+    elapsed = time.perf_counter()-start
+    for output in outputs:
+        output.put(None)
+    stats = collector.stats()
+    stats['seconds'] = elapsed
+    stats['packets_per_sec'] = stats['packets']/elapsed if elapsed > 0 else 0.0
+    dump_metrics(collector)
+    stats_queue.put(('collector', stats))
+
+def run_dca(dca: immune.DCA, name, stats_queue):
+    #DCA process target - runs until its input ends
+    start = time.perf_counter()
+    dca.start()
+    stats = dca.stats()
+    stats['seconds'] = time.perf_counter()-start
+    dump_metrics(dca)
+    stats_queue.put((name, stats))
+
+def run_lymph_node(lymph_node: immune.LymphNode, stats_queue):
+    #lymph node process target - runs until the None sentinel
+    start = time.perf_counter()
+    lymph_node.start()
+    stats = lymph_node.stats()
+    stats['seconds'] = time.perf_counter()-start
+    dump_metrics(lymph_node)
+    stats_queue.put(('lymph_node', stats))
+
+def drain_alerts(alert_queue, out, timeout):
+    #writes the pending alerts as JSON lines, returns how many were written
+    n = 0
+    while True:
+        try:
+            flow = alert_queue.get(timeout=timeout)
+        except queue.Empty:
+            return n
+        if isinstance(flow, dict):
+            #traced alert - the flow key, trace id and per-stage durations
+            stamps = flow['stamps']
+            stamps['sent'] = time.monotonic()
+            out.write(json.dumps({'time': time.time(), 'flow': flow['flow'], 'trace_id': flow['trace_id'],
+                                  'stages_ms': stage_durations(stamps)})+'\n')
+        else:
+            out.write(json.dumps({'time': time.time(), 'flow': flow})+'\n')
+        n += 1
+        timeout = 0
+
+def replay(paths, speed=0.0, workers=1, alerts_path='alerts.jsonl', stats_path='replay_stats.json',
+           metrics_dir=None):
+    """
+    replays the captures through the pipeline (speed 0 -> as fast as possible, otherwise
+    at the captures' timestamps sped up by speed) and writes the alerts and stats.
+    with a metrics_dir, the stages are instrumented (trace stamps, latency histograms) and
+    their metrics snapshots are added to the stats. returns the stats
+    """
+    def stage_metrics(name):
+        return None if metrics_dir == None else Metrics(name, metrics_dir, pipeline.METRICS_INTERVAL)
+
+    #replay is lossless - full rings make the collector wait rather than drop updates
+    dca_inputs = [FlowUpdateRing(pipeline.RING_CAPACITY, BLOCK, stamped=metrics_dir != None)
+                  for _ in range(workers)]
+    if workers == 1:
+        dca_output = MigrationRing(pipeline.MAX_ANTIGENS, capacity=pipeline.MIGRATION_RING_CAPACITY,
+                                   policy=BLOCK)
+    else:
+        dca_output = Queue()
+    alert_queue = Queue()
+    stats_queue = Queue()
+
+    profiles = ProfileStore(max_bytes=pipeline.PROFILE_MAX_BYTES, ttl=pipeline.PROFILE_TTL,
+                            half_life=pipeline.PROFILE_HALF_LIFE)
+    lymph_node = immune.LymphNode(pipeline.ANOMALY_THRESHOLD, dca_output, alert_queue, profiles=profiles,
+                                  metrics=stage_metrics('lymph_node'))
+    lymph_node_process = Process(target=run_lymph_node, args=(lymph_node, stats_queue), name="LymphNode")
+    dca_processes = []
+    sig_extractor = pipeline.signal_extractor()
+    for worker, dca_input in enumerate(dca_inputs):
+        name = "DCA" if workers == 1 else f"DCA-{worker}"
+        dca = immune.DCA(
+            dca_input,
+            dca_output,
+            population_size=5,
+            migration_range=(5,15),
+            max_antigens=pipeline.MAX_ANTIGENS,
+            csm_weights=[2,2],
+            k_weights=[2,-2],
+            segment_size=20,
+            signal_extractor=sig_extractor,
+            in_signal=2,
+            batch_size=pipeline.DCA_BATCH_SIZE,
+            batch_timeout_ms=pipeline.DCA_BATCH_TIMEOUT_MS,
+            metrics=stage_metrics(name.lower()),
+        )
+        dca_processes.append(Process(target=run_dca, args=(dca, name.lower(), stats_queue), name=name))
+    collector = NetworkCollector(
+        bpf_filter=None,
+        network_flows=FlowTable(
+            idle_timeout=pipeline.FLOW_IDLE_TIMEOUT,
+            active_timeout=pipeline.FLOW_ACTIVE_TIMEOUT,
+            max_flows=pipeline.MAX_FLOWS,
+        ),
+        stdout=dca_inputs[0] if workers == 1 else dca_inputs,
+        emission=EmissionPolicy(pipeline.EMIT_EVERY_N, pipeline.EMIT_MIN_INTERVAL_MS, pipeline.EMIT_MIN_DELTA),
+        metrics=stage_metrics('collector'),
+    )
+    collector_process = Process(target=run_collector,
+                                args=(collector, paths, speed, dca_inputs, stats_queue), name="Collector")
+
+    start = time.perf_counter()
+    lymph_node_process.start()
+    for process in dca_processes:
+        process.start()
+    collector_process.start()
+    n_alerts = 0
+    with open(alerts_path, 'w') as alerts:
+        #the stages end in pipeline order - the lymph node is ended once every DCA is done
+        for process in [collector_process, *dca_processes]:
+            while process.is_alive():
+                n_alerts += drain_alerts(alert_queue, alerts, 0.1)
+            process.join()
+        dca_output.put(None)
+        while lymph_node_process.is_alive():
+            n_alerts += drain_alerts(alert_queue, alerts, 0.1)
+        lymph_node_process.join()
+        n_alerts += drain_alerts(alert_queue, alerts, 0)
+    elapsed = time.perf_counter()-start
+
+    stages = {}
+    for _ in range(len(dca_processes)+2):
+        name, stage_stats = stats_queue.get(timeout=10)
+        stages[name] = stage_stats
+    stats = {
+        'captures': list(paths),
+        'speed': speed,
+        'workers': workers,
+        'seconds': elapsed,
+        'packets_per_sec': stages['collector']['packets']/elapsed if elapsed > 0 else 0.0,
+        'alerts': n_alerts,
+        'stages': stages,
+        'transport': {'dca_inputs': [ring.stats() for ring in dca_inputs]},
+    }
+    if metrics_dir != None:
+        stats['metrics'] = read_snapshots(metrics_dir)
+    with open(stats_path, 'w') as f:
+        json.dump(stats, f, indent=2)
+    pipeline.release_rings([*dca_inputs, dca_output])
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="replays captures through the detection pipeline")
+    parser.add_argument('captures', nargs='+', help="pcap/pcapng files, replayed in order")
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help="replay speed multiplier of the capture timestamps (0 -> as fast as possible)")
+    parser.add_argument('--workers', type=int, default=1, help="number of DCA worker processes")
+    parser.add_argument('--alerts', default='alerts.jsonl', help="alerts output file (JSON lines)")
+    parser.add_argument('--stats', default='replay_stats.json', help="stats output file (JSON)")
+    parser.add_argument('--metrics', default=None,
+                        help="instruments the stages, writing their latency metrics to this directory")
+    args = parser.parse_args()
+    stats = replay(args.captures, args.speed, args.workers, args.alerts, args.stats, args.metrics)
+    print(f"{stats['stages']['collector']['packets']} packets in {stats['seconds']:.2f}s "
+          f"({stats['packets_per_sec']:.0f} packets/s), {stats['alerts']} alerts")
+    return cyg.EXIT_SUCCESS
+
+if __name__=="__main__":
+    freeze_support()
+    sys.exit(main())
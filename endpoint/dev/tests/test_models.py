@@ -0,0 +1,44 @@
+"""
+parity of the numpy inference backend (the exported assets/models/*.npz weights) with the
+SavedModels it was exported from, and of the fused evaluator with separate numpy passes.
+the SavedModel checks are skipped when tensorflow isn't installed
+
+usage: python -m pytest endpoint/dev/tests
+"""
+import os
+import sys
+import numpy as np
+import pytest
+
+ENDPOINT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ENDPOINT_DIR not in sys.path:
+    sys.path.insert(0, ENDPOINT_DIR)
+from cygnet_modules import utils
+from cygnet_modules.models import NumpyAutoencoder, FusedAutoencoders, CompiledModel, load_keras_model
+
+MODELS_DIR = ENDPOINT_DIR+"/assets/models"
+MODELS = ['dae3_benign', 'dae3_malicious']
+ATOL = 1e-10
+
+def sample(n=4096, seed=123):
+    #random scaled numericals, and every one-hot protocol
+    rng = np.random.default_rng(seed)
+    return np.concatenate([rng.normal(size=(n, 6)), np.eye(2)[rng.integers(0, 2, n)]], axis=1)
+
+@pytest.mark.parametrize('name', MODELS)
+def test_numpy_matches_saved_model(name):
+    pytest.importorskip('tensorflow')
+    data = sample()
+    expected = CompiledModel(load_keras_model(f"{MODELS_DIR}/{name}"))(data)
+    reconstructed = NumpyAutoencoder.load(f"{MODELS_DIR}/{name}.npz")(data)
+    np.testing.assert_allclose(reconstructed, expected, rtol=0, atol=ATOL)
+
+def test_fused_matches_separate_passes():
+    data = sample()
+    models = [NumpyAutoencoder.load(f"{MODELS_DIR}/{name}.npz") for name in MODELS]
+    fused = FusedAutoencoders(models)
+    reconstructions = fused.reconstruct(data)
+    for i, model in enumerate(models):
+        np.testing.assert_allclose(reconstructions[i], model(data), rtol=0, atol=ATOL)
+    expected = np.stack([utils.rmse_rows(data, model(data)) for model in models], axis=1)
+    np.testing.assert_allclose(fused(data), expected, rtol=0, atol=ATOL)
@@ -1,3 +1,4 @@
+import base64
 import json
 import smtplib
 from email.message import EmailMessage
@@ -5,14 +6,27 @@ import socket
 import threading
 import sys
 import os
+import time
 from cygnet_modules import alerts
 from cygnet_modules import utils as cyg
-from cygnet_modules.encryption import CygCrypt
+from cygnet_modules.encryption import (CygCrypt, SessionTickets, negotiate_cipher, load_ticket_key,
+    TICKET_LIFETIME, RESUMPTION_NONCE_SIZE)
+from cygnet_modules.metrics import Metrics, serve_metrics
 
 CURDIR = os.path.dirname(os.path.abspath(__file__))
 
 CONF_PATH = CURDIR+"/configuration/config.json"
 APP_MAIL_JSON = CURDIR+"/configuration/app_mail.json"
+#alert latency instrumentation - histograms dumped to METRICS_DIR every METRICS_INTERVAL
+#seconds and served on localhost:METRICS_PORT/metrics (None -> not served)
+METRICS_ENABLED = False
+METRICS_DIR = CURDIR+"/metrics"
+METRICS_INTERVAL = 10.0
+METRICS_PORT = None
+#session resumption - the ticket key is kept in TICKET_KEY_PATH, so the endpoints' tickets
+#survive a server restart (and they reconnect without a key exchange)
+TICKET_KEY_PATH = CURDIR+"/configuration/ticket.key"
+TICKET_LIFETIME_SECONDS = TICKET_LIFETIME
 
 #redirecting stdout and stderr to null, to avoid output
 sys.stdout = open(os.devnull, 'w')
@@ -35,7 +49,7 @@ class Endpoint:
         self._client_socket.close()
 
 class AlertServer:
-    def __init__(self, host, port, config_file):
+    def __init__(self, host, port, config_file, metrics: Metrics=None, tickets: SessionTickets=None):
         self._host = host
         self._port = port
         self._endpoints = {}
@@ -43,6 +57,9 @@ class AlertServer:
         self._server_socket = None
         self._threads = [] #list of active threads 
         self._email_address = None #email address of the server (updated when connecting to smtp)
+        self._metrics = metrics #(shared by the client threads - recorded under the lock)
+        self._metrics_lock = threading.Lock()
+        self._tickets = tickets #issues/redeems resumption tickets (None -> no resumption)
     
     def smtp_login(self):
         """logging in to the SMTP server using the app email credentials"""
@@ -95,7 +112,7 @@ class AlertServer:
 
         try:
             #recieves authentication key and processes it
-            authentication = client_socket.recv(cyg.RECV_SIZE)
+            authentication = cyg.recv_frame(client_socket)
             credentials = json.loads(authentication.decode())
             authenticated = self.authenticate(credentials)
             if authenticated:
@@ -103,7 +120,11 @@ class AlertServer:
                                     client_address[0],
                                     credentials['hostname'])
                 self._endpoints[threading.current_thread()] = endpoint
-                self.send_authentication_result(client_socket, True)
+                #session cipher - the first of the endpoint's offered ciphers the server supports
+                #(endpoints that offer none get fernet and the plain success reply)
+                offered = credentials.get('ciphers')
+                cipher = negotiate_cipher(offered)
+                self.send_authentication_result(client_socket, True, cipher if offered else None)
             else:
                 self.send_authentication_result(client_socket, False)
                 return
@@ -111,29 +132,49 @@ class AlertServer:
             self.send_authentication_result(client_socket, False)
             return
         
-        #sends email to inform admins a new endpoint connected to the system
+        crypt = CygCrypt()
+        try:
+            if 'public_key' in credentials:
+                #the endpoint's public key (and ticket) came with the credentials - the handshake
+                #reply completes the key exchange without another round trip
+                handshake = self.handshake(crypt, credentials, cipher)
+                cyg.send_frame(client_socket, json.dumps(handshake).encode())
+            else:
+                #setting up encryption with diffie-hellman exchange
+                crypt.generate_keys() 
+                public_key = crypt.serialised_public_key()
+                client_public_key = cyg.recv_frame(client_socket) #getting client public key
+                crypt.shared_secret(client_public_key, cipher, initiator=False) #computing encryption key
+                cyg.send_frame(client_socket, public_key) #sending the client the server's public key
+        except Exception:
+            #malformed handshake (missing/invalid key, ticket or nonce) or connection lost
+            del self._endpoints[threading.current_thread()]
+            endpoint.close()
+            return
+
+        #sends email to inform admins a new endpoint connected to the system - after the
+        #handshake reply, so the (synchronous) smtp doesn't delay it past the endpoint's timeout
         self.send_emails(self.get_admins(), msg=f"{endpoint.get_name()} on \
                           ({endpoint.get_address} connected to the system", 
                           subject="New endpoint connected")
-        
-        #setting up encryption with diffie-hellman exchange
-        crypt = CygCrypt()
-        crypt.generate_keys() 
-        public_key = crypt.serialised_public_key()
-        client_public_key = client_socket.recv(cyg.RECV_SIZE) #getting client public key
-        crypt.shared_secret(client_public_key) #computing encryption key
-        client_socket.send(public_key) #sending the client the server's public key
 
         while True:
             try:
-                data = client_socket.recv(cyg.RECV_SIZE)
-                if not data:
+                #each frame carries a batch of alerts
+                data = cyg.recv_frame(client_socket)
+                if data == None:
                     break
+                received = time.monotonic()
                 decrypted = crypt.decrypt_msg(data)
                 name = endpoint.get_name()
-                alert = self.process_alert(endpoint.get_address(), name, 
-                                            decrypted) #processing and formatting the alert from the endpoint
-                self.send_alert(alert) #sending the alerts to the admins
+                batch = self.process_alerts(endpoint.get_address(), name, 
+                                            decrypted) #processing and formatting the alerts from the endpoint
+                processed = time.monotonic()
+                for alert in batch:
+                    start = time.monotonic()
+                    self.send_alert(alert) #sending the alerts to the admins
+                    if self._metrics != None:
+                        self.observe_alert(alert, received, processed, start)
             except:
                 break
 
@@ -176,13 +217,74 @@ class AlertServer:
                 return True
         return False
     
-    def send_authentication_result(self, client_socket, success):
+    def handshake(self, crypt: CygCrypt, credentials: dict, cipher):
+        """
+        Sets up the session encryption from the endpoint's credentials - resumes the session
+        of a valid ticket, else completes the key exchange (X25519 or DH, as the endpoint's key).
+
+        Args:
+            crypt (CygCrypt): the session's (server side) encryption
+            credentials (dict): credentials sent by the endpoint - 'public_key', and 'ticket'
+                and 'nonce' (RESUMPTION_NONCE_SIZE bytes) when resuming (base64)
+            cipher (str): the negotiated session cipher
+
+        Returns:
+            dict: the handshake reply - 'resumed', the server's 'nonce' (resumed) or 'public_key',
+                and a new 'ticket' (if resumption is enabled)
+        """
+        hostname = credentials['hostname']
+        handshake = {'resumed': False}
+        secret = None
+        if self._tickets != None and 'ticket' in credentials:
+            secret = self._tickets.redeem(base64.b64decode(credentials['ticket']), hostname)
+        if secret != None:
+            client_nonce = base64.b64decode(credentials['nonce'])
+            if len(client_nonce) != RESUMPTION_NONCE_SIZE:
+                raise ValueError('INVALID NONCE')
+            server_nonce = os.urandom(RESUMPTION_NONCE_SIZE)
+            crypt.resume(secret, client_nonce, server_nonce, cipher, initiator=False)
+            handshake['resumed'] = True
+            handshake['nonce'] = base64.b64encode(server_nonce).decode()
+        else:
+            client_public_key = base64.b64decode(credentials['public_key'])
+            crypt.generate_keys(CygCrypt.key_exchange_of(client_public_key))
+            crypt.shared_secret(client_public_key, cipher, initiator=False)
+            handshake['public_key'] = base64.b64encode(crypt.serialised_public_key()).decode()
+        if self._tickets != None:
+            ticket = self._tickets.issue(crypt.resumption_secret(), hostname)
+            handshake['ticket'] = base64.b64encode(ticket).decode()
+        return handshake
+
+    def send_authentication_result(self, client_socket, success, cipher=None):
+        #"CONN:<cipher>" tells the endpoint the negotiated session cipher
         result = cyg.AUTH_SUCCESS if success else cyg.AUTH_FAILURE
+        if success and cipher != None:
+            result += ':'+cipher
         data = result.encode()
-        client_socket.send(data)
+        cyg.send_frame(client_socket, data)
+
+    def process_alert(self, endpoint_addr, endpoint_name, payload):
+        return alerts.Alert.from_payload(endpoint_addr, endpoint_name, payload)
+
+    def process_alerts(self, endpoint_addr, endpoint_name, message):
+        """returns the alerts of a decrypted batch frame (a JSON list of alert payloads)"""
+        batch = json.loads(message)
+        if not isinstance(batch, list):
+            batch = [batch]
+        return [self.process_alert(endpoint_addr, endpoint_name, payload) for payload in batch]
 
-    def process_alert(self, endpoint_addr, endpoint_name, netflow):
-        return alerts.Alert(endpoint_addr, endpoint_name, netflow)
+    def observe_alert(self, alert: alerts.Alert, received, processed, sending):
+        #server side stages of the alert - network (wall clocks of both machines), processing
+        #of its frame, waiting for the alerts before it in the frame, smtp
+        now = time.monotonic()
+        with self._metrics_lock:
+            metrics = self._metrics
+            if alert.trace != None:
+                metrics.observe('server.network', time.time()-(now-received)-alert.trace['sent'])
+            metrics.observe('server.processing', processed-received)
+            metrics.observe('server.batch_wait', sending-processed)
+            metrics.observe('server.smtp', now-sending)
+            metrics.maybe_dump(now)
 
     def send_email(self, destination_email, body, subject):
         """
@@ -211,5 +313,11 @@ class AlertServer:
         self.send_emails(admins, str(alert), subject)
 
 if __name__=="__main__":
-    server = AlertServer("localhost", 8000, CONF_PATH)
+    metrics = None
+    if METRICS_ENABLED:
+        metrics = Metrics('alert_server', METRICS_DIR, METRICS_INTERVAL)
+        if METRICS_PORT != None:
+            serve_metrics(METRICS_DIR, METRICS_PORT)
+    tickets = SessionTickets(load_ticket_key(TICKET_KEY_PATH), TICKET_LIFETIME_SECONDS)
+    server = AlertServer("localhost", 8000, CONF_PATH, metrics=metrics, tickets=tickets)
     server.start()
\ No newline at end of file
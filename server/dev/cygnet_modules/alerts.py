@@ -1,21 +1,35 @@
 class Alert:
-        def __init__(self, endpoint, endpoint_name, netflow_key):
+        def __init__(self, endpoint, endpoint_name, netflow_key, trace=None):
+            """
+            :param netflow_key: flow key of the alert ("sip:sport-dip:dport")
+            :param trace: the alert's trace - {'trace_id': str, 'stages_ms': {stage: ms}} (None -> untraced)
+            """
             alert = {}
             self.endpoint = endpoint
             self.endpoint_name = endpoint_name
-            temp = netflow_key.split('-')
-            temp[0].split(':')
-            temp[1].split(':')
-            alert['sip']=temp[0][0]
-            alert['sport']=temp[0][1]
-            alert['dip']=temp[1][0]
-            alert['dport']=temp[1][1]
+            self.trace = trace
+            source, destination = netflow_key.split('-')
+            alert['sip'], alert['sport'] = source.rsplit(':', 1)
+            alert['dip'], alert['dport'] = destination.rsplit(':', 1)
             self._alert_msg = f"Threat detected on {self.endpoint_name} ({self.endpoint}) on your network.\n\
                 Source:\nIP - {alert['sip']}, port - {alert['sport']}\n\
                 Destination:\nIP - {alert['dip']}, port - {alert['dport']}"
-        
+            if trace != None:
+                stages = ", ".join(f"{stage} {ms:.1f}ms" for stage, ms in trace['stages_ms'].items())
+                self._alert_msg += f"\nTrace: {trace['trace_id']} ({stages})"
+
+        @staticmethod
+        def from_payload(endpoint, endpoint_name, payload):
+            """
+            builds the alert from a decrypted endpoint message - a JSON flow key string,
+            or a JSON traced alert ({'flow', 'trace_id', 'stages_ms', 'sent'})
+            """
+            if isinstance(payload, dict):
+                return Alert(endpoint, endpoint_name, payload['flow'], payload)
+            return Alert(endpoint, endpoint_name, payload)
+
         def get_alert(self):
             return self._alert_msg
-        
+
         def __str__(self):
-            return self._alert_msg
\ No newline at end of file
+            return self._alert_msg
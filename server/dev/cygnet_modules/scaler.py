@@ -0,0 +1,70 @@
+import numpy as np
+import pickle
+import sys
+
+#the first N_NUMERICALS features are standard-scaled, the rest (proto one-hot) are left as is
+N_NUMERICALS = 6
+
+class FeatureScaler:
+    """
+    The training data's StandardScaler, reduced to its constants and applied as
+    (x - mean) / scale on the numerical columns of a batch. The operations match
+    sklearn's StandardScaler.transform step for step, so the results are bit-for-bit identical,
+    without importing sklearn (unless the scaler is loaded from its pickle).
+
+    Attributes:
+        mean (ndarray): (6,) per-feature mean
+        scale (ndarray): (6,) per-feature scale (standard deviation)
+    """
+    def __init__(self, mean, scale):
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+
+    @staticmethod
+    def from_sklearn(scaler):
+        """takes the constants of a fitted sklearn StandardScaler"""
+        n = scaler.n_features_in_
+        mean = scaler.mean_ if scaler.with_mean and scaler.mean_ is not None else np.zeros(n)
+        scale = scaler.scale_ if scaler.with_std and scaler.scale_ is not None else np.ones(n)
+        return FeatureScaler(mean, scale)
+
+    @staticmethod
+    def load(path):
+        """
+        loads a scaler from a preconverted .npz/.npy file (no sklearn needed),
+        or from the pickled sklearn StandardScaler
+        """
+        if path.endswith('.npz'):
+            with np.load(path) as f:
+                return FeatureScaler(f['mean'], f['scale'])
+        if path.endswith('.npy'):
+            mean, scale = np.load(path)
+            return FeatureScaler(mean, scale)
+        with open(path, 'rb') as f:
+            return FeatureScaler.from_sklearn(pickle.load(f))
+
+    def save(self, path):
+        """saves the constants to a .npz (or (2, 6) .npy) file"""
+        if path.endswith('.npy'):
+            np.save(path, np.stack([self.mean, self.scale]))
+        else:
+            np.savez(path, mean=self.mean, scale=self.scale)
+
+    def transform_inplace(self, batch: np.ndarray):
+        """scales the numerical columns of a float64 (N, 8) batch in place and returns it"""
+        numericals = batch[:, :N_NUMERICALS]
+        numericals -= self.mean
+        numericals /= self.scale
+        return batch
+
+    def transform(self, batch):
+        """returns a scaled float64 copy of the (N, 8) batch"""
+        return self.transform_inplace(np.array(batch, dtype=np.float64))
+
+def convert(pkl_path, out_path):
+    """converts the pickled sklearn scaler to the sklearn-free .npz/.npy format"""
+    FeatureScaler.load(pkl_path).save(out_path)
+
+if __name__ == "__main__":
+    #usage: python -m cygnet_modules.scaler scaler.pkl scaler.npz
+    convert(sys.argv[1], sys.argv[2])
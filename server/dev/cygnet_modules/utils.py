@@ -1,7 +1,8 @@
 import signal
+import struct
 import subprocess
 import numpy as np
-import pickle
+from cygnet_modules.scaler import FeatureScaler
 
 #exit codes
 EXIT_SUCCESS = 0 
@@ -14,6 +15,10 @@ AUTH_FAILURE = "FAIL"
 #bytes for socket.recv to recieve 
 RECV_SIZE = 1024
 
+#framing of the endpoint<->server messages - a 4 byte (big endian) payload length + the payload
+FRAME_HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 16*1024*1024
+
 #ports for the flask apps (on localhost:PORT)
 SERVER_PORT = 5000
 CLIENT_PORT = 5001
@@ -54,6 +59,41 @@ def terminate_external_process(proc: subprocess.Popen):
             return False
     return False
 
+#Framing
+def send_frame(sock, payload: bytes):
+    """sends the payload as one length-prefixed frame"""
+    if len(payload) > MAX_FRAME_SIZE:
+        raise Exception('FRAME TOO LARGE')
+    sock.sendall(FRAME_HEADER.pack(len(payload))+payload)
+
+def recv_exact(sock, size):
+    """receives exactly size bytes (looping over partial reads), or None if the connection closed first"""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = sock.recv(min(remaining, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+def recv_frame(sock):
+    """
+    receives the next frame's payload - reads are repeated until the whole frame arrived,
+    however the stream was split or coalesced. returns None once the connection closed
+    """
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if header == None:
+        return None
+    size = FRAME_HEADER.unpack(header)[0]
+    if size > MAX_FRAME_SIZE:
+        raise Exception('FRAME TOO LARGE')
+    payload = recv_exact(sock, size)
+    if payload == None:
+        raise Exception('CONNECTION CLOSED MID FRAME')
+    return payload
+
 #DataOps
 def rmse(y_true, y_pred):
     return np.sqrt(np.mean(np.square(y_true-y_pred)))
@@ -66,10 +106,13 @@ def get_numericals_categoricals(data):
         categoricals[i]=data[i][6:]
     return numericals, categoricals
 
+#loaded scalers by path (each scaler file is loaded once per process)
+_scalers = {}
+
 def scale_test_data(data, scaler_path):
     #scaling data using the trained scaler
-    numericals, categoricals = get_numericals_categoricals(data)
-    with open(scaler_path, 'rb') as f:
-        scaler = pickle.load(f)
-    scaled_numericals = scaler.transform(numericals)
-    return np.concatenate([scaled_numericals, categoricals], axis=1)
\ No newline at end of file
+    scaler = _scalers.get(scaler_path)
+    if scaler == None:
+        scaler = FeatureScaler.load(scaler_path)
+        _scalers[scaler_path] = scaler
+    return scaler.transform(np.asarray(data, dtype=np.float64))
\ No newline at end of file
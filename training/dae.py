@@ -10,10 +10,19 @@ import os
 import sys
 
 CURDIR = os.path.dirname(os.path.abspath(sys.argv[0]))
+#the endpoint's inference code - exports are loaded and checked with the runtime implementation
+ENDPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'endpoint', 'dev')
+sys.path.append(ENDPOINT_DIR)
+from cygnet_modules.models import NumpyAutoencoder, load_keras_model
 SCALER_PATH = CURDIR+"/assets/scaler.pkl"
+SCALER_NPZ_PATH = CURDIR+"/assets/scaler.npz" #scaler constants for the endpoint (no sklearn needed)
 TRAIN_PATH = CURDIR+"/datasets/unsw_nb15/UNSW_NB15_training-set.csv"
 TEST_PATH = CURDIR+"/datasets/unsw_nb15/UNSW_NB15_testing-set.csv"
 
+#activations of build_autoencoder's Dense layers (legacy SavedModels loaded under keras 3 only
+#expose their weights)
+DENSE_ACTIVATIONS = ('relu', 'relu', 'relu', 'linear')
+
 categorical_feature = 'proto'
 numerical_features = ['spkts', 'dpkts', 'sbytes', 'dbytes', 'smean', 'dmean']
 
@@ -120,7 +129,53 @@ def save_autoencoder(autoencoder: tf.keras.Model, saved_model_path, model_name=N
     autoencoder.save(saved_model_path)
 
 def load_autoencoder(saved_model_path):
-        return tf.keras.models.load_model(saved_model_path)
+    #(legacy SavedModels load through their serving signature under keras 3)
+    return load_keras_model(saved_model_path)
+
+def dense_weights(autoencoder):
+    """
+    returns the (kernels, biases, activations) of the autoencoder's Dense layers - of a keras
+    model, or of a legacy SavedModel loaded through its serving signature (load_keras_model)
+    """
+    if isinstance(autoencoder, tf.keras.Model):
+        dense_layers = [l for l in autoencoder.layers if isinstance(l, tf.keras.layers.Dense)]
+        kernels, biases = zip(*(layer.get_weights() for layer in dense_layers))
+        return list(kernels), list(biases), [l.get_config()['activation'] for l in dense_layers]
+    #the SavedModel's variables - "dense/kernel:0", "dense/bias:0", "dense_1/kernel:0", ...
+    layers = {}
+    for variable in autoencoder.saved_model.trainable_variables:
+        layer, weight = variable.name.split(':')[0].split('/')[-2:]
+        layers.setdefault(layer, {})[weight] = variable.numpy()
+    names = sorted(layers, key=lambda name: int(name.split('_')[1]) if '_' in name else 0)
+    if len(names) != len(DENSE_ACTIVATIONS):
+        raise Exception('UNEXPECTED AUTOENCODER LAYERS')
+    return [layers[n]['kernel'] for n in names], [layers[n]['bias'] for n in names], list(DENSE_ACTIVATIONS)
+
+def export_numpy_weights(autoencoder, npz_path):
+    """
+    exports the Dense layers' weights to a .npz for the endpoint's numpy inference backend.
+    the GaussianNoise layer is inactive at inference, so the Dense layers are the whole network
+    """
+    kernels, biases, activations = dense_weights(autoencoder)
+    arrays = {}
+    for i, (kernel, bias) in enumerate(zip(kernels, biases)):
+        arrays[f'kernel_{i}'] = kernel.astype(np.float64)
+        arrays[f'bias_{i}'] = bias.astype(np.float64)
+    arrays['activations'] = np.array(activations)
+    np.savez(npz_path, **arrays)
+
+def check_numpy_parity(autoencoder, npz_path, n_samples=10000, atol=1e-10):
+    """
+    checks the endpoint's NumpyAutoencoder, loaded from the exported weights, reproduces
+    the model's reconstructions (float64 tolerance) - on random scaled numericals and
+    every one-hot protocol. returns (parity, max abs error)
+    """
+    rng = np.random.default_rng(123)
+    data = np.concatenate([rng.normal(size=(n_samples, 6)),
+                           np.eye(2)[rng.integers(0, 2, n_samples)]], axis=1)
+    expected = np.asarray(autoencoder(tf.constant(data, dtype=tf.float64), training=False))
+    max_error = np.max(np.abs(NumpyAutoencoder.load(npz_path)(data)-expected))
+    return max_error <= atol, max_error
         
 def main(model_name):
     scaler = StandardScaler()
@@ -130,6 +185,7 @@ def main(model_name):
     scaled_data = scale_data(data, scaler) 
     with open(SCALER_PATH, 'wb') as f:
         pickle.dump(scaler, f)
+    np.savez(SCALER_NPZ_PATH, mean=scaler.mean_, scale=scaler.scale_)
     train_data, validation_data = train_test_split(scaled_data, test_size=0.2, random_state=123)
     #cleaning test data
     test_data = prep_data_without_scaling(TEST_PATH, malicious_only=False, benign_only=True)
@@ -154,6 +210,24 @@ def main(model_name):
             autoencoder=autoencoder,
             saved_model_path=f"{CURDIR}/assets/dae_saved_model/{model_name}"
         )
+        export(autoencoder, f"{CURDIR}/assets/dae_saved_model/{model_name}.npz")
+
+def export(autoencoder, npz_path):
+    export_numpy_weights(autoencoder, npz_path)
+    check(autoencoder, npz_path)
+
+def check(autoencoder, npz_path):
+    parity, max_error = check_numpy_parity(autoencoder, npz_path)
+    print(f"numpy export: {npz_path} (max abs error {max_error:.3g})")
+    if not parity:
+        raise Exception('NUMPY EXPORT DOES NOT MATCH THE MODEL')
 
 if __name__=="__main__":
-    main(model_name="dae3")
\ No newline at end of file
+    if len(sys.argv) == 4 and sys.argv[1] == 'export':
+        #exporting an existing SavedModel: python dae.py export <saved_model_dir> <out.npz>
+        export(load_autoencoder(sys.argv[2]), sys.argv[3])
+    elif len(sys.argv) == 4 and sys.argv[1] == 'check':
+        #checking an exported .npz against its SavedModel: python dae.py check <saved_model_dir> <weights.npz>
+        check(load_autoencoder(sys.argv[2]), sys.argv[3])
+    else:
+        main(model_name="dae3")
\ No newline at end of file